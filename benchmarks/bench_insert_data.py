@@ -0,0 +1,42 @@
+"""
+Compare the row-by-row ORM loader with the COPY-based bulk loader.
+
+Usage (from the repository root, with config.py in place):
+
+    python benchmarks/bench_insert_data.py path/to/hotel_bookings_clean.csv
+
+Rows inserted by each run are deleted again afterwards, so the benchmark can be
+pointed at the development database.
+"""
+import sys, time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+from sqlalchemy import func
+from models import SessionLocal, HotelBooking, create_tables, insert_data, insert_data_orm
+
+
+def run(loader, data_path):
+    db = SessionLocal()
+    try:
+        max_id = db.query(func.max(HotelBooking.id)).scalar() or 0
+        start_time = time.perf_counter()
+        loader(db=db, data_path=data_path)
+        elapsed = time.perf_counter() - start_time
+        rows = db.query(HotelBooking).filter(HotelBooking.id > max_id).count()
+        db.query(HotelBooking).filter(HotelBooking.id > max_id).delete(synchronize_session=False)
+        db.commit()
+        return rows, elapsed
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    data_path = sys.argv[1]
+    create_tables()
+    # Deduplication is off for the COPY loader, the development database usually holds the same rows already
+    copy_loader = lambda db, data_path: insert_data(db=db, data_path=data_path, dedupe=False)
+    for name, loader in [('orm', insert_data_orm), ('copy', copy_loader)]:
+        rows, elapsed = run(loader, data_path)
+        print(f'{name:>5}: {rows} rows in {elapsed:.2f} sec ({rows / elapsed:,.0f} rows/sec)')
@@ -0,0 +1,59 @@
+"""
+Compare scored match queries with the mapping-aware filter-context compiler on
+repeated dashboard-style searches.
+
+Usage (from the repository root, with config.py in place and the index loaded):
+
+    python benchmarks/bench_search_filter_context.py [rounds]
+
+Each mode starts from cleared index caches and runs every query `rounds` times,
+so the filter-context numbers include the benefit of the node query cache.
+"""
+import sys, time, statistics
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+from config import ELASTICSEARCH_SETTINGS, ES_INDEX_NAME
+from elasticsearch_operations import ElasticsearchService, build_search_query
+
+# The kind of parameter sets the search tab and dashboard drill-downs send
+QUERIES = [
+    {'hotel': 'City Hotel', 'is_canceled': 1},
+    {'hotel': 'Resort Hotel', 'arrival_date_month': 'August'},
+    {'country': 'Portugal', 'is_canceled': 0, 'range_fields': {'arrival_date': {'gte': '2016-01-01', 'lt': '2017-01-01'}}},
+    {'market_segment': 'Online TA', 'customer_type': 'Transient', 'is_repeated_guest': 0},
+    {'deposit_type': 'Non Refund', 'exclude_fields': {'reservation_status': 'Check-Out'}},
+]
+PAGE_SIZE = 100
+
+
+def run(es_service, properties, rounds):
+    es_service.es.indices.clear_cache(index=ES_INDEX_NAME)
+    latencies, took = [], []
+    for _ in range(rounds):
+        for params in QUERIES:
+            body = build_search_query(params, properties)
+            body['size'] = PAGE_SIZE
+            start_time = time.perf_counter()
+            response = es_service.es.search(index=ES_INDEX_NAME, body=body, request_cache=False)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            took.append(response['took'])
+    return latencies, took
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    es_service = ElasticsearchService(ELASTICSEARCH_SETTINGS)
+    properties = es_service.get_index_properties(ES_INDEX_NAME)
+    # Without properties every condition compiles to a scored match, the previous behaviour
+    for name, mode_properties in [('match', None), ('filter', properties)]:
+        latencies, took = run(es_service, mode_properties, rounds)
+        print(
+            f'{name:>6}: {len(latencies)} searches, client p50 {statistics.median(latencies):.1f} ms, '
+            f'p95 {percentile(latencies, 95):.1f} ms, es took p50 {statistics.median(took):.1f} ms'
+        )
@@ -1,21 +1,109 @@
+import io, csv, json
 from fastapi import APIRouter, HTTPException, Query
-from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional
 from schemas import (
     SearchQueryParams,
     AggregationQueryParams,
     FullTextSearchParams,
     SuggestQueryParams,
     SearchResult,
-    AggregationResult
+    AggregationResult,
+    Facet
 )
-from elasticsearch_operations import ElasticsearchService
-from config import ELASTICSEARCH_SETTINGS, ES_INDEX_NAME
+from elasticsearch_operations import FACET_FIELDS, FACET_RANGE_FIELDS, is_last_page
+from sql_reports import SQLReportService
+from columnar_reports import ColumnarReportService
+from config import ES_INDEX_NAME, REPORT_BACKENDS
+from report_queries import REPORT_QUERIES
 from logger_setup import Logger
+from report_cache import report_cache, query_cache, normalize_request, query_key
+from services import services
 
 log = Logger(__name__, './logs/api.log').get_logger()
 
 router = APIRouter()
-es_service = ElasticsearchService(ELASTICSEARCH_SETTINGS)
+es_service = services.async_es
+sql_report_service = SQLReportService()
+columnar_report_service = ColumnarReportService()
+
+def report_backend(name):
+    # REPORT_BACKENDS maps report names (or 'default') to 'elasticsearch', 'sql' or 'columnar'
+    return REPORT_BACKENDS.get(name, REPORT_BACKENDS.get('default', 'elasticsearch'))
+
+def uses_columnar_backend():
+    return 'columnar' in REPORT_BACKENDS.values()
+
+def run_columnar_report(name):
+    # Reload the snapshot first if an ETL load or sync moved the data version
+    columnar_report_service.ensure_version(report_cache.current_version())
+    return columnar_report_service.run_report(name)
+
+async def run_report(name):
+    if report_backend(name) == 'sql':
+        return await run_in_threadpool(sql_report_service.run_report, name)
+    if report_backend(name) == 'columnar':
+        return await run_in_threadpool(run_columnar_report, name)
+    results = await es_service.run_report(name, ES_INDEX_NAME)
+    if results is None:
+        # Elasticsearch is down or mid-reindex, the same report can be served from Postgres
+        log.info(f'Serving {name} report from the database')
+        results = await run_in_threadpool(sql_report_service.run_report, name)
+    return results
+
+async def run_reports(names):
+    es_names = [name for name in names if report_backend(name) == 'elasticsearch']
+    results = {}
+    if es_names:
+        results = await es_service.get_dashboard_reports(ES_INDEX_NAME, es_names) or {}
+    for name in names:
+        if report_backend(name) == 'columnar':
+            results[name] = await run_in_threadpool(run_columnar_report, name)
+        if results.get(name) is None:
+            results[name] = await run_in_threadpool(sql_report_service.run_report, name)
+    return results
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_EXCLUDED_FIELDS = {'hotel_suggest', 'country_suggest', 'reservation_status_suggest'}
+
+def encode_export_batch(hits, export_format, fieldnames=None):
+    docs = [{k: v for k, v in hit['_source'].items() if k not in EXPORT_EXCLUDED_FIELDS} for hit in hits]
+    buffer = io.StringIO()
+    if export_format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=fieldnames or list(docs[0]), extrasaction='ignore')
+        if fieldnames is None:
+            writer.writeheader()
+        writer.writerows(docs)
+        fieldnames = writer.fieldnames
+    else:
+        for doc in docs:
+            buffer.write(json.dumps(doc))
+            buffer.write('\n')
+    return buffer.getvalue().encode(), fieldnames
+
+async def export_search_results(first_hits, batches, export_format):
+    # Encodes and sends one Elasticsearch batch at a time, so memory use does not grow with the result size
+    if first_hits is None:
+        return
+    chunk, fieldnames = encode_export_batch(first_hits, export_format)
+    yield chunk
+    try:
+        async for hits in batches:
+            chunk, fieldnames = encode_export_batch(hits, export_format, fieldnames)
+            yield chunk
+    except Exception as e:
+        # Headers are already sent: abort the response instead of ending the body normally,
+        # so the client sees an incomplete transfer rather than a short file
+        log.error(f'Error exporting search results, aborting the download: {e}')
+        raise e
+    finally:
+        # Closes the point in time, also when the client disconnects mid-download
+        await batches.aclose()
+
+async def cached_report(name):
+    # Report results only change when the data version does, see report_cache.ReportCache
+    return await report_cache.get_or_compute(name, lambda: run_report(name))
 
 @router.get("/")
 async def root():
@@ -26,21 +114,61 @@ async def root():
 async def search(query_params: SearchQueryParams):
     try:
         # Convert Pydantic model to dict and exclude unset fields
-        params = query_params.dict(exclude_unset=True)
-        results = es_service.search_query_command(ES_INDEX_NAME, params)
-        if results:
-            return {"hits": results['hits']['hits'], "total": results['hits']['total']['value']}
+        params = normalize_request(query_params.dict(exclude_unset=True))
+        page_size, cursor = params.pop('page_size', None), params.pop('cursor', None)
+        if cursor is None:
+            # Searches that fit on one page are served from the query cache until the data changes; a page with
+            # a next_cursor holds the point in time of its caller's paging and is never shared
+            results = await query_cache.get_or_compute(
+                query_key('search', ES_INDEX_NAME, params, page_size),
+                lambda: es_service.search_page(ES_INDEX_NAME, params, page_size=page_size),
+                cacheable=is_last_page
+            )
         else:
-            raise HTTPException(status_code=404, detail="No results found")
+            results = await es_service.search_page(ES_INDEX_NAME, params, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         log.error(f'Error searching in Elasticsearch: {e}')
         raise HTTPException(status_code=500, detail="Internal server error")
+    if results:
+        return results
+    else:
+        raise HTTPException(status_code=404, detail="No results found")
+
+
+@router.post('/search/export', tags=['Search'])
+async def export_search(query_params: SearchQueryParams, format: str = Query("ndjson")):
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown export format: {format}, expected one of {', '.join(EXPORT_MEDIA_TYPES)}")
+    params = query_params.dict(exclude_unset=True)
+    params.pop('page_size', None)
+    params.pop('cursor', None)
+    # The point in time and the first batch are fetched before the response starts, so failures get a proper status
+    batches = es_service.scan_search(ES_INDEX_NAME, params)
+    try:
+        first_hits = await batches.__anext__()
+    except StopAsyncIteration:
+        first_hits = None
+    except Exception as e:
+        log.error(f'Error starting search export: {e}')
+        await batches.aclose()
+        raise HTTPException(status_code=500, detail="Internal server error")
+    return StreamingResponse(
+        export_search_results(first_hits, batches, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="bookings.{format}"'}
+    )
 
 
 @router.post("/aggregate/", tags=['Aggregate'],response_model=AggregationResult)
 async def aggregate(query_params: AggregationQueryParams):
     try:
-        result = es_service.dynamic_aggregation_query(ES_INDEX_NAME, query_params.dict())
+        agg_params = normalize_request(query_params.dict())
+        result = await query_cache.get_or_compute(
+            query_key('aggregate', ES_INDEX_NAME, agg_params),
+            lambda: es_service.dynamic_aggregation_query(ES_INDEX_NAME, agg_params)
+        )
         if result:
             return result
         else:
@@ -53,7 +181,7 @@ async def aggregate(query_params: AggregationQueryParams):
 @router.post("/full-text-search/", response_model=SearchResult, tags=['Full Text Search'])
 async def full_text_search(query_params: FullTextSearchParams):
     try:
-        results = es_service.full_text_search_query(ES_INDEX_NAME, query_params.dict())
+        results = await es_service.full_text_search_query(ES_INDEX_NAME, query_params.dict())
         if results:
             return {"hits": results['hits']['hits'], "total": results['hits']['total']['value']}
         else:
@@ -66,7 +194,7 @@ async def full_text_search(query_params: FullTextSearchParams):
 @router.post("/suggest/", response_model=List[str], tags=['Suggest'])
 async def suggest(query_params: SuggestQueryParams):
     try:
-        suggestions = es_service.suggest_query(ES_INDEX_NAME, query_params.text, query_params.field)
+        suggestions = await es_service.suggest_query(ES_INDEX_NAME, query_params.text, query_params.field)
         if suggestions:
             return suggestions
         else:
@@ -75,10 +203,42 @@ async def suggest(query_params: SuggestQueryParams):
         log.error(f'Error suggesting in Elasticsearch: {e}')
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.get("/facets", response_model=Dict[str, Facet], tags=['Search'])
+async def facets(fields: Optional[List[str]] = Query(None), range_fields: Optional[List[str]] = Query(None)):
+    fields = fields or FACET_FIELDS
+    range_fields = range_fields if range_fields is not None else FACET_RANGE_FIELDS
+    try:
+        # Distinct values only change with the data, so they share the report cache and its data version
+        key = ("facets", tuple(fields), tuple(range_fields))
+        results = await report_cache.get_or_compute(key, lambda: es_service.get_facets(ES_INDEX_NAME, fields, range_fields))
+    except Exception as e:
+        log.error(f'Error retrieving facets: {e}')
+        raise HTTPException(status_code=500, detail="Internal server error")
+    if results is None:
+        raise HTTPException(status_code=404, detail="No facets found")
+    return results
+
+@router.get("/cache/stats", tags=['Search'])
+async def cache_stats():
+    return {"query_cache": query_cache.stats()}
+
+@router.get("/reports/dashboard", tags=["Reports"])
+async def dashboard_report(reports: Optional[List[str]] = Query(None)):
+    names = reports or list(REPORT_QUERIES)
+    unknown = [name for name in names if name not in REPORT_QUERIES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown reports: {', '.join(unknown)}")
+    try:
+        results = await report_cache.get_or_compute_many(names, run_reports)
+        return results
+    except Exception as e:
+        log.error(f'Error retrieving dashboard reports: {e}')
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.get("/reports/cancellation_rate", tags=["Reports"])
 async def cancellation_rate_report():
     try:
-        results = es_service.get_cancellation_rate_by_segment_and_type(ES_INDEX_NAME)
+        results = await cached_report("cancellation_rate")
         return results
     except Exception as e:
         log.error(f'Error retrieving cancellation rate report: {e}')
@@ -87,7 +247,7 @@ async def cancellation_rate_report():
 @router.get("/reports/adr_by_month", tags=["Reports"])
 async def adr_by_month_report():
     try:
-        results = es_service.get_adr_by_month_and_type(ES_INDEX_NAME)
+        results = await cached_report("adr_by_month")
         return results
     except Exception as e:
         log.error(f'Error retrieving ADR by month report: {e}')
@@ -96,7 +256,7 @@ async def adr_by_month_report():
 @router.get("/reports/top_countries", tags=["Reports"])
 async def top_countries_report():
     try:
-        results = es_service.get_top_countries_with_most_bookings(ES_INDEX_NAME)
+        results = await cached_report("top_countries")
         return results
     except Exception as e:
         log.error(f'Error retrieving top countries report: {e}')
@@ -105,7 +265,7 @@ async def top_countries_report():
 @router.get("/reports/length_of_stay_distribution", tags=["Reports"])
 async def length_of_stay_distribution_simple_report():
     try:
-        results = es_service.get_length_of_stay_distribution_simple(ES_INDEX_NAME)
+        results = await cached_report("length_of_stay_distribution")
         return results
     except Exception as e:
         log.error(f'Error retrieving length of stay distribution report: {e}')
@@ -114,7 +274,7 @@ async def length_of_stay_distribution_simple_report():
 @router.get("/reports/booking_trends_over_time", tags=["Reports"])
 async def booking_trends_over_time_report():
     try:
-        results = es_service.get_booking_trends_over_time(ES_INDEX_NAME)
+        results = await cached_report("booking_trends_over_time")
         return results
     except Exception as e:
         log.error(f'Error retrieving booking trends over time report: {e}')
@@ -123,7 +283,7 @@ async def booking_trends_over_time_report():
 @router.get("/reports/special_requests_impact_on_cancellations", tags=["Reports"])
 async def special_requests_impact_on_cancellations_report():
     try:
-        results = es_service.get_special_requests_impact_on_cancellations(ES_INDEX_NAME)
+        results = await cached_report("special_requests_impact_on_cancellations")
         return results
     except Exception as e:
         log.error(f'Error retrieving special requests impact on cancellations report: {e}')
@@ -132,7 +292,7 @@ async def special_requests_impact_on_cancellations_report():
 @router.get("/reports/average_lead_time_by_cancellation_status", tags=["Reports"])
 async def average_lead_time_by_cancellation_status_report():
     try:
-        results = es_service.get_average_lead_time_by_cancellation_status(ES_INDEX_NAME)
+        results = await cached_report("average_lead_time_by_cancellation_status")
         return results
     except Exception as e:
         log.error(f'Error retrieving average lead time by cancellation status report: {e}')
@@ -141,7 +301,7 @@ async def average_lead_time_by_cancellation_status_report():
 @router.get("/reports/bookings_distribution_by_room_type", tags=["Reports"])
 async def bookings_distribution_by_room_type_report():
     try:
-        results = es_service.get_bookings_distribution_by_room_type(ES_INDEX_NAME)
+        results = await cached_report("bookings_distribution_by_room_type")
         return results
     except Exception as e:
         log.error(f'Error retrieving bookings distribution by room type report: {e}')
@@ -150,7 +310,7 @@ async def bookings_distribution_by_room_type_report():
 @router.get("/reports/bookings_by_guest_country", tags=["Reports"])
 async def bookings_by_guest_country_report():
     try:
-        results = es_service.get_bookings_by_guest_country(ES_INDEX_NAME)
+        results = await cached_report("bookings_by_guest_country")
         return results
     except Exception as e:
         log.error(f'Error retrieving bookings by guest country report: {e}')
@@ -159,7 +319,7 @@ async def bookings_by_guest_country_report():
 @router.get("/reports/booking_source_analysis", tags=["Reports"])
 async def booking_source_analysis_report():
     try:
-        results = es_service.get_booking_source_analysis(ES_INDEX_NAME)
+        results = await cached_report("booking_source_analysis")
         return results
     except Exception as e:
         log.error(f'Error retrieving booking source analysis report: {e}')
@@ -168,7 +328,7 @@ async def booking_source_analysis_report():
 @router.get("/reports/revenue_analysis_by_room_and_month", tags=["Reports"])
 async def revenue_analysis_by_room_and_month_report():
     try:
-        results = es_service.get_revenue_analysis_by_room_and_month(ES_INDEX_NAME)
+        results = await cached_report("revenue_analysis_by_room_and_month")
         return results
     except Exception as e:
         log.error(f'Error retrieving revenue analysis by room and month report: {e}')
@@ -177,7 +337,7 @@ async def revenue_analysis_by_room_and_month_report():
 @router.get("/reports/impact_of_lead_time_on_adr", tags=["Reports"])
 async def impact_of_lead_time_on_adr_report():
     try:
-        results = es_service.get_impact_of_lead_time_on_adr(ES_INDEX_NAME)
+        results = await cached_report("impact_of_lead_time_on_adr")
         return results
     except Exception as e:
         log.error(f'Error retrieving impact of lead time on ADR report: {e}')
@@ -186,7 +346,7 @@ async def impact_of_lead_time_on_adr_report():
 @router.get("/reports/analyze_repeat_guest_bookings", tags=["Reports"])
 async def analyze_repeat_guest_bookings_report():
     try:
-        results = es_service.get_analyze_repeat_guest_bookings(ES_INDEX_NAME)
+        results = await cached_report("analyze_repeat_guest_bookings")
         return results
     except Exception as e:
         log.error(f'Error retrieving analyze repeat guest bookings report: {e}')
@@ -195,7 +355,7 @@ async def analyze_repeat_guest_bookings_report():
 @router.get("/reports/correlate_adr_with_factors", tags=["Reports"])
 async def correlate_adr_with_factors_report():
     try:
-        results = es_service.get_correlate_adr_with_factors(ES_INDEX_NAME)
+        results = await cached_report("correlate_adr_with_factors")
         return results
     except Exception as e:
         log.error(f'Error retrieving correlate ADR with factors report: {e}')
@@ -205,7 +365,7 @@ async def correlate_adr_with_factors_report():
 @router.get("/reports/correlate_cancelations_with_factors", tags=["Reports"])
 async def correlate_cancelations_with_factors_report():
     try:
-        results = es_service.get_correlate_cancelations_with_factors(ES_INDEX_NAME)
+        results = await cached_report("correlate_cancelations_with_factors")
         return results
     except Exception as e:
         log.error(f'Error retrieving correlate cancellations with factors report: {e}')
@@ -214,7 +374,7 @@ async def correlate_cancelations_with_factors_report():
 @router.get("/reports/analyze_booking_composition", tags=["Reports"])
 async def get_analyze_booking_composition_report():
     try:
-        results = es_service.get_analyze_booking_composition(ES_INDEX_NAME)
+        results = await cached_report("analyze_booking_composition")
         return results
     except Exception as e:
         log.error(f'Error retrieving analyze booking composition report: {e}')
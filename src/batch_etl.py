@@ -0,0 +1,51 @@
+"""
+Run the ETL over many booking exports at once, e.g. a nightly drop.
+
+Usage (from the src folder, with config.py in place):
+
+    python batch_etl.py path/to/exports [more/files.csv ...] [--workers 8] [--db-writers 4] [--sync]
+
+A directory argument means every *.csv file in it.
+"""
+import os, sys, argparse
+
+# Importing the services changes the working directory, so relative paths are resolved against the caller's
+CALLER_CWD = os.getcwd()
+
+
+def main():
+    # Imported here, not at module level: the transform workers are spawned processes, which re-import
+    # this script and would otherwise load the database models, the API and its clients for nothing
+    from etl_utils import ETLUtils
+    from models import create_tables, session_scope, ensure_booking_hashes
+    from main import sync_sql_to_elasticsearch
+
+    parser = argparse.ArgumentParser(description='Batch ETL of booking exports into Postgres')
+    parser.add_argument('paths', nargs='+', help='directories or csv files')
+    parser.add_argument('--workers', type=int, default=None, help="transform processes, defaults to ETL_SETTINGS['workers']")
+    parser.add_argument('--db-writers', type=int, default=None, help="concurrent database loads, defaults to ETL_SETTINGS['db_writers']")
+    parser.add_argument('--sync', action='store_true', help='sync the loaded rows to Elasticsearch afterwards')
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.paths:
+        path = os.path.join(CALLER_CWD, path)
+        paths.extend(ETLUtils.list_batch_files(path) if os.path.isdir(path) else [path])
+
+    create_tables()
+    with session_scope() as db:
+        # The loads insert ON CONFLICT (booking_hash), which needs the unique index on a table from before hashing
+        ensure_booking_hashes(db)
+    summary = ETLUtils().run_batch_etl(paths, workers=args.workers, db_writers=args.db_writers)
+    for status in summary['files']:
+        print(f"{status['status']:>6}  {status['rows']:>8} rows  {status['file']}" + (f"  ({status['error']})" if status['error'] else ''))
+    print(f"{summary['loaded']} loaded, {summary['failed']} failed, {summary['rows']} rows in {summary['seconds']} sec ({summary['rows_per_sec']} rows/sec)")
+
+    if args.sync and summary['rows']:
+        sync_sql_to_elasticsearch()
+
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+import threading
+from datetime import date
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from models import HotelBooking, engine
+from sql_reports import terms, month_histogram, value
+from report_queries import format_composition
+from logger_setup import Logger
+
+log = Logger(__name__, './logs/api.log').get_logger()
+
+# Only the columns the reports read are loaded into the snapshot
+CATEGORICAL_COLUMNS = ['hotel', 'country', 'market_segment', 'distribution_channel', 'reserved_room_type']
+NUMERIC_COLUMNS = [
+    'is_canceled', 'lead_time', 'stays_in_weekend_nights', 'stays_in_week_nights', 'adults', 'children',
+    'babies', 'is_repeated_guest', 'adr', 'total_of_special_requests'
+]
+SNAPSHOT_CHUNK_SIZE = 100000
+
+
+def month_to_date(month):
+    return date(1970 + int(month) // 12, int(month) % 12 + 1, 1)
+
+def combine(first, second, second_size):
+    # Code of the (first, second) pair, -1 where either is missing
+    return np.where((first >= 0) & (second >= 0), first * second_size + second, -1)
+
+def counts(codes, size):
+    valid = codes >= 0
+    return np.bincount(codes[valid], minlength=size)
+
+def sums(codes, values, size):
+    valid = (codes >= 0) & ~np.isnan(values)
+    return np.bincount(codes[valid], weights=values[valid], minlength=size)
+
+def means(codes, values, size):
+    # Average of the non-missing values per group, None for groups without any (like an ES avg)
+    valid = (codes >= 0) & ~np.isnan(values)
+    totals = np.bincount(codes[valid], weights=values[valid], minlength=size)
+    seen = np.bincount(codes[valid], minlength=size)
+    return [totals[i] / seen[i] if seen[i] else None for i in range(size)]
+
+
+class ColumnarSnapshot(object):
+    """
+    In-memory columnar copy of HotelBooking: NumPy float arrays for numeric columns (NaN for nulls)
+    and dictionary-encoded categoricals (int32 codes into a labels array, -1 for nulls).
+    """
+    def __init__(self, frame, data_version=None):
+        self.size = len(frame)
+        self.data_version = data_version
+        self.codes, self.labels = {}, {}
+        for col in CATEGORICAL_COLUMNS:
+            codes, labels = pd.factorize(frame[col])
+            self.codes[col] = codes.astype(np.int32)
+            self.labels[col] = np.asarray(labels, dtype=object)
+
+        self.numbers = {col: pd.to_numeric(frame[col]).to_numpy(dtype='float64', na_value=np.nan) for col in NUMERIC_COLUMNS}
+        self.numbers['nights'] = self.numbers['stays_in_weekend_nights'] + self.numbers['stays_in_week_nights']
+        self.numbers['revenue'] = self.numbers['adr'] * self.numbers['nights']
+        self.numbers['lead_time_bucket'] = np.floor(self.numbers['lead_time'] / 10) * 10
+
+        arrival = pd.to_datetime(frame['arrival_date'])
+        months = arrival.dt.year * 12 + arrival.dt.month - 1 - 1970 * 12
+        self.numbers['arrival_month'] = months.to_numpy(dtype='float64', na_value=np.nan)
+
+    @classmethod
+    def load(cls, bind=engine, data_version=None):
+        columns = [getattr(HotelBooking, col) for col in CATEGORICAL_COLUMNS + NUMERIC_COLUMNS + ['arrival_date']]
+        chunks = pd.read_sql(select(*columns), bind, chunksize=SNAPSHOT_CHUNK_SIZE)
+        frames = list(chunks)
+        frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=[c.name for c in columns])
+        snapshot = cls(frame, data_version=data_version)
+        log.info(f'Columnar snapshot loaded with {snapshot.size} bookings (data version {data_version})')
+        return snapshot
+
+    def group(self, column):
+        """
+        Return (labels, codes) for a column: codes index into labels and are -1 for missing values.
+        """
+        if column in self.codes:
+            return self.labels[column], self.codes[column]
+        values = self.numbers[column]
+        valid = ~np.isnan(values)
+        labels, inverse = np.unique(values[valid], return_inverse=True)
+        codes = np.full(self.size, -1, dtype=np.int64)
+        codes[valid] = inverse
+        return labels, codes
+
+
+class ColumnarReportService(object):
+    """
+    Report backend computing every /reports/* query with vectorized NumPy group-bys over a
+    ColumnarSnapshot. Results have the same shapes as AsyncElasticsearchService.run_report.
+    The snapshot is reloaded when the data version moves past the one it was loaded at.
+    """
+    def __init__(self, snapshot_loader=ColumnarSnapshot.load):
+        self.snapshot_loader = snapshot_loader
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def refresh(self, data_version=None):
+        snapshot = self.snapshot_loader(data_version=data_version)
+        self.snapshot = snapshot
+
+    def ensure_version(self, data_version):
+        if self.snapshot is not None and self.snapshot.data_version == data_version:
+            return
+        with self.lock:
+            if self.snapshot is None or self.snapshot.data_version != data_version:
+                self.refresh(data_version)
+
+    def run_report(self, name, index_name=None):
+        try:
+            if self.snapshot is None:
+                self.refresh()
+            return getattr(self, f'report_{name}')(self.snapshot)
+        except Exception as e:
+            log.error(f'Error computing {name} report from the columnar snapshot: {e}')
+            return None
+
+    def count_by(self, snapshot, column, size=10, key=str):
+        labels, codes = snapshot.group(column)
+        count = counts(codes, len(labels))
+        buckets = [{"key": key(labels[i]), "doc_count": int(count[i])} for i in range(len(labels)) if count[i]]
+        return terms(buckets, size=size)["buckets"]
+
+    def report_cancellation_rate(self, snapshot):
+        segments, segment_codes = snapshot.group('market_segment')
+        hotels, hotel_codes = snapshot.group('hotel')
+        pairs = combine(segment_codes, hotel_codes, len(hotels))
+        size = len(segments) * len(hotels)
+        segment_count = counts(segment_codes, len(segments))
+        pair_count = counts(pairs, size)
+        rate = means(pairs, snapshot.numbers['is_canceled'], size)
+        buckets = []
+        for s in range(len(segments)):
+            hotel_buckets = [
+                {"key": str(hotels[h]), "doc_count": int(pair_count[s * len(hotels) + h]), "cancellation_rate": value(rate[s * len(hotels) + h])}
+                for h in range(len(hotels)) if pair_count[s * len(hotels) + h]
+            ]
+            if segment_count[s]:
+                buckets.append({"key": str(segments[s]), "doc_count": int(segment_count[s]), "hotel_type": terms(hotel_buckets)})
+        return {"market_segment": terms(buckets)}
+
+    def report_adr_by_month(self, snapshot):
+        months, month_codes = snapshot.group('arrival_month')
+        hotels, hotel_codes = snapshot.group('hotel')
+        pairs = combine(month_codes, hotel_codes, len(hotels))
+        size = len(months) * len(hotels)
+        month_count = counts(month_codes, len(months))
+        pair_count = counts(pairs, size)
+        adr = means(pairs, snapshot.numbers['adr'], size)
+        buckets = {}
+        for m in range(len(months)):
+            hotel_buckets = [
+                {"key": str(hotels[h]), "doc_count": int(pair_count[m * len(hotels) + h]), "average_adr": value(adr[m * len(hotels) + h])}
+                for h in range(len(hotels)) if pair_count[m * len(hotels) + h]
+            ]
+            buckets[month_to_date(months[m])] = {"doc_count": int(month_count[m]), "hotel_type": terms(hotel_buckets)}
+        return {"months": month_histogram(buckets, '%Y-%m-%d', empty_bucket=lambda: {"hotel_type": terms([])})}
+
+    def report_top_countries(self, snapshot):
+        return self.count_by(snapshot, 'country')
+
+    def report_length_of_stay_distribution(self, snapshot):
+        return self.count_by(snapshot, 'nights', key=int)
+
+    def report_booking_trends_over_time(self, snapshot):
+        months, month_codes = snapshot.group('arrival_month')
+        month_count = counts(month_codes, len(months))
+        buckets = {month_to_date(months[m]): {"doc_count": int(month_count[m])} for m in range(len(months))}
+        return month_histogram(buckets, '%Y-%m')["buckets"]
+
+    def report_special_requests_impact_on_cancellations(self, snapshot):
+        labels, codes = snapshot.group('total_of_special_requests')
+        count = counts(codes, len(labels))
+        rate = means(codes, snapshot.numbers['is_canceled'], len(labels))
+        buckets = [{"key": int(labels[i]), "doc_count": int(count[i]), "cancellation_rate": value(rate[i])} for i in range(len(labels))]
+        return terms(buckets)["buckets"]
+
+    def report_average_lead_time_by_cancellation_status(self, snapshot):
+        labels, codes = snapshot.group('is_canceled')
+        count = counts(codes, len(labels))
+        lead_time = means(codes, snapshot.numbers['lead_time'], len(labels))
+        buckets = [{"key": int(labels[i]), "doc_count": int(count[i]), "average_lead_time": value(lead_time[i])} for i in range(len(labels))]
+        return terms(buckets)["buckets"]
+
+    def report_bookings_distribution_by_room_type(self, snapshot):
+        return self.count_by(snapshot, 'reserved_room_type')
+
+    def report_bookings_by_guest_country(self, snapshot):
+        return self.count_by(snapshot, 'country')
+
+    def report_booking_source_analysis(self, snapshot):
+        return self.count_by(snapshot, 'distribution_channel', size=5)
+
+    def report_revenue_analysis_by_room_and_month(self, snapshot):
+        rooms, room_codes = snapshot.group('reserved_room_type')
+        months, month_codes = snapshot.group('arrival_month')
+        pairs = combine(room_codes, month_codes, len(months))
+        size = len(rooms) * len(months)
+        room_count = counts(room_codes, len(rooms))
+        pair_count = counts(pairs, size)
+        revenue = sums(pairs, snapshot.numbers['revenue'], size)
+        buckets = []
+        for r in range(len(rooms)):
+            monthly = {
+                month_to_date(months[m]): {"doc_count": int(pair_count[r * len(months) + m]), "revenue": {"value": float(revenue[r * len(months) + m])}}
+                for m in range(len(months)) if pair_count[r * len(months) + m]
+            }
+            if room_count[r]:
+                buckets.append({"key": str(rooms[r]), "doc_count": int(room_count[r]), "monthly_revenue": month_histogram(monthly, '%Y-%m', fill_gaps=False)})
+        return terms(buckets)["buckets"]
+
+    def report_impact_of_lead_time_on_adr(self, snapshot):
+        labels, codes = snapshot.group('lead_time_bucket')
+        count = counts(codes, len(labels))
+        adr = means(codes, snapshot.numbers['adr'], len(labels))
+        return [{"key": float(labels[i]), "doc_count": int(count[i]), "average_adr": value(adr[i])} for i in range(len(labels))]
+
+    def report_analyze_repeat_guest_bookings(self, snapshot):
+        guests, guest_codes = snapshot.group('is_repeated_guest')
+        guest_count = counts(guest_codes, len(guests))
+        lead_time = means(guest_codes, snapshot.numbers['lead_time'], len(guests))
+        breakdowns = {}
+        for output, column in [("bookings_by_country", 'country'), ("bookings_by_hotel_type", 'hotel')]:
+            labels, codes = snapshot.group(column)
+            pair_count = counts(combine(guest_codes, codes, len(labels)), len(guests) * len(labels))
+            breakdowns[output] = [
+                terms([
+                    {"key": str(labels[i]), "doc_count": int(pair_count[g * len(labels) + i])}
+                    for i in range(len(labels)) if pair_count[g * len(labels) + i]
+                ])
+                for g in range(len(guests))
+            ]
+        buckets = [
+            {
+                "key": int(guests[g]),
+                "doc_count": int(guest_count[g]),
+                "average_lead_time": value(lead_time[g]),
+                "bookings_by_country": breakdowns["bookings_by_country"][g],
+                "bookings_by_hotel_type": breakdowns["bookings_by_hotel_type"][g]
+            }
+            for g in range(len(guests))
+        ]
+        return {"repeat_guests": terms(buckets, size=2)}
+
+    def booking_factors(self, snapshot, codes, size):
+        return {
+            "count": counts(codes, size),
+            "lead_time": means(codes, snapshot.numbers['lead_time'], size),
+            "cancellation_rate": means(codes, snapshot.numbers['is_canceled'], size),
+            "stay_length": means(codes, snapshot.numbers['nights'], size),
+            "special_requests": means(codes, snapshot.numbers['total_of_special_requests'], size)
+        }
+
+    def report_correlate_adr_with_factors(self, snapshot):
+        labels, codes = snapshot.group('adr')
+        factors = self.booking_factors(snapshot, codes, len(labels))
+        buckets = [
+            {
+                "key": float(labels[i]),
+                "doc_count": int(factors["count"][i]),
+                "cancellation_rate": value(factors["cancellation_rate"][i]),
+                "average_stay_length": value(factors["stay_length"][i]),
+                "special_requests_count": value(factors["special_requests"][i])
+            }
+            for i in range(len(labels))
+        ]
+        return {"adr_correlation": terms(buckets, order_by_key=True)}
+
+    def report_correlate_cancelations_with_factors(self, snapshot):
+        labels, codes = snapshot.group('is_canceled')
+        factors = self.booking_factors(snapshot, codes, len(labels))
+        buckets = [
+            {
+                "key": int(labels[i]),
+                "doc_count": int(factors["count"][i]),
+                "average_lead_time": value(factors["lead_time"][i]),
+                "average_stay_length": value(factors["stay_length"][i]),
+                "special_requests_count": value(factors["special_requests"][i])
+            }
+            for i in range(len(labels))
+        ]
+        return {"cancellation_correlation": terms(buckets, size=2)}
+
+    def report_analyze_booking_composition(self, snapshot):
+        # Composition is the (adults, children, babies) triple, grouped on its unique rows
+        numbers = snapshot.numbers
+        triples = np.column_stack([numbers['adults'], numbers['children'], numbers['babies']])
+        valid = ~np.isnan(triples).any(axis=1)
+        labels, inverse = np.unique(triples[valid], axis=0, return_inverse=True)
+        codes = np.full(snapshot.size, -1, dtype=np.int64)
+        codes[valid] = inverse.reshape(-1)
+        factors = self.booking_factors(snapshot, codes, len(labels))
+        buckets = [
+            {
+                "key": format_composition(int(adults), children, int(babies)),
+                "doc_count": int(factors["count"][i]),
+                "average_lead_time": value(factors["lead_time"][i]),
+                "average_stay_length": value(factors["stay_length"][i]),
+                "special_requests_count": value(factors["special_requests"][i])
+            }
+            for i, (adults, children, babies) in enumerate(labels)
+        ]
+        return {"booking_composition": terms(buckets)}
@@ -0,0 +1,91 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from config import DATA_LAKE_PATH
+from models import BOOKING_COLUMNS, coerce_booking_frame
+from logger_setup import Logger
+
+
+log = Logger(__name__, './logs/etl.log').get_logger()
+
+PARTITION_COLUMNS = ['arrival_date_year', 'arrival_date_month']
+PARTITION_SCHEMA = pa.schema([('arrival_date_year', pa.int64()), ('arrival_date_month', pa.string())])
+LAKE_BATCH_SIZE = 50000
+
+
+def partition_filter(years=None, months=None):
+    """
+    Build a dataset filter on the partition columns, e.g. partition_filter(years=[2017], months=['July']).
+    Only the matching arrival_date_year=/arrival_date_month= directories are opened.
+    """
+    expression = None
+    for column, values in (('arrival_date_year', years), ('arrival_date_month', months)):
+        if values:
+            condition = ds.field(column).isin(list(values))
+            expression = condition if expression is None else expression & condition
+    return expression
+
+
+class DataLake(object):
+    """
+    Cleaned bookings stored as typed Parquet files, partitioned by arrival year and month
+    (hive layout: <root>/arrival_date_year=2017/arrival_date_month=July/<batch>-0.parquet).
+    Every upload is written as its own batch of files, so readers can pick whole partitions,
+    single uploads, and only the columns they need.
+    """
+    def __init__(self, root=DATA_LAKE_PATH):
+        self.root = root
+        self.partitioning = ds.partitioning(PARTITION_SCHEMA, flavor='hive')
+
+    def is_empty(self):
+        if not os.path.isdir(self.root):
+            return True
+        return not any(files for _, _, files in os.walk(self.root))
+
+    def write(self, data: pd.DataFrame, batch_id=None) -> list:
+        """
+        Write a cleaned DataFrame into the lake and return the paths of the files written for it.
+        """
+        batch_id = batch_id or pd.Timestamp.now().strftime("%Y%m%d%H%M%S%f")
+        table = pa.Table.from_pandas(coerce_booking_frame(data), preserve_index=False)
+        written = []
+        try:
+            ds.write_dataset(
+                table,
+                self.root,
+                format='parquet',
+                partitioning=self.partitioning,
+                basename_template=f'{batch_id}-{{i}}.parquet',
+                existing_data_behavior='overwrite_or_ignore',
+                file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'),
+                file_visitor=lambda written_file: written.append(written_file.path)
+            )
+        except Exception as e:
+            log.error(f'Error writing batch {batch_id} to {self.root}: {e}')
+            raise e
+        log.info(f'Wrote {table.num_rows} rows as batch {batch_id} into {len(written)} partitions of {self.root}')
+        return written
+
+    def dataset(self, files=None):
+        if files is not None:
+            return ds.dataset(files, format='parquet', partitioning=self.partitioning, partition_base_dir=self.root)
+        return ds.dataset(self.root, format='parquet', partitioning=self.partitioning)
+
+    def read(self, columns=None, filter=None, files=None) -> pd.DataFrame:
+        """
+        Read the lake (or just the given files) into a DataFrame.
+        Only the requested columns are decoded and partitions excluded by filter are skipped.
+        """
+        return self.dataset(files).to_table(columns=columns, filter=filter).to_pandas()
+
+    def iter_frames(self, columns=BOOKING_COLUMNS, filter=None, files=None, batch_size=LAKE_BATCH_SIZE):
+        """
+        Yield the lake as DataFrames of at most batch_size rows, for loaders that keep memory bounded.
+        """
+        for batch in self.dataset(files).to_batches(columns=columns, filter=filter, batch_size=batch_size):
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+    def count_rows(self, filter=None, files=None) -> int:
+        return self.dataset(files).count_rows(filter=filter)
@@ -1,103 +1,536 @@
-import os
+import os, time, json, base64
+from datetime import datetime
 
 # Reset project path to this file's location
 project_path = os.path.dirname(os.path.abspath(__file__))
 os.chdir(project_path)
 
-from elasticsearch import Elasticsearch, exceptions, helpers
+from elasticsearch import Elasticsearch, AsyncElasticsearch, exceptions, helpers
 from elasticsearch.helpers import bulk
 from logger_setup import Logger
-from models import HotelBooking, get_db
-from config import ELASTICSEARCH_SETTINGS, ES_INDEX_NAME
+from models import HotelBooking, SessionLocal
+from sqlalchemy import func
+from config import ELASTICSEARCH_SETTINGS, ES_INDEX_NAME, ES_BULK_SETTINGS, ES_ROLLUP_INDEX_NAME, ES_SEARCH_SETTINGS, ES_REINDEX_SETTINGS, ES_CLIENT_SETTINGS
 from logger_setup import Logger
 from tqdm import tqdm
+from report_queries import REPORT_QUERIES, ROLLUP_QUERIES, extract_report, format_composition
+from metrics import observe_bulk, observe_es_request
 
 log = Logger(__name__, './logs/elasticsearch.log').get_logger()
 
+DB_FETCH_SIZE = 2000  # rows per server-side cursor fetch when streaming bookings out of Postgres
+
+# Rollup index: one document per arrival day x hotel x market segment x room type x country
+ROLLUP_DIMENSIONS = ['arrival_date', 'hotel', 'market_segment', 'reserved_room_type', 'country']
+ROLLUP_DAYS_PER_BATCH = 500
+ROLLUP_INDEX_MAPPING = {
+    "mappings": {
+        "properties": {
+            "arrival_date": {"type": "date", "format": "yyyy-MM-dd"},
+            "hotel": {"type": "keyword"},
+            "market_segment": {"type": "keyword"},
+            "reserved_room_type": {"type": "keyword"},
+            "country": {"type": "keyword"},
+            "bookings": {"type": "integer"},
+            "canceled": {"type": "integer"},
+            "adr_sum": {"type": "double"},
+            "adr_count": {"type": "integer"},
+            "nights_sum": {"type": "long"},
+            "revenue_sum": {"type": "double"},
+            "lead_time_sum": {"type": "long"},
+            "rolled_up_at": {"type": "date"}
+        }
+    }
+}
+
+BOOKING_INDEX_MAPPING = {
+    "mappings": {
+        "properties": {
+            "hotel": {
+                "type": "text",
+                "fields": {
+                    "keyword": {"type": "keyword"}
+                }
+            },
+            "hotel_suggest": {
+                "type": "completion"
+            },
+            "id": {"type": "long"},
+            "booking_hash": {"type": "keyword"},
+            "is_canceled": {"type": "integer"},
+            "lead_time": {"type": "integer"},
+            "arrival_date": {"type": "date", "format": "yyyy-MM-dd", "fields": {"keyword": {"type": "keyword"}}},
+            "arrival_date_year": {"type": "integer"},
+            "arrival_date_month": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "arrival_date_week_number": {"type": "integer"},
+            "arrival_date_day_of_month": {"type": "integer"},
+            "stays_in_weekend_nights": {"type": "integer"},
+            "stays_in_week_nights": {"type": "integer"},
+            "adults": {"type": "integer"},
+            "children": {"type": "float"},
+            "babies": {"type": "integer"},
+            "meal": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "country": {
+                "type": "text",
+                "fields": {
+                    "keyword": {"type": "keyword"}
+                }
+            },
+            "country_suggest": {
+                "type": "completion"
+            },
+            "market_segment": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "distribution_channel": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "is_repeated_guest": {"type": "integer"},
+            "previous_cancellations": {"type": "integer"},
+            "previous_bookings_not_canceled": {"type": "integer"},
+            "reserved_room_type": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "assigned_room_type": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "booking_changes": {"type": "integer"},
+            "deposit_type": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "agent": {"type": "float"},
+            "company": {"type": "float"},
+            "days_in_waiting_list": {"type": "integer"},
+            "customer_type": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "adr": {"type": "float"},
+            "required_car_parking_spaces": {"type": "integer"},
+            "total_of_special_requests": {"type": "integer"},
+            "reservation_status": {
+                "type": "text",
+                "fields": {
+                    "keyword": {"type": "keyword"}
+                }
+            },
+            "reservation_status_suggest": {
+                "type": "completion"
+            },
+            "reservation_status_date": {"type": "date", "format": "yyyy-MM-dd", "fields": {"keyword": {"type": "keyword"}}},
+            "updated_at": {"type": "date"},
+            # Derived at index time so reports aggregate doc values instead of running scripts
+            "total_nights": {"type": "integer"},
+            "revenue": {"type": "float"},
+            "composition": {"type": "keyword"}
+        }
+    }
+}
+
+def versioned_index_name(alias):
+    return f'{alias}-{datetime.utcnow().strftime("%Y%m%d%H%M%S")}'
+
+
+# Version of the documents add_derived_fields produces (total_nights, revenue, composition), recorded in the
+# _meta of an index once all of its documents have it; bump it when the derived fields change so existing
+# indices are rebuilt once
+DOCUMENTS_VERSION = 1
+
+def documents_meta():
+    return {"documents_version": DOCUMENTS_VERSION}
+
+def needs_document_rebuild(mapping):
+    # mapping is one index's entry of get_mapping; indices without the marker were never fully (re)built
+    return mapping['mappings'].get('_meta', {}).get('documents_version', 0) < DOCUMENTS_VERSION
+
+def add_derived_fields(doc):
+    """
+    Materialize the values reports used to compute with painless scripts at query time.
+    """
+    weekend, week = doc.get('stays_in_weekend_nights'), doc.get('stays_in_week_nights')
+    total_nights = weekend + week if weekend is not None and week is not None else None
+    adr = doc.get('adr')
+    adults, children, babies = doc.get('adults'), doc.get('children'), doc.get('babies')
+
+    doc['total_nights'] = total_nights
+    doc['revenue'] = adr * total_nights if adr is not None and total_nights is not None else None
+    if adults is not None and children is not None and babies is not None:
+        doc['composition'] = format_composition(adults, children, babies)
+    else:
+        doc['composition'] = None
+    return doc
+
+# Search parameters that control the request rather than match a document field
+SEARCH_CONTROL_FIELDS = ['exclude_fields', 'optional_fields', 'range_fields', 'cursor', 'page_size']
+# Relevance first, then the booking id so every hit has a unique, stable position for search_after
+SEARCH_SORT = [{"_score": "desc"}, {"id": "asc"}]
+# Index order, the cheapest sort for walking a whole point in time when relevance does not matter
+EXPORT_SORT = [{"_shard_doc": "asc"}]
+
+# Field types matched exactly (term/terms/range in filter context) instead of through a scored match
+EXACT_TYPES = ('keyword', 'integer', 'long', 'short', 'byte', 'float', 'double', 'date', 'boolean')
+
+def exact_field(properties, field):
+    """
+    Name under which field can be matched exactly: the field itself for keyword, numeric and date fields,
+    its keyword sub-field for text fields that have one, None for text-only fields.
+    """
+    mapping = properties.get(field, {})
+    if mapping.get('type') in EXACT_TYPES:
+        return field
+    if 'keyword' in mapping.get('fields', {}):
+        return f"{field}.keyword"
+    return None
+
+def compile_clause(properties, field, value):
+    # Returns the clause and whether it is exact, i.e. can run in filter context
+    exact = exact_field(properties, field)
+    if exact is None:
+        return {"match": {field: value}}, False
+    if isinstance(value, list):
+        return {"terms": {exact: value}}, True
+    return {"term": {exact: value}}, True
+
+def build_search_query(params, properties=None):
+    """
+    Compile search parameters into a bool query. With the index mapping's properties, equality and range
+    conditions on keyword, numeric and date fields go into filter context, which skips scoring and is
+    cached by Elasticsearch across requests; match is only used for analyzed text fields.
+    Without properties every condition is a scored match, as before.
+    """
+    properties = properties or {}
+    bool_query = {"bool": {"must": [], "filter": [], "should": [], "must_not": []}}
+    
+    # Handling 'must' conditions based on user input
+    for field, value in params.items():
+        if value is not None and field not in SEARCH_CONTROL_FIELDS:
+            clause, exact = compile_clause(properties, field, value)
+            bool_query["bool"]["filter" if exact else "must"].append(clause)
+    
+    # Handling 'exclude_fields' for 'must_not' conditions
+    exclude_fields = params.get('exclude_fields') or {}
+    for field, value in exclude_fields.items():
+        bool_query["bool"]["must_not"].append(compile_clause(properties, field, value)[0])
+    
+    # Handling 'optional_fields' for 'should' conditions
+    optional_fields = params.get('optional_fields') or {}
+    for field, value in optional_fields.items():
+        bool_query["bool"]["should"].append(compile_clause(properties, field, value)[0])
+        bool_query["bool"]["minimum_should_match"] = 1  # Ensure at least one 'should' condition matches if present
+    
+    # Handling 'range_fields' for range conditions
+    range_fields = params.get('range_fields') or {}
+    for field, ranges in range_fields.items():
+        range_query = {"range": {field: {}}}
+        for range_type, range_value in ranges.items():
+            range_query["range"][field][range_type] = range_value
+        bool_query["bool"]["filter" if field in properties else "must"].append(range_query)
+    
+    return {"query": bool_query, "size": params.get('size', 10000)}
+
+def encode_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode()
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor made by encode_cursor into {"params", "pit_id", "search_after"}, raising ValueError if it is not one.
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f'Invalid search cursor: {e}')
+    if not isinstance(state, dict) or not {"params", "pit_id", "search_after"} <= set(state):
+        raise ValueError('Invalid search cursor')
+    return state
+
+def search_page_size(page_size=None):
+    page_size = page_size or ES_SEARCH_SETTINGS['page_size']
+    return max(1, min(page_size, ES_SEARCH_SETTINGS['max_page_size']))
+
+def start_search_page(params=None, page_size=None, cursor=None):
+    """
+    Return the paging state {"params", "pit_id", "search_after"} and page size of one search_page call:
+    those of the cursor when there is one, its query and page size travel inside it, otherwise a new search.
+    Raises ValueError for a cursor that encode_cursor did not make.
+    """
+    if cursor is not None:
+        state = decode_cursor(cursor)
+        return state, search_page_size(state.get("page_size"))
+    return {"params": params or {}, "pit_id": None, "search_after": None}, search_page_size(page_size)
+
+def build_search_page(params, pit_id, page_size, search_after=None, sort=SEARCH_SORT, track_total_hits=True, properties=None):
+    # The point in time pins the index state, so pages neither skip nor repeat hits while data changes;
+    # without one the caller searches the index directly
+    body = build_search_query(params, properties)
+    body.update({
+        "size": page_size,
+        "sort": sort,
+        "track_total_hits": track_total_hits
+    })
+    if pit_id is not None:
+        body["pit"] = {"id": pit_id, "keep_alive": ES_SEARCH_SETTINGS['keep_alive']}
+    if search_after is not None:
+        body["search_after"] = search_after
+    return body
+
+def search_page_request(index_name, state, page_size, properties=None):
+    # Keyword arguments of the search for one page; a point in time search must not name the index
+    body = build_search_page(state["params"], state["pit_id"], page_size, state["search_after"], properties=properties)
+    return {"body": body} if state["pit_id"] is not None else {"index": index_name, "body": body}
+
+def parse_search_page(response, state, page_size):
+    """
+    Turn one page of a point-in-time search into {"hits", "total", "next_cursor"}.
+    state["pit_id"] is moved to the id the response returned; next_cursor is None on the last page,
+    whose point in time the caller should close.
+    """
+    hits = response['hits']['hits']
+    state["pit_id"] = response.get("pit_id", state["pit_id"])
+    next_cursor = None
+    if len(hits) == page_size:
+        next_cursor = encode_cursor({
+            "params": state["params"],
+            "pit_id": state["pit_id"],
+            "search_after": hits[-1]["sort"],
+            "page_size": page_size
+        })
+    return {"hits": hits, "total": response['hits']['total']['value'], "next_cursor": next_cursor}
+
+def is_last_page(page):
+    # Pages with a next_cursor keep their point in time open for the caller, so only last pages can be shared
+    return page["next_cursor"] is None
+
+def build_aggregation_query(properties, agg_params):
+    aggs_body = {"aggs": {}, "size": 0}
+    for agg in agg_params['aggregations']:
+        field = agg['field']
+        agg_type = agg['agg_type']
+
+        # Determine if field is a text field with a keyword sub-field
+        if field in properties and 'fields' in properties[field] and 'keyword' in properties[field]['fields']:
+            field_name = f"{field}.keyword"
+        else:
+            field_name = field
+
+        aggs_body["aggs"][f"{field}_{agg_type}"] = {agg_type: {"field": field_name}}
+    return aggs_body
+
+FACET_FIELDS = [
+    'hotel', 'is_canceled', 'country', 'market_segment', 'distribution_channel', 'is_repeated_guest',
+    'reserved_room_type', 'booking_changes', 'deposit_type', 'customer_type', 'meal',
+    'total_of_special_requests', 'reservation_status', 'reservation_status_date'
+]
+FACET_RANGE_FIELDS = ['arrival_date']
+FACET_SIZE = 1000  # max distinct values returned per field
+RANGE_TYPES = ('date', 'integer', 'long', 'short', 'byte', 'float', 'double')
+
+def build_facets_query(properties, fields, range_fields=()):
+    """
+    One size-0 search with a terms aggregation per field (distinct values, key order)
+    and min/max aggregations for numeric and date fields and for range_fields.
+    """
+    aggs = {}
+    for field in fields:
+        mapping = properties.get(field, {})
+        if 'keyword' in mapping.get('fields', {}):
+            field_name = f"{field}.keyword"
+        else:
+            field_name = field
+        aggs[f"{field}_values"] = {"terms": {"field": field_name, "size": FACET_SIZE, "order": {"_key": "asc"}}}
+    for field in list(fields) + list(range_fields):
+        if field in range_fields or properties.get(field, {}).get('type') in RANGE_TYPES:
+            aggs[f"{field}_min"] = {"min": {"field": field}}
+            aggs[f"{field}_max"] = {"max": {"field": field}}
+    return {"size": 0, "aggs": aggs}
+
+def parse_facets(response, fields, range_fields=()):
+    aggregations = response["aggregations"]
+    facets = {}
+    for field in list(fields) + [field for field in range_fields if field not in fields]:
+        facet = {"values": [], "min": None, "max": None}
+        if f"{field}_values" in aggregations:
+            facet["values"] = [bucket.get("key_as_string", bucket["key"]) for bucket in aggregations[f"{field}_values"]["buckets"]]
+        for bound in ("min", "max"):
+            agg = aggregations.get(f"{field}_{bound}")
+            if agg is not None:
+                facet[bound] = agg.get("value_as_string", agg["value"])
+        facets[field] = facet
+    return facets
+
+def build_full_text_query(user_input):
+    terms = user_input["query_string"].split(' ')  # Split terms by comma
+    fields = user_input["fields"]
+
+    must_queries = []
+    for term in terms:
+        trimmed_term = term.strip()  # Remove any leading/trailing whitespace
+        must_queries.append({
+            "multi_match": {
+                "query": trimmed_term,
+                "fields": fields,
+                "type": "best_fields",
+                "fuzziness": "AUTO"
+            }
+        })
+
+    return {
+        "query": {
+            "bool": {
+                "must": must_queries
+            }
+        }
+    }
+    # return {
+    #     "query": {
+    #         "multi_match": {
+    #             "query": user_input["query_string"],
+    #             "fields": user_input["fields"] + ["^2"],
+    #             "fuzziness": "AUTO",
+    #             "type": "cross_fields",
+    #         }
+    #     }
+    # }
+
+def build_suggest_query(text, field):
+    return {
+        "suggest": {
+            "text": text,
+            field: {
+                "completion": {
+                    "field": field,
+                    "skip_duplicates": True  # This attempts to skip duplicates, but its effectiveness may vary.
+                }
+            }
+        }
+    }
+
+def parse_suggestions(response, field):
+    suggestions = []
+    if response and "suggest" in response and field in response["suggest"]:
+        seen = set()  # Set to track seen suggestions
+        for suggestion in response["suggest"][field][0]["options"]:
+            if suggestion["text"] not in seen:
+                suggestions.append(suggestion["text"])
+                seen.add(suggestion["text"])
+    return suggestions
+
+
+def uses_rollup(name, rollup_index_name):
+    return rollup_index_name is not None and name in ROLLUP_QUERIES
+
+def build_dashboard_msearch(index_name, names, rollup_index_name=None):
+    # One header/body pair per report, sent together as a single _msearch request
+    searches = []
+    for name in names:
+        if uses_rollup(name, rollup_index_name):
+            searches.append({"index": rollup_index_name})
+            searches.append(ROLLUP_QUERIES[name]["body"])
+        else:
+            searches.append({"index": index_name})
+            searches.append(REPORT_QUERIES[name]["body"])
+    return searches
+
+def parse_dashboard_response(response, names, rollup_index_name=None):
+    results = {}
+    for name, item in zip(names, response["responses"]):
+        if "error" in item:
+            log.error(f'{REPORT_QUERIES[name]["error"]}: {item["error"]}')
+            results[name] = None
+        else:
+            results[name] = extract_report(item, name, rollup=uses_rollup(name, rollup_index_name))
+    return results
+
 class ElasticsearchService(object):
     def __init__(self, config):
         self.es = Elasticsearch([{
             'host': config['host'],
             'port': config['port'],
             'scheme': config['scheme']
-        }], basic_auth=config['auth'])
+        }], basic_auth=config['auth'], **ES_CLIENT_SETTINGS)
 
         self.index_mappings_cache = {}  # Cache for storing index mappings
 
+    def close(self):
+        self.es.close()
+
     def create_index(self, index_name):
-        index_mapping = {
-            "mappings": {
-                "properties": {
-                    "hotel": {
-                        "type": "text",
-                        "fields": {
-                            "keyword": {"type": "keyword"}
-                        }
-                    },
-                    "hotel_suggest": {
-                        "type": "completion"
-                    },
-                    "is_canceled": {"type": "integer"},
-                    "lead_time": {"type": "integer"},
-                    "arrival_date": {"type": "date", "format": "yyyy-MM-dd", "fields": {"keyword": {"type": "keyword"}}},
-                    "arrival_date_year": {"type": "integer"},
-                    "arrival_date_month": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
-                    "arrival_date_week_number": {"type": "integer"},
-                    "arrival_date_day_of_month": {"type": "integer"},
-                    "stays_in_weekend_nights": {"type": "integer"},
-                    "stays_in_week_nights": {"type": "integer"},
-                    "adults": {"type": "integer"},
-                    "children": {"type": "float"},
-                    "babies": {"type": "integer"},
-                    "meal": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
-                    "country": {
-                        "type": "text",
-                        "fields": {
-                            "keyword": {"type": "keyword"}
-                        }
-                    },
-                    "country_suggest": {
-                        "type": "completion"
-                    },
-                    "market_segment": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
-                    "distribution_channel": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
-                    "is_repeated_guest": {"type": "integer"},
-                    "previous_cancellations": {"type": "integer"},
-                    "previous_bookings_not_canceled": {"type": "integer"},
-                    "reserved_room_type": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
-                    "assigned_room_type": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
-                    "booking_changes": {"type": "integer"},
-                    "deposit_type": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
-                    "agent": {"type": "float"},
-                    "company": {"type": "float"},
-                    "days_in_waiting_list": {"type": "integer"},
-                    "customer_type": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
-                    "adr": {"type": "float"},
-                    "required_car_parking_spaces": {"type": "integer"},
-                    "total_of_special_requests": {"type": "integer"},
-                    "reservation_status": {
-                        "type": "text",
-                        "fields": {
-                            "keyword": {"type": "keyword"}
-                        }
-                    },
-                    "reservation_status_suggest": {
-                        "type": "completion"
-                    },
-                    "reservation_status_date": {"type": "date", "format": "yyyy-MM-dd", "fields": {"keyword": {"type": "keyword"}}}
-                }
-            }
-        }
-       
+        """
+        Make sure index_name is usable for reads and writes. A new deployment gets a versioned index
+        behind the alias index_name (see rebuild_index); an existing alias or legacy concrete index
+        gets new fields added to its mapping.
+        Returns True when the existing index has no documents_version marker in its _meta for the current
+        DOCUMENTS_VERSION, i.e. its documents lack derived fields until the index is rebuilt. The marker is
+        written by rebuild_index when it completes, not by the mapping update here, so a rebuild that is
+        interrupted (e.g. by a restart) is requested again on the next start.
+        """
         try:
             if not self.es.indices.exists(index=index_name):
-                self.es.indices.create(index=index_name, body=index_mapping)
-                log.info(f'Index {index_name} created in Elasticsearch')
-            else:
-                log.info(f'Index {index_name} exists in Elasticsearch')
-                
+                versioned_index = versioned_index_name(index_name)
+                # An empty index only ever receives current documents
+                mappings = dict(BOOKING_INDEX_MAPPING["mappings"], _meta=documents_meta())
+                self.es.indices.create(index=versioned_index, mappings=mappings, aliases={index_name: {}})
+                log.info(f'Index {versioned_index} created in Elasticsearch behind alias {index_name}')
+                return False
+            mapping = next(iter(self.get_index_mapping(index_name).values()))
+            needs_rebuild = needs_document_rebuild(mapping)
+            # New fields are additive, so existing indices pick them up; documents get them on their next upsert
+            self.es.indices.put_mapping(index=index_name, body=BOOKING_INDEX_MAPPING["mappings"])
+            self.index_mappings_cache.pop(index_name, None)
+            log.info(f'Index {index_name} exists in Elasticsearch')
+            if needs_rebuild:
+                log.info(f'Index {index_name} has not been rebuilt with version {DOCUMENTS_VERSION} of the documents yet')
+            return needs_rebuild
         except Exception as e:
             log.error(f'Error creating index {index_name} in Elasticsearch: {e}')
+        return False
+
+    def alias_indices(self, alias):
+        if not self.es.indices.exists_alias(name=alias):
+            return []
+        return list(self.es.indices.get_alias(name=alias).keys())
+
+    def rebuild_index(self, alias):
+        """
+        Blue/green full reindex: load every booking from Postgres into a new versioned index,
+        then atomically point the alias at it. Readers keep using the old index until the swap and never see a partial load.
+        The new index is loaded without refreshes or replicas, then gets its settings back and is force merged
+        before it goes live. Old indices behind the alias (or a legacy concrete index named like the alias) are deleted.
+        Returns the bulk stats, or None if the load failed and the alias was left untouched.
+        """
+        new_index = versioned_index_name(alias)
+        session = SessionLocal()
+        try:
+            self.es.indices.create(
+                index=new_index,
+                mappings=BOOKING_INDEX_MAPPING["mappings"],
+                settings={"index": ES_REINDEX_SETTINGS['bulk_settings']}
+            )
+            stats = self.run_bulk_pipeline(self.db_to_es_docs(session, new_index), description=f'Rebuild of {alias} into {new_index}', pipeline='rebuild')
+            if stats['failed']:
+                log.error(f'Rebuild of {alias} failed for {stats["failed"]} documents, keeping the current index')
+                self.es.indices.delete(index=new_index)
+                return None
+
+            self.es.indices.put_settings(index=new_index, settings={"index": ES_REINDEX_SETTINGS['live_settings']})
+            # Refresh, force merge and the health wait can take far longer than the client's request timeout,
+            # and retrying a timed out force merge only queues another one
+            timeout = ES_REINDEX_SETTINGS['maintenance_timeout']
+            maintenance = self.es.options(request_timeout=timeout + 30, retry_on_timeout=False)
+            maintenance.indices.refresh(index=new_index)
+            maintenance.indices.forcemerge(index=new_index, max_num_segments=ES_REINDEX_SETTINGS['max_num_segments'])
+            maintenance.cluster.health(index=new_index, wait_for_status=ES_REINDEX_SETTINGS['wait_for_status'], timeout=f'{timeout}s')
+            # Only a complete index is marked as holding current documents, see create_index
+            self.es.indices.put_mapping(index=new_index, meta=documents_meta())
+
+            old_indices = self.alias_indices(alias)
+            actions = [{"add": {"index": new_index, "alias": alias}}]
+            if old_indices:
+                actions = [{"remove": {"index": index, "alias": alias}} for index in old_indices] + actions
+            elif self.es.indices.exists(index=alias):
+                # A concrete index from before aliases is dropped in the same atomic step that creates the alias
+                actions = [{"remove_index": {"index": alias}}] + actions
+            self.es.indices.update_aliases(actions=actions)
+            self.index_mappings_cache.pop(alias, None)
+            log.info(f'Alias {alias} now points at {new_index}')
+
+            for index in old_indices:
+                self.es.indices.delete(index=index)
+                log.info(f'Deleted previous index {index}')
+            return stats
+        except Exception as e:
+            log.error(f'Error rebuilding {alias} into {new_index}: {e}')
+            if self.es.indices.exists(index=new_index) and new_index not in self.alias_indices(alias):
+                self.es.indices.delete(index=new_index)
+            return None
+        finally:
+            session.close()
     
 
     def index_document(self, index_name, document):
@@ -120,72 +553,198 @@ class ElasticsearchService(object):
             self.index_mappings_cache[index_name] = self.es.indices.get_mapping(index=index_name)
         return self.index_mappings_cache[index_name]
 
+    def get_index_properties(self, index_name):
+        mappings = self.get_index_mapping(index_name)
+        # Keyed by the concrete index, which differs from index_name when it is an alias
+        return next(iter(mappings.values()))['mappings']['properties']
+
+    def instance_to_doc(self, instance):
+        # Convert instance to dict and prepare the document
+        doc = {c.name: getattr(instance, c.name) for c in instance.__table__.columns}
+        doc['hotel_suggest'] = {"input": doc['hotel']}
+        doc['country_suggest'] = {"input": doc['country']}
+        doc['reservation_status_suggest'] = {'input': doc['reservation_status']}
+        return add_derived_fields(doc)
+
+    def stream_bookings(self, session, since=None, until=None):
+        # Server-side cursor: rows are fetched DB_FETCH_SIZE at a time instead of all at once
+        query = session.query(HotelBooking)
+        if since is not None:
+            query = query.filter(HotelBooking.updated_at > since)
+        if until is not None:
+            query = query.filter(HotelBooking.updated_at <= until)
+        return query.execution_options(stream_results=True).yield_per(DB_FETCH_SIZE)
+
     def db_to_es_docs(self, session, index_name):
-        documents = []
-        
-        query = session.query(HotelBooking).all()
-        for instance in query:
-            # Convert instance to dict and prepare the document
-            doc = {c.name: getattr(instance, c.name) for c in instance.__table__.columns}
-            doc['hotel_suggest'] = {"input": doc['hotel']}
-            doc['country_suggest'] = {"input": doc['country']}
-            doc['reservation_status_suggest'] = {'input': doc['reservation_status']}
-
-            documents.append({"_index": index_name, "_source": doc})
-        return documents
-    
+        # The row id is the document id, so later upserts from the sync update these documents in place
+        for instance in self.stream_bookings(session):
+            yield {"_index": index_name, "_id": instance.id, "_source": self.instance_to_doc(instance)}
+
+    def run_bulk_pipeline(self, actions, description='bulk', pipeline='bulk'):
+        """
+        Shared parallel indexing pipeline used by the initial load and the scheduled sync.
+        Worker count and chunk sizes (docs and bytes) come from ES_BULK_SETTINGS.
+        Failed items are reported in input order. Returns throughput stats for tuning,
+        which are also exported as metrics labelled with pipeline.
+        """
+        max_errors_logged = ES_BULK_SETTINGS.get('max_errors_logged', 10)
+        start_time = time.perf_counter()
+        succeeded, errors = 0, []
+        results = helpers.parallel_bulk(
+            self.es,
+            actions,
+            thread_count=ES_BULK_SETTINGS['thread_count'],
+            chunk_size=ES_BULK_SETTINGS['chunk_size'],
+            max_chunk_bytes=ES_BULK_SETTINGS['max_chunk_bytes'],
+            raise_on_error=False,
+            raise_on_exception=False
+        )
+        # parallel_bulk yields results in the order the actions were submitted
+        for position, (ok, item) in enumerate(results):
+            if ok:
+                succeeded += 1
+            else:
+                errors.append((position, item))
+        elapsed = time.perf_counter() - start_time
+
+        stats = {
+            "succeeded": succeeded,
+            "failed": len(errors),
+            "seconds": round(elapsed, 3),
+            "docs_per_sec": round((succeeded + len(errors)) / elapsed, 1) if elapsed else 0.0,
+            "thread_count": ES_BULK_SETTINGS['thread_count'],
+            "chunk_size": ES_BULK_SETTINGS['chunk_size'],
+            "max_chunk_bytes": ES_BULK_SETTINGS['max_chunk_bytes'],
+        }
+        log.info(f'{description}: {stats}')
+        observe_bulk(pipeline, stats)
+        for position, item in errors[:max_errors_logged]:
+            log.error(f'{description}: action #{position} failed: {item}')
+        if len(errors) > max_errors_logged:
+            log.error(f'{description}: {len(errors) - max_errors_logged} more failed actions not shown')
+        return stats
+
     def insert_bulk_data_from_db(self, index_name):
-        db_gen = get_db()  # Get the generator for the session
-        session = next(db_gen)  # Advance to the first yield to get the session
+        session = SessionLocal()
 
         documents = self.db_to_es_docs(session, index_name)
         
         try:
-            bulk(self.es, documents)
+            stats = self.run_bulk_pipeline(documents, description=f'Initial load into {index_name}', pipeline='initial_load')
             log.info(f'Data inserted into {index_name} from database')
+            return stats
         except Exception as e:
             log.error(f'Error inserting data into {index_name} from database: {e}')
+            return None
         finally:
-            next(db_gen, None)
+            session.close()
             
 
     # New method for preparing documents for upsert
-    def db_to_es_docs_for_upsert(self, session, index_name):
-        documents = []
-        
-        query = session.query(HotelBooking).all()
-        for instance in query:
-            doc_id = getattr(instance, 'id')  # Assuming 'id' is the unique identifier
-            doc = {c.name: getattr(instance, c.name) for c in instance.__table__.columns}
-            doc['hotel_suggest'] = {"input": doc['hotel']}
-            doc['country_suggest'] = {"input": doc['country']}
-            doc['reservation_status_suggest'] = {'input': doc['reservation_status']}
-
-            documents.append({
+    def db_to_es_docs_for_upsert(self, session, index_name, since=None, until=None):
+        for instance in self.stream_bookings(session, since=since, until=until):
+            yield {
                 "_op_type": "update",
                 "_index": index_name,
-                "_id": doc_id,
-                "doc": doc,
+                "_id": instance.id,
+                "doc": self.instance_to_doc(instance),
                 "doc_as_upsert": True
-            })
-        return documents
+            }
 
     # New method for bulk upsert
-    def bulk_upsert_data_from_db(self, index_name):
-        db_gen = get_db()  # Session management remains unchanged
-        session = next(db_gen)
+    def bulk_upsert_data_from_db(self, index_name, since=None, until=None):
+        session = SessionLocal()
 
-        documents = self.db_to_es_docs_for_upsert(session, index_name)
+        documents = self.db_to_es_docs_for_upsert(session, index_name, since=since, until=until)
         
         try:
-            bulk(self.es, documents)
+            stats = self.run_bulk_pipeline(documents, description=f'Upsert into {index_name}', pipeline='sync')
             log.info(f'Data upserted into {index_name} from database')
+            return stats
         except exceptions.BulkIndexError as e:
             log.error(f'Error during bulk upsert operation: {e}')
         except Exception as e:
             log.error(f'General error during bulk upsert operation: {e}')
         finally:
-            next(db_gen, None)  # Close the session properly
+            session.close()
+        return None
+
+    def create_rollup_index(self, index_name):
+        try:
+            if not self.es.indices.exists(index=index_name):
+                self.es.indices.create(index=index_name, body=ROLLUP_INDEX_MAPPING)
+                log.info(f'Rollup index {index_name} created in Elasticsearch')
+                return True
+            else:
+                log.info(f'Rollup index {index_name} exists in Elasticsearch')
+        except Exception as e:
+            log.error(f'Error creating rollup index {index_name} in Elasticsearch: {e}')
+        return False
+
+    def rollup_query(self, session, days=None):
+        nights = HotelBooking.stays_in_weekend_nights + HotelBooking.stays_in_week_nights
+        dimensions = [getattr(HotelBooking, dimension) for dimension in ROLLUP_DIMENSIONS]
+        query = session.query(
+            *dimensions,
+            func.count().label('bookings'),
+            func.coalesce(func.sum(HotelBooking.is_canceled), 0).label('canceled'),
+            func.coalesce(func.sum(HotelBooking.adr), 0).label('adr_sum'),
+            func.count(HotelBooking.adr).label('adr_count'),
+            func.coalesce(func.sum(nights), 0).label('nights_sum'),
+            func.coalesce(func.sum(HotelBooking.adr * nights), 0).label('revenue_sum'),
+            func.coalesce(func.sum(HotelBooking.lead_time), 0).label('lead_time_sum')
+        ).group_by(*dimensions)
+        if days is not None:
+            query = query.filter(HotelBooking.arrival_date.in_(days))
+        return query.execution_options(stream_results=True).yield_per(DB_FETCH_SIZE)
+
+    def db_to_rollup_docs(self, session, index_name, rolled_up_at, days=None):
+        for row in self.rollup_query(session, days):
+            doc = row._asdict()
+            doc['rolled_up_at'] = rolled_up_at
+            yield {
+                "_index": index_name,
+                "_id": "|".join(str(doc[dimension]) for dimension in ROLLUP_DIMENSIONS),
+                "_source": doc
+            }
+
+    def refresh_rollup(self, index_name, since=None, until=None):
+        """
+        Recompute the rollup buckets of every arrival day touched by rows updated in (since, until],
+        or of all days when no bounds are given, then drop buckets of those days that no longer exist.
+        """
+        session = SessionLocal()
+        try:
+            rolled_up_at = datetime.utcnow()
+            if since is None and until is None:
+                day_batches = [None]
+            else:
+                changed = session.query(HotelBooking.arrival_date).distinct()
+                if since is not None:
+                    changed = changed.filter(HotelBooking.updated_at > since)
+                if until is not None:
+                    changed = changed.filter(HotelBooking.updated_at <= until)
+                days = [row.arrival_date for row in changed]
+                day_batches = [days[i:i + ROLLUP_DAYS_PER_BATCH] for i in range(0, len(days), ROLLUP_DAYS_PER_BATCH)]
+
+            succeeded, failed = 0, 0
+            for days in day_batches:
+                stats = self.run_bulk_pipeline(self.db_to_rollup_docs(session, index_name, rolled_up_at, days), description=f'Rollup into {index_name}', pipeline='rollup')
+                succeeded += stats['succeeded']
+                failed += stats['failed']
+                if stats['failed']:
+                    continue
+                stale = [{"range": {"rolled_up_at": {"lt": rolled_up_at}}}]
+                if days is not None:
+                    stale.append({"terms": {"arrival_date": [day.isoformat() for day in days if day is not None]}})
+                self.es.delete_by_query(index=index_name, query={"bool": {"filter": stale}}, conflicts='proceed', refresh=True)
+            log.info(f'Rollup {index_name} refreshed ({succeeded} buckets written, {failed} failed)')
+            return {"succeeded": succeeded, "failed": failed}
+        except Exception as e:
+            log.error(f'Error refreshing rollup {index_name}: {e}')
+            return None
+        finally:
+            session.close()
 
     def bulk_upsert(self, documents, index_name):
         actions = [
@@ -212,34 +771,8 @@ class ElasticsearchService(object):
             return None
 
     def search_query_command(self, index_name, params):
-        bool_query = {"bool": {"must": [], "should": [], "must_not": []}}
-        
-        # Handling 'must' conditions based on user input
-        for field, value in params.items():
-            if value is not None and field not in ['exclude_fields', 'optional_fields', 'range_fields']:
-                bool_query["bool"]["must"].append({"match": {field: value}})
-        
-        # Handling 'exclude_fields' for 'must_not' conditions
-        exclude_fields = params.get('exclude_fields', {})
-        for field, value in exclude_fields.items():
-            bool_query["bool"]["must_not"].append({"match": {field: value}})
-        
-        # Handling 'optional_fields' for 'should' conditions
-        optional_fields = params.get('optional_fields', {})
-        for field, value in optional_fields.items():
-            bool_query["bool"]["should"].append({"match": {field: value}})
-            bool_query["bool"]["minimum_should_match"] = 1  # Ensure at least one 'should' condition matches if present
-        
-        # Handling 'range_fields' for range conditions
-        range_fields = params.get('range_fields', {})
-        for field, ranges in range_fields.items():
-            range_query = {"range": {field: {}}}
-            for range_type, range_value in ranges.items():
-                range_query["range"][field][range_type] = range_value
-            bool_query["bool"]["must"].append(range_query)
-        
-        query = {"query": bool_query, "size": params.get('size', 10000)}
         try:
+            query = build_search_query(params, self.get_index_properties(index_name))
             response = self.es.search(index=index_name, body=query)
             return response
         except Exception as e:
@@ -247,24 +780,43 @@ class ElasticsearchService(object):
             return None
         
         
+    def search_page(self, index_name, params=None, page_size=None, cursor=None):
+        """
+        One page of a search, paged with search_after on a point in time opened by the first page.
+        Pass the returned next_cursor back to get the following page, its query and page size travel inside it.
+        Raises ValueError for a cursor this service did not issue.
+        """
+        state, page_size = start_search_page(params, page_size, cursor)
+        try:
+            properties = self.get_index_properties(index_name)
+            # The first page opens the point in time and every later page searches it, so all pages see one
+            # snapshot and their sort values carry the same implicit _shard_doc tiebreaker
+            if state["pit_id"] is None:
+                state["pit_id"] = self.es.open_point_in_time(index=index_name, keep_alive=ES_SEARCH_SETTINGS['keep_alive'])["id"]
+            try:
+                response = self.es.search(**search_page_request(index_name, state, page_size, properties))
+            except exceptions.NotFoundError:
+                # The point in time expired between pages, continue from the same sort values on a new one
+                log.info(f'Point in time expired, reopening it on {index_name}')
+                state["pit_id"] = self.es.open_point_in_time(index=index_name, keep_alive=ES_SEARCH_SETTINGS['keep_alive'])["id"]
+                response = self.es.search(**search_page_request(index_name, state, page_size, properties))
+        except Exception as e:
+            log.error(f'Error executing paginated search in {index_name}: {e}')
+            return None
+        page = parse_search_page(response, state, page_size)
+        if page["next_cursor"] is None and state["pit_id"] is not None:
+            try:
+                self.es.close_point_in_time(id=state["pit_id"])
+            except Exception as e:
+                log.error(f'Error closing point in time on {index_name}: {e}')
+        return page
+
     def dynamic_aggregation_query(self, index_name, agg_params):
         # Use the cached mapping or fetch it if not cached
         # mappings = self.es.indices.get_mapping(index=index_name)
-        mappings = self.get_index_mapping(index_name)
-        properties = mappings[index_name]['mappings']['properties']
+        properties = self.get_index_properties(index_name)
 
-        aggs_body = {"aggs": {}, "size": 0}
-        for agg in agg_params['aggregations']:
-            field = agg['field']
-            agg_type = agg['agg_type']
-
-            # Determine if field is a text field with a keyword sub-field
-            if field in properties and 'fields' in properties[field] and 'keyword' in properties[field]['fields']:
-                field_name = f"{field}.keyword"
-            else:
-                field_name = field
-
-            aggs_body["aggs"][f"{field}_{agg_type}"] = {agg_type: {"field": field_name}}
+        aggs_body = build_aggregation_query(properties, agg_params)
 
         try:
             response = self.es.search(index=index_name, body=aggs_body)
@@ -280,524 +832,208 @@ class ElasticsearchService(object):
 
 
     def full_text_search_query(self, index_name, user_input):
-        terms = user_input["query_string"].split(' ')  # Split terms by comma
-        fields = user_input["fields"]
-
-        must_queries = []
-        for term in terms:
-            trimmed_term = term.strip()  # Remove any leading/trailing whitespace
-            must_queries.append({
-                "multi_match": {
-                    "query": trimmed_term,
-                    "fields": fields,
-                    "type": "best_fields",
-                    "fuzziness": "AUTO"
-                }
-            })
-
         try:
-            query = {
-                "query": {
-                    "bool": {
-                        "must": must_queries
-                    }
-                }
-            }
+            query = build_full_text_query(user_input)
             return self.search_data(index_name, query)
-        # try:
-        #     query = {
-        #         "query": {
-        #             "multi_match": {
-        #                 "query": user_input["query_string"],
-        #                 "fields": user_input["fields"] + ["^2"],
-        #                 "fuzziness": "AUTO",
-        #                 "type": "cross_fields",
-        #             }
-        #         }
-        #     }
-        #     return self.search_data(index_name, query)
         except Exception as e:
             log.error(f'Error performing full-text search on {index_name}: {e}')
             return None
 
     def suggest_query(self, index_name, text, field):
-        suggest_body = {
-            "suggest": {
-                "text": text,
-                field: {
-                    "completion": {
-                        "field": field,
-                        "skip_duplicates": True  # This attempts to skip duplicates, but its effectiveness may vary.
-                    }
-                }
-            }
-        }
+        suggest_body = build_suggest_query(text, field)
         try:
             response = self.es.search(index=index_name, body=suggest_body)
-            suggestions = []
-            if response and "suggest" in response and field in response["suggest"]:
-                seen = set()  # Set to track seen suggestions
-                for suggestion in response["suggest"][field][0]["options"]:
-                    if suggestion["text"] not in seen:
-                        suggestions.append(suggestion["text"])
-                        seen.add(suggestion["text"])
-            return suggestions
+            return parse_suggestions(response, field)
         except Exception as e:
             log.error(f'Error suggesting in {index_name}: {e}')
             return None
         
-    def get_cancellation_rate_by_segment_and_type(self, index_name):
-        query_body = {
-            "size": 0,  # We don't need the actual documents, just the aggregations
-            "aggs": {
-                "market_segment": {
-                    "terms": {"field": "market_segment.keyword"},
-                    "aggs": {
-                        "hotel_type": {
-                            "terms": {"field": "hotel.keyword"},
-                            "aggs": {
-                                "cancellation_rate": {
-                                    "avg": {"field": "is_canceled"}
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
-        try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']
-        except Exception as e:
-            log.error(f'Error getting cancellation rate by market segment and hotel type: {e}')
-            return None
-        
-    def get_adr_by_month_and_type(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "months": {
-                    "date_histogram": {
-                        "field": "arrival_date",
-                        "calendar_interval": "month",
-                        "format": "yyyy-MM-dd"
-                    },
-                    "aggs": {
-                        "hotel_type": {
-                            "terms": {"field": "hotel.keyword"},
-                            "aggs": {
-                                "average_adr": {
-                                    "avg": {"field": "adr"}
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
+    def get_facets(self, index_name, fields=FACET_FIELDS, range_fields=FACET_RANGE_FIELDS):
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']
+            properties = self.get_index_properties(index_name)
+            response = self.es.search(index=index_name, body=build_facets_query(properties, fields, range_fields))
+            return parse_facets(response, fields, range_fields)
         except Exception as e:
-            log.error(f'Error getting ADR by month and hotel type: {e}')
+            log.error(f'Error getting facets from {index_name}: {e}')
             return None
 
 
-    def get_top_countries_with_most_bookings(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "top_countries": {
-                    "terms": {
-                        "field": "country.keyword",
-                        "size": 10
-                    }
-                }
-            }
-        }
-        try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']['top_countries']['buckets']
-        except Exception as e:
-            log.error(f'Error getting top countries with most bookings: {e}')
-            return None
+class AsyncElasticsearchService(object):
+    """
+    AsyncElasticsearch-backed counterpart of ElasticsearchService for the FastAPI routes,
+    so concurrent requests overlap their Elasticsearch round-trips instead of blocking the event loop.
+    Query bodies are shared with the synchronous service.
+    """
+    def __init__(self, config):
+        self.es = AsyncElasticsearch([{
+            'host': config['host'],
+            'port': config['port'],
+            'scheme': config['scheme']
+        }], basic_auth=config['auth'], **ES_CLIENT_SETTINGS)
 
+        self.index_mappings_cache = {}  # Cache for storing index mappings
+        self.rollup_index_name = ES_ROLLUP_INDEX_NAME  # None disables the rollup index for reports
 
-    def get_length_of_stay_distribution_simple(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "length_of_stay": {
-                    "terms": {
-                        "script": {
-                            "source": "doc['stays_in_weekend_nights'].value + doc['stays_in_week_nights'].value",
-                            "lang": "painless"
-                        },
-                        "size": 10  # Adjust the size as needed
-                    }
-                }
-            }
-        }
-        try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']['length_of_stay']['buckets']
-        except Exception as e:
-            log.error(f'Error getting simplified length of stay distribution: {e}')
-            return None
-        
-    def get_booking_trends_over_time(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "bookings_over_time": {
-                    "date_histogram": {
-                        "field": "arrival_date",
-                        "calendar_interval": "month",
-                        "format": "yyyy-MM"
-                    }
-                }
-            }
-        }
-        try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']['bookings_over_time']['buckets']
-        except Exception as e:
-            log.error(f'Error getting booking trends over time: {e}')
-            return None
+    async def close(self):
+        await self.es.close()
 
+    async def timed(self, operation, call, **kwargs):
+        start_time = time.perf_counter()
+        response = await call(**kwargs)
+        observe_es_request(operation, response, time.perf_counter() - start_time)
+        return response
 
-    # def get_booking_trends_over_time(self, index_name):
-    #     query_body = {
-    #         "size": 0,
-    #         "aggs": {
-    #             "bookings_over_time": {
-    #                 "date_histogram": {
-    #                     "field": "arrival_date",
-    #                     "calendar_interval": "month",
-    #                     "format": "yyyy-MM"
-    #                 }
-    #             }
-    #         }
-    #     }
-    #     try:
-    #         response = self.es.search(index=index_name, body=query_body)
-    #         return response['aggregations']['bookings_over_time']['buckets']
-    #     except Exception as e:
-    #         log.error(f'Error getting booking trends over time: {e}')
-    #         return None
-
-    def get_special_requests_impact_on_cancellations(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "special_requests": {
-                    "terms": {"field": "total_of_special_requests"},
-                    "aggs": {
-                        "cancellation_rate": {
-                            "avg": {"field": "is_canceled"}
-                        }
-                    }
-                }
-            }
-        }
-        try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']['special_requests']['buckets']
-        except Exception as e:
-            log.error(f'Error getting impact of special requests on cancellations: {e}')
-            return None
+    async def get_index_mapping(self, index_name):
+        if index_name not in self.index_mappings_cache:
+            self.index_mappings_cache[index_name] = await self.es.indices.get_mapping(index=index_name)
+        return self.index_mappings_cache[index_name]
 
+    async def get_index_properties(self, index_name):
+        mappings = await self.get_index_mapping(index_name)
+        # Keyed by the concrete index, which differs from index_name when it is an alias
+        return next(iter(mappings.values()))['mappings']['properties']
 
-    def get_average_lead_time_by_cancellation_status(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "cancellation_status": {
-                    "terms": {"field": "is_canceled"},
-                    "aggs": {
-                        "average_lead_time": {
-                            "avg": {"field": "lead_time"}
-                        }
-                    }
-                }
-            }
-        }
+    async def search_data(self, index_name, query):
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']['cancellation_status']['buckets']
+            response = await self.timed('search_data', self.es.search, index=index_name, body=query)
+            return response
         except Exception as e:
-            log.error(f'Error getting average lead time by cancellation status: {e}')
+            log.error(f'Error searching in {index_name}: {e}')
             return None
 
-    def get_bookings_distribution_by_room_type(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "room_types": {
-                    "terms": {"field": "reserved_room_type.keyword"}
-                }
-            }
-        }
+    async def search_query_command(self, index_name, params):
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']['room_types']['buckets']
+            query = build_search_query(params, await self.get_index_properties(index_name))
+            response = await self.timed('search_query_command', self.es.search, index=index_name, body=query)
+            return response
         except Exception as e:
-            log.error(f'Error getting bookings distribution by room type: {e}')
+            log.error(f'Error executing search query in {index_name}: {e}')
             return None
-        
-    def get_bookings_by_guest_country(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "guest_countries": {
-                    "terms": {
-                        "field": "country.keyword",
-                        "size": 10  # Adjust based on how many top countries you want to analyze
-                    }
-                }
-            }
-        }
+
+    async def search_page(self, index_name, params=None, page_size=None, cursor=None):
+        """
+        One page of a search, paged with search_after on a point in time opened by the first page.
+        Pass the returned next_cursor back to get the following page, its query and page size travel inside it.
+        Raises ValueError for a cursor this service did not issue.
+        """
+        state, page_size = start_search_page(params, page_size, cursor)
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']['guest_countries']['buckets']
+            properties = await self.get_index_properties(index_name)
+            # The first page opens the point in time and every later page searches it, so all pages see one
+            # snapshot and their sort values carry the same implicit _shard_doc tiebreaker
+            if state["pit_id"] is None:
+                state["pit_id"] = (await self.es.open_point_in_time(index=index_name, keep_alive=ES_SEARCH_SETTINGS['keep_alive']))["id"]
+            try:
+                response = await self.timed('search_page', self.es.search, **search_page_request(index_name, state, page_size, properties))
+            except exceptions.NotFoundError:
+                # The point in time expired between pages, continue from the same sort values on a new one
+                log.info(f'Point in time expired, reopening it on {index_name}')
+                state["pit_id"] = (await self.es.open_point_in_time(index=index_name, keep_alive=ES_SEARCH_SETTINGS['keep_alive']))["id"]
+                response = await self.timed('search_page', self.es.search, **search_page_request(index_name, state, page_size, properties))
         except Exception as e:
-            log.error(f'Error getting number of bookings by guest country: {e}')
+            log.error(f'Error executing paginated search in {index_name}: {e}')
             return None
+        page = parse_search_page(response, state, page_size)
+        if page["next_cursor"] is None and state["pit_id"] is not None:
+            try:
+                await self.es.close_point_in_time(id=state["pit_id"])
+            except Exception as e:
+                log.error(f'Error closing point in time on {index_name}: {e}')
+        return page
 
-    def get_booking_source_analysis(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "booking_sources": {
-                    "terms": {
-                        "field": "distribution_channel.keyword",
-                        "size": 5  # Adjust based on the number of channels you want to analyze
-                    }
-                }
-            }
-        }
+    async def scan_search(self, index_name, params, batch_size=None):
+        """
+        Async generator over every hit matching params, one list of hits per batch.
+        Walks a point in time in index order with search_after, so only one batch is held in memory;
+        the point in time is closed when the generator finishes or is closed early.
+        """
+        batch_size = batch_size or ES_SEARCH_SETTINGS['export_batch_size']
+        properties = await self.get_index_properties(index_name)
+        pit_id = (await self.es.open_point_in_time(index=index_name, keep_alive=ES_SEARCH_SETTINGS['keep_alive']))["id"]
+        search_after = None
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']['booking_sources']['buckets']
-        except Exception as e:
-            log.error(f'Error getting booking source analysis: {e}')
-            return None
+            while True:
+                body = build_search_page(params, pit_id, batch_size, search_after, sort=EXPORT_SORT, track_total_hits=False, properties=properties)
+                response = await self.timed('scan_search', self.es.search, body=body)
+                pit_id = response.get("pit_id", pit_id)
+                hits = response['hits']['hits']
+                if hits:
+                    yield hits
+                if len(hits) < batch_size:
+                    return
+                search_after = hits[-1]["sort"]
+        finally:
+            try:
+                await self.es.close_point_in_time(id=pit_id)
+            except Exception as e:
+                log.error(f'Error closing point in time on {index_name}: {e}')
+
+    async def dynamic_aggregation_query(self, index_name, agg_params):
+        properties = await self.get_index_properties(index_name)
+
+        aggs_body = build_aggregation_query(properties, agg_params)
 
-    def get_revenue_analysis_by_room_and_month(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "room_types": {
-                    "terms": {"field": "reserved_room_type.keyword"},
-                    "aggs": {
-                        "monthly_revenue": {
-                            "date_histogram": {
-                                "field": "arrival_date",
-                                "calendar_interval": "month",
-                                "format": "yyyy-MM",
-                                "min_doc_count": 1
-                            },
-                            "aggs": {
-                                "revenue": {
-                                    "sum": {
-                                        "script": {
-                                            "source": "doc['adr'].value * (doc['stays_in_week_nights'].value + doc['stays_in_weekend_nights'].value)",
-                                            "lang": "painless"
-                                        }
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']['room_types']['buckets']
+            response = await self.timed('dynamic_aggregation_query', self.es.search, index=index_name, body=aggs_body)
+            if 'aggregations' in response:
+                return {"aggregations": response['aggregations']}
+            else:
+                log.error(f"No aggregations found in response for {index_name}")
+                return None
         except Exception as e:
-            log.error(f'Error getting revenue analysis by room type and month: {e}')
+            log.error(f'Error performing dynamic aggregation on {index_name}: {e}')
             return None
 
-    def get_impact_of_lead_time_on_adr(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "lead_time_buckets": {
-                    "histogram": {
-                        "field": "lead_time",
-                        "interval": 10,  # Adjust the interval based on your data distribution
-                        "min_doc_count": 1
-                    },
-                    "aggs": {
-                        "average_adr": {
-                            "avg": {"field": "adr"}
-                        }
-                    }
-                }
-            }
-        }
+    async def full_text_search_query(self, index_name, user_input):
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']['lead_time_buckets']['buckets']
+            query = build_full_text_query(user_input)
+            return await self.search_data(index_name, query)
         except Exception as e:
-            log.error(f'Error getting impact of lead time on ADR: {e}')
+            log.error(f'Error performing full-text search on {index_name}: {e}')
             return None
 
-    def get_analyze_repeat_guest_bookings(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "repeat_guests": {
-                    "terms": {
-                        "field": "is_repeated_guest",
-                        "size": 2  # 0 for new guests, 1 for repeat guests
-                    },
-                    "aggs": {
-                        "average_lead_time": {
-                            "avg": {
-                                "field": "lead_time"
-                            }
-                        },
-                        "bookings_by_country": {
-                            "terms": {
-                                "field": "country.keyword"
-                            }
-                        },
-                        "bookings_by_hotel_type": {
-                            "terms": {
-                                "field": "hotel.keyword"
-                            }
-                        }
-                    }
-                }
-            }
-        }
+    async def suggest_query(self, index_name, text, field):
+        suggest_body = build_suggest_query(text, field)
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']
+            response = await self.timed('suggest_query', self.es.search, index=index_name, body=suggest_body)
+            return parse_suggestions(response, field)
         except Exception as e:
-            log.error(f'Error analyzing repeat guest bookings: {e}')
+            log.error(f'Error suggesting in {index_name}: {e}')
             return None
-        
 
-    def get_correlate_adr_with_factors(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "adr_correlation": {
-                    "terms": {
-                        "field": "adr",
-                        "order": {
-                            "_key": "asc"  # Order by ADR ascendingly
-                        }
-                    },
-                    "aggs": {
-                        "cancellation_rate": {
-                            "avg": {
-                                "field": "is_canceled"
-                            }
-                        },
-                        "average_stay_length": {
-                            "avg": {
-                                "script": {
-                                    "source": "doc['stays_in_weekend_nights'].value + doc['stays_in_week_nights'].value",
-                                    "lang": "painless"
-                                }
-                            }
-                        },
-                        "special_requests_count": {
-                            "avg": {
-                                "field": "total_of_special_requests"
-                            }
-                        }
-                    }
-                }
-            }
-        }
+    async def get_facets(self, index_name, fields=FACET_FIELDS, range_fields=FACET_RANGE_FIELDS):
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']
+            properties = await self.get_index_properties(index_name)
+            response = await self.timed('get_facets', self.es.search, index=index_name, body=build_facets_query(properties, fields, range_fields))
+            return parse_facets(response, fields, range_fields)
         except Exception as e:
-            log.error(f'Error correlating ADR with booking factors: {e}')
+            log.error(f'Error getting facets from {index_name}: {e}')
             return None
 
-    def get_correlate_cancelations_with_factors(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "cancellation_correlation": {
-                    "terms": {
-                        "field": "is_canceled",
-                        "size": 2  # 0 for not canceled, 1 for canceled
-                    },
-                    "aggs": {
-                        "average_lead_time": {
-                            "avg": {
-                                "field": "lead_time"
-                            }
-                        },
-                        "average_stay_length": {
-                            "avg": {
-                                "script": {
-                                    "source": "doc['stays_in_weekend_nights'].value + doc['stays_in_week_nights'].value",
-                                    "lang": "painless"
-                                }
-                            }
-                        },
-                        "special_requests_count": {
-                            "avg": {
-                                "field": "total_of_special_requests"
-                            }
-                        }
-                    }
-                }
-            }
-        }
+    async def run_report(self, name, index_name, use_rollup=True):
+        report = REPORT_QUERIES[name]
+        if use_rollup and uses_rollup(name, self.rollup_index_name):
+            try:
+                response = await self.timed(f'report_{name}', self.es.search, index=self.rollup_index_name, body=ROLLUP_QUERIES[name]["body"])
+                return extract_report(response, name, rollup=True)
+            except Exception as e:
+                log.error(f'Error querying {self.rollup_index_name} for {name}, falling back to {index_name}: {e}')
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']
+            response = await self.timed(f'report_{name}', self.es.search, index=index_name, body=report["body"])
+            return extract_report(response, name)
         except Exception as e:
-            log.error(f'Error correlating cancellations with booking factors: {e}')
+            log.error(f'{report["error"]}: {e}')
             return None
-        
-    def get_analyze_booking_composition(self, index_name):
-        query_body = {
-            "size": 0,
-            "aggs": {
-                "booking_composition": {
-                    "terms": {
-                        "script": {
-                            "source": "doc['adults'].value + ' adults, ' + doc['children'].value + ' children, ' + doc['babies'].value + ' babies'",
-                            "lang": "painless"
-                        }
-                    },
-                    "aggs": {
-                        "average_lead_time": {
-                            "avg": {
-                                "field": "lead_time"
-                            }
-                        },
-                        "average_stay_length": {
-                            "avg": {
-                                "script": {
-                                    "source": "doc['stays_in_weekend_nights'].value + doc['stays_in_week_nights'].value",
-                                    "lang": "painless"
-                                }
-                            }
-                        },
-                        "special_requests_count": {
-                            "avg": {
-                                "field": "total_of_special_requests"
-                            }
-                        }
-                    }
-                }
-            }
-        }
+
+    async def get_dashboard_reports(self, index_name, names=None):
+        names = list(names or REPORT_QUERIES)
         try:
-            response = self.es.search(index=index_name, body=query_body)
-            return response['aggregations']
+            response = await self.timed('get_dashboard_reports', self.es.msearch, searches=build_dashboard_msearch(index_name, names, self.rollup_index_name))
+            results = parse_dashboard_response(response, names, self.rollup_index_name)
         except Exception as e:
-            log.error(f'Error analyzing booking composition: {e}')
-            return None
\ No newline at end of file
+            log.error(f'Error getting dashboard reports: {e}')
+            return None
+        for name in names:
+            if results[name] is None and uses_rollup(name, self.rollup_index_name):
+                results[name] = await self.run_report(name, index_name, use_rollup=False)
+        return results
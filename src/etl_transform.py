@@ -0,0 +1,278 @@
+import pandas as pd
+
+# Pure DataFrame transformations for ETLUtils.transform. This module has no database or
+# Elasticsearch imports, so process pool workers can import it cheaply with any start method.
+
+# numerical columns
+CHECK_OUTLIER_VALUES = [
+    'lead_time',
+    'adr',
+    'days_in_waiting_list',
+    'adults',
+    'children',
+    'babies',
+    'previous_cancellations',
+    'previous_bookings_not_canceled'
+]
+
+COUNTRY_NAMES = {
+    "PRT": "Portugal",
+    "GBR": "United Kingdom",
+    "USA": "United States",
+    "ESP": "Spain",
+    "IRL": "Ireland",
+    "FRA": "France",
+    "Unknown": "Unknown", # I added this to handle the missing values
+    "ROU": "Romania",
+    "NOR": "Norway",
+    "OMN": "Oman",
+    "ARG": "Argentina",
+    "POL": "Poland",
+    "DEU": "Germany",
+    "BEL": "Belgium",
+    "CHE": "Switzerland",
+    "CN": "Canada", 
+    "GRC": "Greece",
+    "ITA": "Italy",
+    "NLD": "Netherlands",
+    "DNK": "Denmark",
+    "RUS": "Russia",
+    "SWE": "Sweden",
+    "AUS": "Australia",
+    "EST": "Estonia",
+    "CZE": "Czech Republic",
+    "BRA": "Brazil",
+    "FIN": "Finland",
+    "MOZ": "Mozambique",
+    "BWA": "Botswana",
+    "LUX": "Luxembourg",
+    "SVN": "Slovenia",
+    "ALB": "Albania",
+    "IND": "India",
+    "CHN": "China",
+    "MEX": "Mexico",
+    "MAR": "Morocco",
+    "UKR": "Ukraine",
+    "SMR": "San Marino",
+    "LVA": "Latvia",
+    "PRI": "Puerto Rico",
+    "SRB": "Serbia",
+    "CHL": "Chile",
+    "AUT": "Austria",
+    "BLR": "Belarus",
+    "LTU": "Lithuania",
+    "TUR": "Turkey",
+    "ZAF": "South Africa",
+    "AGO": "Angola",
+    "ISR": "Israel",
+    "CYM": "Cayman Islands",
+    "ZMB": "Zambia",
+    "CPV": "Cape Verde",
+    "ZWE": "Zimbabwe",
+    "DZA": "Algeria",
+    "KOR": "South Korea",
+    "CRI": "Costa Rica",
+    "HUN": "Hungary",
+    "ARE": "United Arab Emirates",
+    "TUN": "Tunisia",
+    "JAM": "Jamaica",
+    "HRV": "Croatia",
+    "HKG": "Hong Kong",
+    "IRN": "Iran",
+    "GEO": "Georgia",
+    "AND": "Andorra",
+    "GIB": "Gibraltar",
+    "URY": "Uruguay",
+    "JEY": "Jersey",
+    "CAF": "Central African Republic",
+    "CYP": "Cyprus",
+    "COL": "Colombia",
+    "GGY": "Guernsey",
+    "KWT": "Kuwait",
+    "NGA": "Nigeria",
+    "MDV": "Maldives",
+    "VEN": "Venezuela",
+    "SVK": "Slovakia",
+    "FJI": "Fiji",
+    "KAZ": "Kazakhstan",
+    "PAK": "Pakistan",
+    "IDN": "Indonesia",
+    "LBN": "Lebanon",
+    "PHL": "Philippines",
+    "SEN": "Senegal",
+    "SYC": "Seychelles",
+    "AZE": "Azerbaijan",
+    "BHR": "Bahrain",
+    "NZL": "New Zealand",
+    "THA": "Thailand",
+    "DOM": "Dominican Republic",
+    "MKD": "North Macedonia",
+    "MYS": "Malaysia",
+    "ARM": "Armenia",
+    "JPN": "Japan",
+    "LKA": "Sri Lanka",
+    "CUB": "Cuba",
+    "CMR": "Cameroon",
+    "BIH": "Bosnia and Herzegovina",
+    "MUS": "Mauritius",
+    "COM": "Comoros",
+    "SUR": "Suriname",
+    "UGA": "Uganda",
+    "BGR": "Bulgaria",
+    "CIV": "Ivory Coast",
+    "JOR": "Jordan",
+    "SYR": "Syria",
+    "SGP": "Singapore",
+    "BDI": "Burundi",
+    "SAU": "Saudi Arabia",
+    "VNM": "Vietnam",
+    "PLW": "Palau",
+    "QAT": "Qatar",
+    "EGY": "Egypt",
+    "PER": "Peru",
+    "MLT": "Malta",
+    "MWI": "Malawi",
+    "ECU": "Ecuador",
+    "MDG": "Madagascar",
+    "ISL": "Iceland",
+    "UZB": "Uzbekistan",
+    "NPL": "Nepal",
+    "BHS": "Bahamas",
+    "MAC": "Macao",
+    "TGO": "Togo",
+    "TWN": "Taiwan",
+    "DJI": "Djibouti",
+    "STP": "Sao Tome and Principe",
+    "KNA": "Saint Kitts and Nevis",
+    "ETH": "Ethiopia",
+    "IRQ": "Iraq",
+    "HND": "Honduras",
+    "RWA": "Rwanda",
+    "KHM": "Cambodia",
+    "MCO": "Monaco",
+    "BGD": "Bangladesh",
+    "IMN": "Isle of Man",
+    "TJK": "Tajikistan",
+    "NIC": "Nicaragua",
+    "BEN": "Benin",
+    "VGB": "British Virgin Islands",
+    "TZA": "Tanzania",
+    "GAB": "Gabon",
+    "GHA": "Ghana",
+    "TMP": "East Timor",
+    "GLP": "Guadeloupe",
+    "KEN": "Kenya",
+    "LIE": "Liechtenstein",
+    "GNB": "Guinea-Bissau",
+    "MNE": "Montenegro",
+    "UMI": "United States Minor Outlying Islands",
+    "MYT": "Mayotte",
+    "FRO": "Faroe Islands",
+    "MMR": "Myanmar",
+    "PAN": "Panama",
+    "BFA": "Burkina Faso",
+    "LBY": "Libya",
+    "MLI": "Mali",
+    "NAM": "Namibia",
+    "BOL": "Bolivia",
+    "PRY": "Paraguay",
+    "BRB": "Barbados",
+    "ABW": "Aruba",
+    "AIA": "Anguilla",
+    "SLV": "El Salvador",
+    "DMA": "Dominica",
+    "PYF": "French Polynesia",
+    "GUY": "Guyana",
+    "LCA": "Saint Lucia",
+    "ATA": "Antarctica",
+    "GTM": "Guatemala",
+    "ASM": "American Samoa",
+    "MRT": "Mauritania",
+    "NCL": "New Caledonia",
+    "KIR": "Kiribati",
+    "SDN": "Sudan",
+    "ATF": "French Southern Territories",
+    "SLE": "Sierra Leone",
+    "LAO": "Laos"
+}
+
+
+# It will enable us to take the necessary actions to suppress the outliers in the data set.
+# It is useful if we want to use this dataset with a machine learning model in the future.
+
+def outlier_thresholds(dataframe, variable):
+    quartile1 = dataframe[variable].quantile(0.01)
+    quartile3 = dataframe[variable].quantile(0.99)
+    interquantile_range = quartile3 - quartile1
+
+    upper_limit = quartile3 + 1.5 * interquantile_range
+    lower_limit = quartile1 - 1.5 * interquantile_range
+    return lower_limit, upper_limit
+
+def fill_missing_values(data, children_median):
+    # Handling missing values for 'children' by replacing them with the median value
+    data['children'] = data['children'].fillna(children_median)
+
+    # For 'country', we'll replace missing values with 'Unknown'
+    data['country'] = data['country'].fillna('Unknown')
+
+    # For 'agent' and 'company', missing values may indicate bookings without agents or companies,
+    # so I'll replace them with 0 to indicate 'No agent' or 'No company' because they can be considered as categorical variables
+    data['agent'] = data['agent'].fillna(0)
+    data['company'] = data['company'].fillna(0)
+    return data
+
+def transform_statistics(data):
+    """
+    Whole-dataset statistics the chunks of a transform share: whether nulls are filled and with which
+    children median, and for every outlier column whether it has outliers and its clipping thresholds.
+    Computed once on the full upload so chunked and single-pass transforms give the same result.
+    """
+    fill_missing = bool(data.isnull().sum().sum() > 0)
+    children_median = data['children'].median() if fill_missing else None
+
+    outliers = {}
+    for col in CHECK_OUTLIER_VALUES:
+        column = data[[col]]
+        if fill_missing and col == 'children':
+            column = column.fillna(children_median)
+        lower_limit, upper_limit = outlier_thresholds(column, col)
+        values = column[col]
+        # Same selection as the original check: rows below the lower limit, or above it if the upper limit is below 1
+        selected = data[((values > upper_limit) > upper_limit) | (values < lower_limit)]
+        if fill_missing:
+            selected = fill_missing_values(selected.copy(), children_median)
+        has_outliers = bool(selected.any(axis=None))
+        outliers[col] = (has_outliers, lower_limit, upper_limit)
+
+    return {"fill_missing": fill_missing, "children_median": children_median, "outliers": outliers}
+
+def transform_chunk(data, statistics):
+    """
+    Clean one chunk of an upload with statistics from transform_statistics. Chunks are independent,
+    so they can run in separate processes and be concatenated in order afterwards.
+    """
+    if statistics["fill_missing"]:
+        data = fill_missing_values(data, statistics["children_median"])
+
+    #make sure that no nulls are left
+    assert data.isnull().sum().sum() == 0
+
+    for col, (has_outliers, lower_limit, upper_limit) in statistics["outliers"].items():
+        if has_outliers:
+            data.loc[(data[col] > upper_limit), col] = round(upper_limit)
+            data.loc[(data[col] < lower_limit), col] = round(lower_limit)
+
+    data['country'] = data['country'].map(COUNTRY_NAMES)
+
+    #split the arrival date into year, month and day
+    data['arrival_date'] = pd.to_datetime(data['arrival_date_year'].astype(str) + '-' + data['arrival_date_month'] + '-' + data['arrival_date_day_of_month'].astype(str))
+
+    return data
+
+def transform_file(path):
+    """
+    Extract and transform one booking export in a worker process, returning the cleaned DataFrame.
+    """
+    data = pd.read_csv(path)
+    return transform_chunk(data, transform_statistics(data))
@@ -1,17 +1,36 @@
+import os, glob, time, multiprocessing
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import repeat
 from logger_setup import Logger
-from io import StringIO
-from config import DATA_FOLDER_PATH
-from models import get_db, insert_data
-from sqlalchemy.orm import Session
-from main import sync_sql_to_elasticsearch
+from config import ETL_SETTINGS
+from etl_transform import transform_statistics, transform_chunk, transform_file
+from models import session_scope, insert_dataframe, bump_data_version
+from data_lake import DataLake
+from metrics import observe_etl_load, push_metrics
 
 
 log = Logger(__name__, './logs/etl.log').get_logger()
 
+# Transform workers are spawned rather than forked: the web app and the API call the ETL from
+# multi-threaded processes, and a forked child can inherit locks held by other threads and deadlock
+TRANSFORM_CONTEXT = multiprocessing.get_context('spawn')
+
+# Parquet archiving of uploads runs in the background, so the database load does not wait for it
+archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='etl-archive')
+
+def archive_to_lake(data):
+    try:
+        files = DataLake().write(data)
+        log.info(f'Cleaned data archived to {len(files)} parquet files')
+        return files
+    except Exception as e:
+        log.error(f'Error archiving data to the data lake: {e}')
+        return None
+
 class ETLUtils(object):
     def __init__(self):
-        pass 
+        self.archive_future = None  # Future of the last upload's data lake archive, resolves to its file paths
 
     def extract(self, uploaded_file):
         if uploaded_file is not None:
@@ -23,291 +42,142 @@ class ETLUtils(object):
                 log.error(f'Error loading data: {e}')
                 raise e
     
-    def transform(self, data):
-        #check nulls in data
-        missing_values = data.isnull().sum()
-
-        #if all rows missing value isn't 0, drop them
-        if missing_values.sum() > 0:
-            # Handling missing values for 'children' by replacing them with the median value
-            data['children'] = data['children'].fillna(data['children'].median())
-
-            # For 'country', we'll replace missing values with 'Unknown'
-            data['country'] = data['country'].fillna('Unknown')
-
-            # For 'agent' and 'company', missing values may indicate bookings without agents or companies,
-            # so I'll replace them with 0 to indicate 'No agent' or 'No company' because they can be considered as categorical variables
-            data['agent'] = data['agent'].fillna(0)
-            data['company'] = data['company'].fillna(0)
-            
-        #make sure that no nulls are left
-        assert data.isnull().sum().sum() == 0
-
-        # It will enable us to take the necessary actions to suppress the outliers in the data set.
-        # It is useful if we want to use this dataset with a machine learning model in the future.
-
-        def outlier_thresholds(dataframe, variable):
-            quartile1 = dataframe[variable].quantile(0.01)
-            quartile3 = dataframe[variable].quantile(0.99)
-            interquantile_range = quartile3 - quartile1
-
-            upper_limit = quartile3 + 1.5 * interquantile_range
-            lower_limit = quartile1 - 1.5 * interquantile_range
-            return lower_limit, upper_limit
-
-        def replace_with_thresholds(dataframe, variable):
-            lower_limit, upper_limit = outlier_thresholds(dataframe, variable)
-            dataframe.loc[(dataframe[variable] > upper_limit), variable] = round(upper_limit)
-            dataframe.loc[(dataframe[variable] < lower_limit), variable] = round(lower_limit)
-
-        # numerical columns
-        check_outlier_values = [
-            'lead_time',
-            'adr',
-            'days_in_waiting_list',
-            'adults',
-            'children',
-            'babies',
-            'previous_cancellations',
-            'previous_bookings_not_canceled'
-        ]
-
-        def check_outlier(dataframe, col_name):
-            lower_limit, upper_limit = outlier_thresholds(dataframe, col_name)
-            if dataframe[((dataframe[col_name] > upper_limit) > upper_limit) | (dataframe[col_name] < lower_limit)].any(axis=None):
-                return True
-            else:
-                return False
-            
-        for col in check_outlier_values:
-            has_outliers = check_outlier(data, col)
+    def transform(self, data, workers=None, chunk_size=None):
+        """
+        Clean an upload. Statistics that need the whole dataset (children median, outlier thresholds)
+        are computed first, then the row-wise work runs on chunks of chunk_size rows spread over
+        a pool of worker processes; small uploads are transformed in this process.
+        """
+        workers = workers or ETL_SETTINGS['workers']
+        chunk_size = chunk_size or ETL_SETTINGS['chunk_size']
+
+        statistics = transform_statistics(data)
+        for col, (has_outliers, _, _) in statistics["outliers"].items():
             log.info(f"Outliers in {col} column: {has_outliers}")
             if has_outliers:
-                replace_with_thresholds(data, col)
-                log.info(f"Outliers in {col} column were suppressed.")
-
-        country_names = {
-            "PRT": "Portugal",
-            "GBR": "United Kingdom",
-            "USA": "United States",
-            "ESP": "Spain",
-            "IRL": "Ireland",
-            "FRA": "France",
-            "Unknown": "Unknown", # I added this to handle the missing values
-            "ROU": "Romania",
-            "NOR": "Norway",
-            "OMN": "Oman",
-            "ARG": "Argentina",
-            "POL": "Poland",
-            "DEU": "Germany",
-            "BEL": "Belgium",
-            "CHE": "Switzerland",
-            "CN": "Canada", 
-            "GRC": "Greece",
-            "ITA": "Italy",
-            "NLD": "Netherlands",
-            "DNK": "Denmark",
-            "RUS": "Russia",
-            "SWE": "Sweden",
-            "AUS": "Australia",
-            "EST": "Estonia",
-            "CZE": "Czech Republic",
-            "BRA": "Brazil",
-            "FIN": "Finland",
-            "MOZ": "Mozambique",
-            "BWA": "Botswana",
-            "LUX": "Luxembourg",
-            "SVN": "Slovenia",
-            "ALB": "Albania",
-            "IND": "India",
-            "CHN": "China",
-            "MEX": "Mexico",
-            "MAR": "Morocco",
-            "UKR": "Ukraine",
-            "SMR": "San Marino",
-            "LVA": "Latvia",
-            "PRI": "Puerto Rico",
-            "SRB": "Serbia",
-            "CHL": "Chile",
-            "AUT": "Austria",
-            "BLR": "Belarus",
-            "LTU": "Lithuania",
-            "TUR": "Turkey",
-            "ZAF": "South Africa",
-            "AGO": "Angola",
-            "ISR": "Israel",
-            "CYM": "Cayman Islands",
-            "ZMB": "Zambia",
-            "CPV": "Cape Verde",
-            "ZWE": "Zimbabwe",
-            "DZA": "Algeria",
-            "KOR": "South Korea",
-            "CRI": "Costa Rica",
-            "HUN": "Hungary",
-            "ARE": "United Arab Emirates",
-            "TUN": "Tunisia",
-            "JAM": "Jamaica",
-            "HRV": "Croatia",
-            "HKG": "Hong Kong",
-            "IRN": "Iran",
-            "GEO": "Georgia",
-            "AND": "Andorra",
-            "GIB": "Gibraltar",
-            "URY": "Uruguay",
-            "JEY": "Jersey",
-            "CAF": "Central African Republic",
-            "CYP": "Cyprus",
-            "COL": "Colombia",
-            "GGY": "Guernsey",
-            "KWT": "Kuwait",
-            "NGA": "Nigeria",
-            "MDV": "Maldives",
-            "VEN": "Venezuela",
-            "SVK": "Slovakia",
-            "FJI": "Fiji",
-            "KAZ": "Kazakhstan",
-            "PAK": "Pakistan",
-            "IDN": "Indonesia",
-            "LBN": "Lebanon",
-            "PHL": "Philippines",
-            "SEN": "Senegal",
-            "SYC": "Seychelles",
-            "AZE": "Azerbaijan",
-            "BHR": "Bahrain",
-            "NZL": "New Zealand",
-            "THA": "Thailand",
-            "DOM": "Dominican Republic",
-            "MKD": "North Macedonia",
-            "MYS": "Malaysia",
-            "ARM": "Armenia",
-            "JPN": "Japan",
-            "LKA": "Sri Lanka",
-            "CUB": "Cuba",
-            "CMR": "Cameroon",
-            "BIH": "Bosnia and Herzegovina",
-            "MUS": "Mauritius",
-            "COM": "Comoros",
-            "SUR": "Suriname",
-            "UGA": "Uganda",
-            "BGR": "Bulgaria",
-            "CIV": "Ivory Coast",
-            "JOR": "Jordan",
-            "SYR": "Syria",
-            "SGP": "Singapore",
-            "BDI": "Burundi",
-            "SAU": "Saudi Arabia",
-            "VNM": "Vietnam",
-            "PLW": "Palau",
-            "QAT": "Qatar",
-            "EGY": "Egypt",
-            "PER": "Peru",
-            "MLT": "Malta",
-            "MWI": "Malawi",
-            "ECU": "Ecuador",
-            "MDG": "Madagascar",
-            "ISL": "Iceland",
-            "UZB": "Uzbekistan",
-            "NPL": "Nepal",
-            "BHS": "Bahamas",
-            "MAC": "Macao",
-            "TGO": "Togo",
-            "TWN": "Taiwan",
-            "DJI": "Djibouti",
-            "STP": "Sao Tome and Principe",
-            "KNA": "Saint Kitts and Nevis",
-            "ETH": "Ethiopia",
-            "IRQ": "Iraq",
-            "HND": "Honduras",
-            "RWA": "Rwanda",
-            "KHM": "Cambodia",
-            "MCO": "Monaco",
-            "BGD": "Bangladesh",
-            "IMN": "Isle of Man",
-            "TJK": "Tajikistan",
-            "NIC": "Nicaragua",
-            "BEN": "Benin",
-            "VGB": "British Virgin Islands",
-            "TZA": "Tanzania",
-            "GAB": "Gabon",
-            "GHA": "Ghana",
-            "TMP": "East Timor",
-            "GLP": "Guadeloupe",
-            "KEN": "Kenya",
-            "LIE": "Liechtenstein",
-            "GNB": "Guinea-Bissau",
-            "MNE": "Montenegro",
-            "UMI": "United States Minor Outlying Islands",
-            "MYT": "Mayotte",
-            "FRO": "Faroe Islands",
-            "MMR": "Myanmar",
-            "PAN": "Panama",
-            "BFA": "Burkina Faso",
-            "LBY": "Libya",
-            "MLI": "Mali",
-            "NAM": "Namibia",
-            "BOL": "Bolivia",
-            "PRY": "Paraguay",
-            "BRB": "Barbados",
-            "ABW": "Aruba",
-            "AIA": "Anguilla",
-            "SLV": "El Salvador",
-            "DMA": "Dominica",
-            "PYF": "French Polynesia",
-            "GUY": "Guyana",
-            "LCA": "Saint Lucia",
-            "ATA": "Antarctica",
-            "GTM": "Guatemala",
-            "ASM": "American Samoa",
-            "MRT": "Mauritania",
-            "NCL": "New Caledonia",
-            "KIR": "Kiribati",
-            "SDN": "Sudan",
-            "ATF": "French Southern Territories",
-            "SLE": "Sierra Leone",
-            "LAO": "Laos"
-        }
+                log.info(f"Outliers in {col} column will be suppressed.")
 
-        data['country'] = data['country'].map(country_names)
-
-        #split the arrival date into year, month and day
-        data['arrival_date'] = pd.to_datetime(data['arrival_date_year'].astype(str) + '-' + data['arrival_date_month'] + '-' + data['arrival_date_day_of_month'].astype(str))
+        if workers > 1 and len(data) > chunk_size:
+            chunks = [data.iloc[start:start + chunk_size] for start in range(0, len(data), chunk_size)]
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=TRANSFORM_CONTEXT) as executor:
+                data = pd.concat(executor.map(transform_chunk, chunks, repeat(statistics)))
+            log.info(f'Transformed {len(data)} rows in {len(chunks)} chunks on {min(workers, len(chunks))} processes')
+        else:
+            data = transform_chunk(data, statistics)
 
         return data
     
-    def load(self, data):
-        #save the cleaned data to a csv file with timestamp
-        timestamp = pd.Timestamp.now().strftime("%Y%m%d%H%M%S")
-        filename = "".join([DATA_FOLDER_PATH, "hotel_bookings_clean_", timestamp, ".csv"])
-        try:
-            data.to_csv(filename, index=False)
-            log.info(f'Cleaned data saved to {filename}')
-            
-        except Exception as e:
-            log.error(f'Error saving data: {e}')
-            raise e
+    def load(self, data, progress_callback=None):
+        #archive the cleaned data to the partitioned parquet data lake while it is inserted into the database
+        self.archive_future = archive_executor.submit(archive_to_lake, data)
 
         is_success = False
         
         #insert the cleaned data to the database
-        db: Session = next(get_db())
         try:
-            insert_data(data_path=filename, db=db)
+            start_time = time.perf_counter()
+            with session_scope() as db:
+                inserted = insert_dataframe(db, data, progress_callback=progress_callback)
+                bump_data_version(db)
+            observe_etl_load('upload', len(data), inserted, time.perf_counter() - start_time)
+            push_metrics('etl_upload')
             log.info(f'Uploaded new data cleaned and inserted into the database')
             is_success = True
             return is_success
         except Exception as e:
             log.error(f'Error inserting new data into the database: {e}')
             raise e
-        finally:
-            db.close()
-            is_success = False          
         
-    def run_etl_flow(self, uploaded_file):
+    def run_etl_flow(self, uploaded_file, progress_callback=None):
         raw_data = self.extract(uploaded_file)
         transformed_data = self.transform(raw_data)
-        success_flag = self.load(transformed_data)    
+        success_flag = self.load(transformed_data, progress_callback=progress_callback)    
         return transformed_data, success_flag
 
-
-
-        
\ No newline at end of file
+    @staticmethod
+    def list_batch_files(directory):
+        return sorted(glob.glob(os.path.join(directory, '*.csv')))
+
+    def load_batch_file(self, path, data):
+        # Runs on one of the bounded DB writer threads, each with its own session; the file is archived
+        # by the single lake writer meanwhile and its frame is only released once both are done
+        archive = archive_executor.submit(archive_to_lake, data)
+        start_time = time.perf_counter()
+        with session_scope() as db:
+            rows = insert_dataframe(db, data)
+        seconds = time.perf_counter() - start_time
+        observe_etl_load('batch', len(data), rows, seconds)
+        archive.result()
+        return rows, seconds
+
+    def run_batch_etl(self, paths, workers=None, db_writers=None):
+        """
+        ETL for many booking exports at once, e.g. a nightly drop: paths is a directory (all *.csv in it)
+        or a list of files. Files are extracted and transformed across a pool of worker processes and
+        loaded as they finish through at most db_writers concurrent database sessions.
+        At most workers + 2 * db_writers files are in flight, from the start of their transform to the end of
+        their load, so a slow database holds back the transforms instead of piling up transformed frames.
+        Returns a summary with a status entry per file; a failed file does not stop the others.
+        """
+        if isinstance(paths, (str, os.PathLike)) and os.path.isdir(paths):
+            paths = self.list_batch_files(paths)
+        paths = [str(path) for path in paths]
+        workers = workers or ETL_SETTINGS['workers']
+        db_writers = db_writers or ETL_SETTINGS['db_writers']
+        max_in_flight = workers + 2 * db_writers
+
+        start_time = time.perf_counter()
+        statuses = {path: {"file": path, "status": "pending", "rows": 0, "seconds": None, "error": None} for path in paths}
+        pending = iter(paths)
+        transforms, loads = {}, {}
+        with ProcessPoolExecutor(max_workers=workers, mp_context=TRANSFORM_CONTEXT) as transform_pool, ThreadPoolExecutor(max_workers=db_writers) as writer_pool:
+            while True:
+                # Start transforms only while there is room, the rest of the files stay on disk
+                while len(transforms) + len(loads) < max_in_flight:
+                    path = next(pending, None)
+                    if path is None:
+                        break
+                    transforms[transform_pool.submit(transform_file, path)] = path
+                if not transforms and not loads:
+                    break
+                done, _ = wait(list(transforms) + list(loads), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in transforms:
+                        path = transforms.pop(future)
+                        try:
+                            data = future.result()
+                        except Exception as e:
+                            log.error(f'Error transforming {path}: {e}')
+                            statuses[path].update(status="failed", error=f'transform: {e}')
+                            continue
+                        statuses[path]["status"] = "transformed"
+                        loads[writer_pool.submit(self.load_batch_file, path, data)] = path
+                        continue
+                    path = loads.pop(future)
+                    try:
+                        rows, seconds = future.result()
+                    except Exception as e:
+                        log.error(f'Error loading {path} into the database: {e}')
+                        statuses[path].update(status="failed", error=f'load: {e}')
+                        continue
+                    statuses[path].update(status="loaded", rows=rows, seconds=round(seconds, 2))
+                    log.info(f'Loaded {rows} rows from {path} in {seconds:.2f} sec')
+
+        seconds = time.perf_counter() - start_time
+        rows = sum(status["rows"] for status in statuses.values())
+        if rows:
+            # One version bump for the whole batch, so caches are dropped once
+            with session_scope() as db:
+                bump_data_version(db)
+
+        summary = {
+            "files": list(statuses.values()),
+            "loaded": sum(status["status"] == "loaded" for status in statuses.values()),
+            "failed": sum(status["status"] == "failed" for status in statuses.values()),
+            "rows": rows,
+            "seconds": round(seconds, 2),
+            "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else None
+        }
+        log.info(f'Batch ETL: {summary["loaded"]} of {len(paths)} files loaded, {rows} rows in {seconds:.2f} sec ({summary["rows_per_sec"]} rows/sec)')
+        push_metrics('etl_batch')
+        return summary
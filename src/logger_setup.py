@@ -6,7 +6,7 @@ class Logger:
         """
         Initialize a Logger instance.
         """
-        # self.ensure_dir(log_file)
+        self.ensure_dir(log_file)
         self.logger = logging.getLogger(name)
         self.logger.setLevel(level)
         self.setup_file_handler(log_file, level)
@@ -14,6 +14,12 @@ class Logger:
             self.setup_console_handler(level)
 
 
+    def ensure_dir(self, log_file):
+        """
+        Create the folder of the log file, e.g. logs/ when a test run imports the modules from a fresh checkout.
+        """
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+
     def setup_file_handler(self, log_file, level):
         """
         Set up file handler for logging to a file.
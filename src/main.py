@@ -1,56 +1,74 @@
-from fastapi import FastAPI
-from api_routes import router
+import time
+from fastapi import FastAPI, Request
+from prometheus_client import make_asgi_app
+from api_routes import router, columnar_report_service, uses_columnar_backend
 from logger_setup import Logger
-from models import HotelBooking, get_db, insert_data #, is_initial_data_inserted
-from sqlalchemy.orm import Session
+from models import HotelBooking, create_tables, session_scope, insert_frames, insert_dataframe, BOOKING_COLUMNS, get_sync_watermark, set_sync_watermark, bump_data_version, load_data_version, ensure_booking_hashes, pool_status #, is_initial_data_inserted
 from apscheduler.schedulers.background import BackgroundScheduler
-from elasticsearch_operations import ElasticsearchService
-from config import ELASTICSEARCH_SETTINGS, ES_INDEX_NAME, DATA_PATH
+from services import services
+from data_lake import DataLake
+from metrics import observe_request, timed_job, track_db_pool
+from config import ES_INDEX_NAME, ES_ROLLUP_INDEX_NAME, DATA_PATH
 
 # Initialize the logger
 log_api, log_db, log_es = Logger(__name__, './logs/api.log').get_logger(), Logger(__name__, './logs/db.log').get_logger(), Logger(__name__, './logs/elasticsearch.log').get_logger()
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import itertools
-from models import get_db, HotelBooking
-from sqlalchemy.orm import Session
-
-def chunk_data(data, size):
-    it = iter(data)
-    for i in itertools.count():
-        batch = list(itertools.islice(it, size))
-        if not batch:
-            break
-        yield batch
-
-def upsert_chunk(es_service, index_name, chunk):
-    # Transform each SQL model instance in the chunk to a dict suitable for Elasticsearch
-    documents = [instance_to_dict(instance) for instance in chunk]
-    es_service.bulk_upsert(documents, index_name)
-
-def instance_to_dict(instance):
-    instance_dict = instance.__dict__
-    instance_dict.pop('_sa_instance_state', None)
-    return instance_dict
+from datetime import timedelta
+from sqlalchemy import func
+import pandas as pd
 
+# Rows touched shortly before the previous watermark are re-sent, so transactions that
+# committed late with an earlier now() are not missed. Upserts make the overlap harmless.
+SYNC_WATERMARK_OVERLAP = timedelta(minutes=5)
+
+@timed_job('sync_sql_to_elasticsearch')
 def sync_sql_to_elasticsearch():
-    db: Session = next(get_db())
-    all_data = db.query(HotelBooking).all()
-    chunks = list(chunk_data(all_data, 2500))  #chunk size can be adjusted but I found 2500 as optimal value
-    
-    es_service = ElasticsearchService(ELASTICSEARCH_SETTINGS)
-
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(upsert_chunk, es_service, ES_INDEX_NAME, chunk) for chunk in chunks]
-        
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                print(f"Operation failed: {e}")
+    with session_scope() as db:
+        watermark = get_sync_watermark(db, ES_INDEX_NAME)
+        new_watermark = db.query(func.max(HotelBooking.updated_at)).scalar()
+        if new_watermark is None:
+            log_es.info("No data to sync to Elasticsearch")
+            return
+
+        since = watermark - SYNC_WATERMARK_OVERLAP if watermark is not None else None
+        es_service = services.es
+        stats = es_service.bulk_upsert_data_from_db(ES_INDEX_NAME, since=since, until=new_watermark)
+        rollup_ok = True
+        if ES_ROLLUP_INDEX_NAME is not None and stats is not None and stats['failed'] == 0:
+            rollup_stats = es_service.refresh_rollup(ES_ROLLUP_INDEX_NAME, since=since, until=new_watermark)
+            rollup_ok = rollup_stats is not None and rollup_stats['failed'] == 0
+
+        # Only move the watermark forward when every changed row reached Elasticsearch
+        if stats is not None and stats['failed'] == 0 and rollup_ok:
+            set_sync_watermark(db, ES_INDEX_NAME, new_watermark)
+            if stats['succeeded']:
+                version = bump_data_version(db)
+                if uses_columnar_backend():
+                    columnar_report_service.refresh(version)
+            log_es.info(f"Synced {stats['succeeded']} changed rows to Elasticsearch up to {new_watermark}")
+
+def rebuild_search_index():
+    """
+    Full blue/green rebuild of ES_INDEX_NAME from Postgres (see ElasticsearchService.rebuild_index).
+    The sync watermark is moved back to the state the rebuild started from, so rows changed
+    while it was loading are re-sent to the new index by the next sync.
+    """
+    with session_scope() as db:
+        watermark = db.query(func.max(HotelBooking.updated_at)).scalar()
+        es_service = services.es
+        stats = es_service.rebuild_index(ES_INDEX_NAME)
+        if stats is None:
+            return None
+        set_sync_watermark(db, ES_INDEX_NAME, watermark)
+        version = bump_data_version(db)
+        if uses_columnar_backend():
+            columnar_report_service.refresh(version)
+        log_es.info(f"Rebuilt {ES_INDEX_NAME} with {stats['succeeded']} documents in {stats['seconds']} sec")
+        return stats
+
+scheduler = BackgroundScheduler()
 
 def start_scheduler():
-    scheduler = BackgroundScheduler()
     scheduler.add_job(sync_sql_to_elasticsearch, 'interval', hours=1)
     scheduler.start()
         
@@ -59,15 +77,33 @@ def start_scheduler():
 try:
     app = FastAPI(title="Hotel Booking API", version="1.0")
     app.include_router(router, prefix="/api/v1")
+    app.mount("/metrics", make_asgi_app())
+    track_db_pool(pool_status)
 except Exception as e:
     log_api.error(f'Error initializing FastAPI app: {e}')
     raise e
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start_time = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, e.g. /api/v1/reports/top_countries, so unmatched paths do not add series
+        route = request.scope.get("route")
+        if route is not None:
+            observe_request(request.method, route.path, status, time.perf_counter() - start_time)
+
 @app.on_event("startup")
 async def startup_event():
     try:
-        es_service = ElasticsearchService(ELASTICSEARCH_SETTINGS)
-        es_service.create_index(index_name=ES_INDEX_NAME)
+        create_tables()
+        es_service = services.es
+        needs_rebuild = es_service.create_index(index_name=ES_INDEX_NAME)
+        rollup_created = ES_ROLLUP_INDEX_NAME is not None and es_service.create_rollup_index(index_name=ES_ROLLUP_INDEX_NAME)
         # es_service.insert_bulk_data_from_db(index_name=ES_INDEX_NAME)
         
         start_scheduler()
@@ -75,18 +111,51 @@ async def startup_event():
         flag = True
 
         if flag:
-            db: Session = next(get_db())
-            if not db.query(HotelBooking).first():
-                log_db.info("Inserting initial data into the database")
-                insert_data(data_path=str(DATA_PATH), db=db)
-                es_service.insert_bulk_data_from_db(index_name=ES_INDEX_NAME)
-                log_db.info("Initial data inserted into the database")
-                flag = False
-            else:
-                log_db.info("Initial data already inserted into the database")
+            with session_scope() as db:
+                # Hash rows stored without a booking_hash and create the unique index that the deduplicating
+                # loads below insert against (ON CONFLICT (booking_hash)); rows are only hashed, never removed
+                ensure_booking_hashes(db)
+                if not db.query(HotelBooking).first():
+                    log_db.info("Inserting initial data into the database")
+                    lake = DataLake()
+                    if lake.is_empty():
+                        # Seed the data lake with the initial dataset so every reader can use it
+                        data = pd.read_csv(DATA_PATH)
+                        insert_dataframe(db, data)
+                        lake.write(data)
+                    else:
+                        # The lake already holds the cleaned bookings, including uploads that are not in DATA_PATH
+                        insert_frames(db, lake.iter_frames(columns=BOOKING_COLUMNS), source='data lake', total_rows=lake.count_rows())
+                    es_service.insert_bulk_data_from_db(index_name=ES_INDEX_NAME)
+                    if ES_ROLLUP_INDEX_NAME is not None:
+                        es_service.refresh_rollup(index_name=ES_ROLLUP_INDEX_NAME)
+                    set_sync_watermark(db, ES_INDEX_NAME, db.query(func.max(HotelBooking.updated_at)).scalar())
+                    bump_data_version(db)
+                    log_db.info("Initial data inserted into the database")
+                    flag = False
+                else:
+                    log_db.info("Initial data already inserted into the database")
+                    if rollup_created:
+                        # A new rollup index next to existing data has to be built before reports read it
+                        es_service.refresh_rollup(index_name=ES_ROLLUP_INDEX_NAME)
+
+        if needs_rebuild:
+            # Documents indexed before the derived fields existed are never re-sent by the incremental sync,
+            # so the reports reading them would undercount; rebuild the index once in the background
+            scheduler.add_job(timed_job('rebuild_search_index')(rebuild_search_index), id='rebuild_search_index')
+            log_es.info(f"Scheduled a rebuild of {ES_INDEX_NAME} to add the derived fields to existing documents")
+
+        if uses_columnar_backend():
+            # Build the columnar snapshot now so the first dashboard request does not pay for it
+            columnar_report_service.ensure_version(load_data_version())
 
     except Exception as e:
         log_api.error(f'Error during startup: {e}')
         raise e
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    await services.close()
@@ -0,0 +1,98 @@
+import time
+from functools import wraps
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, push_to_gateway
+from config import METRICS_SETTINGS
+from logger_setup import Logger
+
+log = Logger(__name__, './logs/api.log').get_logger()
+
+# Buckets in seconds, from cached report hits up to full bulk loads
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+JOB_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+REQUEST_LATENCY = Histogram(
+    'stayscope_http_request_duration_seconds', 'API request latency by route template',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS
+)
+ES_TOOK = Histogram(
+    'stayscope_es_took_seconds', 'Server-side search time reported by Elasticsearch (took)',
+    ['operation'], buckets=LATENCY_BUCKETS
+)
+ES_CLIENT_TIME = Histogram(
+    'stayscope_es_client_seconds', 'Elasticsearch request time observed by the client, including network and queueing',
+    ['operation'], buckets=LATENCY_BUCKETS
+)
+BULK_DOCUMENTS = Counter('stayscope_bulk_documents_total', 'Documents sent through bulk indexing', ['pipeline', 'result'])
+BULK_DURATION = Histogram('stayscope_bulk_duration_seconds', 'Duration of bulk indexing runs', ['pipeline'], buckets=JOB_BUCKETS)
+BULK_THROUGHPUT = Gauge('stayscope_bulk_docs_per_second', 'Throughput of the last bulk indexing run', ['pipeline'])
+ETL_ROWS = Counter('stayscope_etl_rows_total', 'Booking rows loaded by the ETL, inserted or skipped as duplicates', ['mode', 'result'])
+ETL_DURATION = Histogram('stayscope_etl_load_duration_seconds', 'Duration of ETL database loads', ['mode'], buckets=JOB_BUCKETS)
+DB_POOL_CONNECTIONS = Gauge('stayscope_db_pool_connections', 'Database connection pool usage', ['state'])
+JOB_DURATION = Histogram('stayscope_job_duration_seconds', 'Duration of scheduled jobs', ['job'], buckets=JOB_BUCKETS)
+JOB_FAILURES = Counter('stayscope_job_failures_total', 'Scheduled job runs that raised', ['job'])
+JOB_LAST_SUCCESS = Gauge('stayscope_job_last_success_timestamp_seconds', 'Unix time of the last successful run of a job', ['job'])
+
+
+def observe_request(method, route, status, seconds):
+    REQUEST_LATENCY.labels(method, route, str(status)).observe(seconds)
+
+def observe_es_request(operation, response, seconds):
+    """
+    Record client time next to the server's took for one search or msearch response;
+    a gap between the two is time spent on the network, in the client pool or in the queue.
+    """
+    ES_CLIENT_TIME.labels(operation).observe(seconds)
+    took = response.get('took') if response is not None else None
+    if took is not None:
+        ES_TOOK.labels(operation).observe(took / 1000)
+
+def observe_bulk(pipeline, stats):
+    BULK_DOCUMENTS.labels(pipeline, 'succeeded').inc(stats['succeeded'])
+    BULK_DOCUMENTS.labels(pipeline, 'failed').inc(stats['failed'])
+    BULK_DURATION.labels(pipeline).observe(stats['seconds'])
+    BULK_THROUGHPUT.labels(pipeline).set(stats['docs_per_sec'])
+
+def observe_etl_load(mode, rows, inserted, seconds):
+    ETL_ROWS.labels(mode, 'inserted').inc(inserted)
+    ETL_ROWS.labels(mode, 'duplicate').inc(rows - inserted)
+    ETL_DURATION.labels(mode).observe(seconds)
+
+def track_db_pool(pool_status):
+    """
+    Expose pool_status() (see models.pool_status) as gauges, read at scrape time.
+    """
+    for state in ('size', 'checked_out', 'overflow', 'idle'):
+        DB_POOL_CONNECTIONS.labels(state).set_function(lambda state=state: pool_status()[state])
+
+def timed_job(name):
+    """
+    Decorator for scheduler jobs recording their duration, failures and last success.
+    """
+    def decorator(job):
+        @wraps(job)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                result = job(*args, **kwargs)
+            except Exception:
+                JOB_FAILURES.labels(name).inc()
+                raise
+            finally:
+                JOB_DURATION.labels(name).observe(time.perf_counter() - start_time)
+            JOB_LAST_SUCCESS.labels(name).set_to_current_time()
+            return result
+        return wrapper
+    return decorator
+
+def push_metrics(job):
+    """
+    Push this process's metrics to the Pushgateway, for ETL runs outside the API process
+    (web app uploads, batch_etl.py) that /metrics cannot see. Does nothing without a configured gateway.
+    """
+    gateway = METRICS_SETTINGS.get('pushgateway')
+    if not gateway:
+        return
+    try:
+        push_to_gateway(gateway, job=job, registry=REGISTRY)
+    except Exception as e:
+        log.error(f'Error pushing metrics to {gateway}: {e}')
@@ -0,0 +1,20 @@
+"""
+Rebuild the bookings search index from Postgres without downtime.
+
+Usage (from the src folder, with config.py in place):
+
+    python rebuild_index.py
+
+Loads a new versioned index with bulk-friendly settings and swaps the ES_INDEX_NAME alias to it
+once it is complete, see ElasticsearchService.rebuild_index.
+"""
+import sys
+from main import rebuild_search_index
+
+
+if __name__ == '__main__':
+    stats = rebuild_search_index()
+    if stats is None:
+        print('Rebuild failed, the current index is still live (see logs/elasticsearch.log)')
+        sys.exit(1)
+    print(f"Indexed {stats['succeeded']} documents in {stats['seconds']} sec ({stats['docs_per_sec']} docs/sec)")
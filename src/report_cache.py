@@ -0,0 +1,196 @@
+import time, threading, json
+from collections import OrderedDict
+from starlette.concurrency import run_in_threadpool
+from models import load_data_version
+from config import REPORT_CACHE_SETTINGS, QUERY_CACHE_SETTINGS
+from logger_setup import Logger
+
+log = Logger(__name__, './logs/api.log').get_logger()
+
+class ReportCache(object):
+    """
+    In-process LRU cache with TTL for report results.
+    Entries are tagged with the data version stored in Postgres, which the sync and ETL load bump,
+    so every worker drops its results as soon as the underlying data changes.
+    """
+    def __init__(self, max_entries=256, ttl_seconds=3600, version_check_seconds=5, version_loader=load_data_version):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version_check_seconds = version_check_seconds
+        self.version_loader = version_loader
+        self.entries = OrderedDict()  # key -> (data_version, expires_at, value)
+        self.lock = threading.Lock()
+        self.version = None
+        self.version_checked_at = 0.0
+
+    def current_version(self):
+        # The data version is re-read at most every version_check_seconds
+        now = time.monotonic()
+        if self.version is None or now - self.version_checked_at >= self.version_check_seconds:
+            try:
+                self.version = self.version_loader()
+            except Exception as e:
+                log.error(f'Error reading data version, bypassing report cache: {e}')
+                return None
+            self.version_checked_at = now
+        return self.version
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            entry_version, expires_at, value = entry
+            if entry_version != version or expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, version, value):
+        with self.lock:
+            self.entries[key] = (version, time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.version = None
+
+    async def get_or_compute(self, key, compute, cacheable=None):
+        """
+        Return the cached value for key, or await compute() and cache its result unless it is None
+        or cacheable(result) is false.
+        """
+        version = await run_in_threadpool(self.current_version)
+        if version is not None:
+            value = self.get(key, version)
+            if value is not None:
+                return value
+        value = await compute()
+        if value is not None and version is not None and (cacheable is None or cacheable(value)):
+            self.set(key, version, value)
+        return value
+
+    async def get_or_compute_many(self, keys, compute_many):
+        """
+        Like get_or_compute for several keys at once: compute_many(missing_keys) is awaited
+        only for the keys not in the cache and must return a dict keyed the same way.
+        """
+        version = await run_in_threadpool(self.current_version)
+        results, missing = {}, []
+        for key in keys:
+            value = self.get(key, version) if version is not None else None
+            if value is None:
+                missing.append(key)
+            else:
+                results[key] = value
+        if missing:
+            computed = await compute_many(missing) or {}
+            for key in missing:
+                value = computed.get(key)
+                if value is not None and version is not None:
+                    self.set(key, version, value)
+                results[key] = value
+        return results
+
+
+def normalize_request(value):
+    """
+    Canonical form of a search or aggregation request: unset (None) and empty values dropped,
+    strings stripped and integral floats turned into ints. Run the normalized request, so equal
+    keys always mean equal queries.
+    """
+    if isinstance(value, dict):
+        normalized = {str(key): normalize_request(item) for key, item in value.items()}
+        return {key: item for key, item in normalized.items() if item is not None and item != {} and item != []}
+    if isinstance(value, (list, tuple)):
+        return [normalize_request(item) for item in value]
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def query_key(*parts):
+    # Sorted keys make requests that only differ in key order share an entry
+    return json.dumps([normalize_request(part) for part in parts], sort_keys=True, separators=(',', ':'), default=str)
+
+
+class QueryCache(ReportCache):
+    """
+    ReportCache for /search and /aggregate results, keyed on query_key of the normalized request.
+    Bounded by the approximate serialized size of the cached results rather than their count,
+    and counts hits, misses and evictions.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=600, version_check_seconds=5, version_loader=load_data_version):
+        super().__init__(ttl_seconds=ttl_seconds, version_check_seconds=version_check_seconds, version_loader=version_loader)
+        self.entries = OrderedDict()  # key -> (data_version, expires_at, value, size)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry_version, expires_at, value, size = entry
+                if entry_version == version and expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.total_bytes -= size
+            self.misses += 1
+            return None
+
+    def set(self, key, version, value):
+        size = len(key) + len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[3]
+            self.entries[key] = (version, time.monotonic() + self.ttl_seconds, value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted[3]
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            self.version = None
+
+    def get_or_compute_sync(self, key, compute, cacheable=None):
+        """
+        get_or_compute for synchronous callers such as the Streamlit app.
+        """
+        version = self.current_version()
+        if version is not None:
+            value = self.get(key, version)
+            if value is not None:
+                return value
+        value = compute()
+        if value is not None and version is not None and (cacheable is None or cacheable(value)):
+            self.set(key, version, value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+
+report_cache = ReportCache(**REPORT_CACHE_SETTINGS)
+query_cache = QueryCache(**QUERY_CACHE_SETTINGS)
@@ -0,0 +1,523 @@
+def format_composition(adults, children, babies):
+    # Same text the former painless script produced, e.g. "2 adults, 0.0 children, 0 babies"
+    return f"{adults} adults, {float(children)} children, {babies} babies"
+
+
+# Report aggregations served under /reports/*, keyed by the ENDPOINTS name in config.py.
+# Every entry holds the search body, the path to the result inside the ES response
+# and the message logged when the report fails.
+REPORT_QUERIES = {
+    "cancellation_rate": {
+        "error": "Error getting cancellation rate by market segment and hotel type",
+        "path": ["aggregations"],
+        "body": {
+            "size": 0,  # We don't need the actual documents, just the aggregations
+            "aggs": {
+                "market_segment": {
+                    "terms": {"field": "market_segment.keyword"},
+                    "aggs": {
+                        "hotel_type": {
+                            "terms": {"field": "hotel.keyword"},
+                            "aggs": {
+                                "cancellation_rate": {
+                                    "avg": {"field": "is_canceled"}
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "adr_by_month": {
+        "error": "Error getting ADR by month and hotel type",
+        "path": ["aggregations"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "months": {
+                    "date_histogram": {
+                        "field": "arrival_date",
+                        "calendar_interval": "month",
+                        "format": "yyyy-MM-dd"
+                    },
+                    "aggs": {
+                        "hotel_type": {
+                            "terms": {"field": "hotel.keyword"},
+                            "aggs": {
+                                "average_adr": {
+                                    "avg": {"field": "adr"}
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "top_countries": {
+        "error": "Error getting top countries with most bookings",
+        "path": ["aggregations", "top_countries", "buckets"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "top_countries": {
+                    "terms": {
+                        "field": "country.keyword",
+                        "size": 10
+                    }
+                }
+            }
+        }
+    },
+    "length_of_stay_distribution": {
+        "error": "Error getting simplified length of stay distribution",
+        "path": ["aggregations", "length_of_stay", "buckets"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "length_of_stay": {
+                    "terms": {
+                        "field": "total_nights",
+                        "size": 10  # Adjust the size as needed
+                    }
+                }
+            }
+        }
+    },
+    "booking_trends_over_time": {
+        "error": "Error getting booking trends over time",
+        "path": ["aggregations", "bookings_over_time", "buckets"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "bookings_over_time": {
+                    "date_histogram": {
+                        "field": "arrival_date",
+                        "calendar_interval": "month",
+                        "format": "yyyy-MM"
+                    }
+                }
+            }
+        }
+    },
+    "special_requests_impact_on_cancellations": {
+        "error": "Error getting impact of special requests on cancellations",
+        "path": ["aggregations", "special_requests", "buckets"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "special_requests": {
+                    "terms": {"field": "total_of_special_requests"},
+                    "aggs": {
+                        "cancellation_rate": {
+                            "avg": {"field": "is_canceled"}
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "average_lead_time_by_cancellation_status": {
+        "error": "Error getting average lead time by cancellation status",
+        "path": ["aggregations", "cancellation_status", "buckets"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "cancellation_status": {
+                    "terms": {"field": "is_canceled"},
+                    "aggs": {
+                        "average_lead_time": {
+                            "avg": {"field": "lead_time"}
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "bookings_distribution_by_room_type": {
+        "error": "Error getting bookings distribution by room type",
+        "path": ["aggregations", "room_types", "buckets"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "room_types": {
+                    "terms": {"field": "reserved_room_type.keyword"}
+                }
+            }
+        }
+    },
+    "bookings_by_guest_country": {
+        "error": "Error getting number of bookings by guest country",
+        "path": ["aggregations", "guest_countries", "buckets"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "guest_countries": {
+                    "terms": {
+                        "field": "country.keyword",
+                        "size": 10  # Adjust based on how many top countries you want to analyze
+                    }
+                }
+            }
+        }
+    },
+    "booking_source_analysis": {
+        "error": "Error getting booking source analysis",
+        "path": ["aggregations", "booking_sources", "buckets"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "booking_sources": {
+                    "terms": {
+                        "field": "distribution_channel.keyword",
+                        "size": 5  # Adjust based on the number of channels you want to analyze
+                    }
+                }
+            }
+        }
+    },
+    "revenue_analysis_by_room_and_month": {
+        "error": "Error getting revenue analysis by room type and month",
+        "path": ["aggregations", "room_types", "buckets"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "room_types": {
+                    "terms": {"field": "reserved_room_type.keyword"},
+                    "aggs": {
+                        "monthly_revenue": {
+                            "date_histogram": {
+                                "field": "arrival_date",
+                                "calendar_interval": "month",
+                                "format": "yyyy-MM",
+                                "min_doc_count": 1
+                            },
+                            "aggs": {
+                                "revenue": {
+                                    "sum": {"field": "revenue"}
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "impact_of_lead_time_on_adr": {
+        "error": "Error getting impact of lead time on ADR",
+        "path": ["aggregations", "lead_time_buckets", "buckets"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "lead_time_buckets": {
+                    "histogram": {
+                        "field": "lead_time",
+                        "interval": 10,  # Adjust the interval based on your data distribution
+                        "min_doc_count": 1
+                    },
+                    "aggs": {
+                        "average_adr": {
+                            "avg": {"field": "adr"}
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "analyze_repeat_guest_bookings": {
+        "error": "Error analyzing repeat guest bookings",
+        "path": ["aggregations"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "repeat_guests": {
+                    "terms": {
+                        "field": "is_repeated_guest",
+                        "size": 2  # 0 for new guests, 1 for repeat guests
+                    },
+                    "aggs": {
+                        "average_lead_time": {
+                            "avg": {
+                                "field": "lead_time"
+                            }
+                        },
+                        "bookings_by_country": {
+                            "terms": {
+                                "field": "country.keyword"
+                            }
+                        },
+                        "bookings_by_hotel_type": {
+                            "terms": {
+                                "field": "hotel.keyword"
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "correlate_adr_with_factors": {
+        "error": "Error correlating ADR with booking factors",
+        "path": ["aggregations"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "adr_correlation": {
+                    "terms": {
+                        "field": "adr",
+                        "order": {
+                            "_key": "asc"  # Order by ADR ascendingly
+                        }
+                    },
+                    "aggs": {
+                        "cancellation_rate": {
+                            "avg": {
+                                "field": "is_canceled"
+                            }
+                        },
+                        "average_stay_length": {
+                            "avg": {
+                                "field": "total_nights"
+                            }
+                        },
+                        "special_requests_count": {
+                            "avg": {
+                                "field": "total_of_special_requests"
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "correlate_cancelations_with_factors": {
+        "error": "Error correlating cancellations with booking factors",
+        "path": ["aggregations"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "cancellation_correlation": {
+                    "terms": {
+                        "field": "is_canceled",
+                        "size": 2  # 0 for not canceled, 1 for canceled
+                    },
+                    "aggs": {
+                        "average_lead_time": {
+                            "avg": {
+                                "field": "lead_time"
+                            }
+                        },
+                        "average_stay_length": {
+                            "avg": {
+                                "field": "total_nights"
+                            }
+                        },
+                        "special_requests_count": {
+                            "avg": {
+                                "field": "total_of_special_requests"
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "analyze_booking_composition": {
+        "error": "Error analyzing booking composition",
+        "path": ["aggregations"],
+        "body": {
+            "size": 0,
+            "aggs": {
+                "booking_composition": {
+                    "terms": {
+                        "field": "composition"
+                    },
+                    "aggs": {
+                        "average_lead_time": {
+                            "avg": {
+                                "field": "lead_time"
+                            }
+                        },
+                        "average_stay_length": {
+                            "avg": {
+                                "field": "total_nights"
+                            }
+                        },
+                        "special_requests_count": {
+                            "avg": {
+                                "field": "total_of_special_requests"
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+def rollup_bucket_aggs(*sums):
+    # Sums over the rollup metrics; rollup_bookings becomes the bucket's doc_count
+    aggs = {"rollup_bookings": {"sum": {"field": "bookings"}}}
+    for name, field in sums:
+        aggs[name] = {"sum": {"field": field}}
+    return aggs
+
+# Equivalent queries against the rollup index (see ElasticsearchService.refresh_rollup) for the reports
+# whose dimensions it keeps. Buckets are ordered by bookings rather than rollup document counts, and
+# "ratios" rebuilds averages as {"value": numerator / denominator} from the summed metrics.
+ROLLUP_QUERIES = {
+    "cancellation_rate": {
+        "ratios": {"cancellation_rate": ("rollup_canceled", "rollup_bookings")},
+        "body": {
+            "size": 0,
+            "aggs": {
+                "market_segment": {
+                    "terms": {"field": "market_segment", "order": {"rollup_bookings": "desc"}},
+                    "aggs": {
+                        "rollup_bookings": {"sum": {"field": "bookings"}},
+                        "hotel_type": {
+                            "terms": {"field": "hotel", "order": {"rollup_bookings": "desc"}},
+                            "aggs": rollup_bucket_aggs(("rollup_canceled", "canceled"))
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "adr_by_month": {
+        "ratios": {"average_adr": ("rollup_adr_sum", "rollup_adr_count")},
+        "body": {
+            "size": 0,
+            "aggs": {
+                "months": {
+                    "date_histogram": {
+                        "field": "arrival_date",
+                        "calendar_interval": "month",
+                        "format": "yyyy-MM-dd"
+                    },
+                    "aggs": {
+                        "rollup_bookings": {"sum": {"field": "bookings"}},
+                        "hotel_type": {
+                            "terms": {"field": "hotel", "order": {"rollup_bookings": "desc"}},
+                            "aggs": rollup_bucket_aggs(("rollup_adr_sum", "adr_sum"), ("rollup_adr_count", "adr_count"))
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "top_countries": {
+        "ratios": {},
+        "body": {
+            "size": 0,
+            "aggs": {
+                "top_countries": {
+                    "terms": {"field": "country", "size": 10, "order": {"rollup_bookings": "desc"}},
+                    "aggs": rollup_bucket_aggs()
+                }
+            }
+        }
+    },
+    "booking_trends_over_time": {
+        "ratios": {},
+        "body": {
+            "size": 0,
+            "aggs": {
+                "bookings_over_time": {
+                    "date_histogram": {
+                        "field": "arrival_date",
+                        "calendar_interval": "month",
+                        "format": "yyyy-MM"
+                    },
+                    "aggs": rollup_bucket_aggs()
+                }
+            }
+        }
+    },
+    "bookings_distribution_by_room_type": {
+        "ratios": {},
+        "body": {
+            "size": 0,
+            "aggs": {
+                "room_types": {
+                    "terms": {"field": "reserved_room_type", "order": {"rollup_bookings": "desc"}},
+                    "aggs": rollup_bucket_aggs()
+                }
+            }
+        }
+    },
+    "bookings_by_guest_country": {
+        "ratios": {},
+        "body": {
+            "size": 0,
+            "aggs": {
+                "guest_countries": {
+                    "terms": {"field": "country", "size": 10, "order": {"rollup_bookings": "desc"}},
+                    "aggs": rollup_bucket_aggs()
+                }
+            }
+        }
+    },
+    "revenue_analysis_by_room_and_month": {
+        "ratios": {},
+        "body": {
+            "size": 0,
+            "aggs": {
+                "room_types": {
+                    "terms": {"field": "reserved_room_type", "order": {"rollup_bookings": "desc"}},
+                    "aggs": {
+                        "rollup_bookings": {"sum": {"field": "bookings"}},
+                        "monthly_revenue": {
+                            "date_histogram": {
+                                "field": "arrival_date",
+                                "calendar_interval": "month",
+                                "format": "yyyy-MM",
+                                "min_doc_count": 1
+                            },
+                            "aggs": {
+                                "rollup_bookings": {"sum": {"field": "bookings"}},
+                                "revenue": {"sum": {"field": "revenue_sum"}}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+def reshape_rollup(node, ratios):
+    """
+    Rewrite rollup buckets in place into the shape the raw-index report returns:
+    doc_count becomes the number of bookings, ratios are computed and rollup_* helpers dropped.
+    Terms-level totals such as sum_other_doc_count still count rollup documents.
+    """
+    if isinstance(node, list):
+        for item in node:
+            reshape_rollup(item, ratios)
+    elif isinstance(node, dict):
+        if "rollup_bookings" in node and "doc_count" in node:
+            node["doc_count"] = int(node["rollup_bookings"]["value"] or 0)
+            for output, (numerator, denominator) in ratios.items():
+                if numerator in node and denominator in node:
+                    divisor = node[denominator]["value"]
+                    node[output] = {"value": node[numerator]["value"] / divisor if divisor else None}
+            for key in [key for key in node if key.startswith("rollup_")]:
+                del node[key]
+        for value in node.values():
+            reshape_rollup(value, ratios)
+
+
+def extract_report(response, name, rollup=False):
+    """
+    Pull the part of a search response that the report named name returns to clients.
+    """
+    if rollup:
+        reshape_rollup(response["aggregations"], ROLLUP_QUERIES[name]["ratios"])
+    result = response
+    for key in REPORT_QUERIES[name]["path"]:
+        result = result[key]
+    return result
@@ -35,6 +35,8 @@ class SearchQueryParams(BaseModel):
     exclude_fields: Optional[Dict[str, Any]] = None  # New field for must_not conditions
     optional_fields: Optional[Dict[str, Any]] = None  # New field for should conditions
     range_fields: Optional[Dict[str, Dict[str, Any]]] = None  # New field for range queries
+    page_size: Optional[int] = None  # Hits per page, defaults to ES_SEARCH_SETTINGS['page_size']
+    cursor: Optional[str] = None  # next_cursor of the previous page, the other fields are ignored when set
 
 class AggregationField(BaseModel):
     field: str
@@ -54,10 +56,16 @@ class SuggestQueryParams(BaseModel):
 class SearchResult(BaseModel):
     hits: List[Dict[str, Any]]
     total: int
+    next_cursor: Optional[str] = None
 
 class AggregationResult(BaseModel):
     aggregations: Any
 
+class Facet(BaseModel):
+    values: List[Any] = []
+    min: Optional[Any] = None
+    max: Optional[Any] = None
+
 
 class Trend(BaseModel):
     time_bucket: str
@@ -0,0 +1,54 @@
+import threading
+from config import ELASTICSEARCH_SETTINGS
+from elasticsearch_operations import ElasticsearchService, AsyncElasticsearchService
+from models import engine
+from logger_setup import Logger
+
+log = Logger(__name__, './logs/api.log').get_logger()
+
+
+class Services(object):
+    """
+    Process-wide clients shared by the API, the scheduler, the ETL and the web app.
+    Each Elasticsearch client keeps one pool of keep-alive connections (ES_CLIENT_SETTINGS) and
+    Postgres sessions come from the single pooled engine in models (DATABASE_POOL_SETTINGS),
+    so callers reuse connections instead of opening new ones per job or request.
+    Clients are created on first use and closed once on shutdown.
+    """
+    def __init__(self, es_settings=ELASTICSEARCH_SETTINGS):
+        self.es_settings = es_settings
+        self.lock = threading.Lock()
+        self._es = None
+        self._async_es = None
+
+    @property
+    def es(self) -> ElasticsearchService:
+        # The synchronous client is thread safe, so scheduler jobs and ETL threads share it
+        with self.lock:
+            if self._es is None:
+                self._es = ElasticsearchService(self.es_settings)
+            return self._es
+
+    @property
+    def async_es(self) -> AsyncElasticsearchService:
+        with self.lock:
+            if self._async_es is None:
+                self._async_es = AsyncElasticsearchService(self.es_settings)
+            return self._async_es
+
+    async def close(self):
+        with self.lock:
+            es, async_es = self._es, self._async_es
+            self._es = self._async_es = None
+        try:
+            if async_es is not None:
+                await async_es.close()
+            if es is not None:
+                es.close()
+            engine.dispose()
+            log.info('Closed Elasticsearch clients and database connections')
+        except Exception as e:
+            log.error(f'Error closing services: {e}')
+
+
+services = Services()
@@ -0,0 +1,264 @@
+from datetime import date, datetime, timezone
+from sqlalchemy import func, select
+from models import HotelBooking, SessionLocal
+from report_queries import format_composition
+from logger_setup import Logger
+
+log = Logger(__name__, './logs/db.log').get_logger()
+
+nights = HotelBooking.stays_in_weekend_nights + HotelBooking.stays_in_week_nights
+arrival_month = func.date_trunc('month', HotelBooking.arrival_date)
+
+
+def value(number):
+    return {"value": float(number) if number is not None else None}
+
+def terms(buckets, size=10, order_by_key=False):
+    """
+    Shape buckets ({"key", "doc_count", ...}) like an Elasticsearch terms aggregation:
+    doc_count descending (key ascending on ties) or key ascending, cut to size.
+    """
+    if order_by_key:
+        ordered = sorted(buckets, key=lambda bucket: bucket["key"])
+    else:
+        ordered = sorted(buckets, key=lambda bucket: (-bucket["doc_count"], bucket["key"]))
+    return {
+        "doc_count_error_upper_bound": 0,
+        "sum_other_doc_count": sum(bucket["doc_count"] for bucket in ordered[size:]),
+        "buckets": ordered[:size]
+    }
+
+def month_histogram(buckets_by_month, date_format, fill_gaps=True, empty_bucket=dict):
+    """
+    Shape {month start: bucket} like a calendar-month date_histogram. With fill_gaps (min_doc_count 0)
+    missing months between the first and last one are added as empty buckets, as Elasticsearch does.
+    """
+    months = sorted(month for month in buckets_by_month if month is not None)
+    if fill_gaps and months:
+        first, last, months = months[0], months[-1], []
+        year, month = first.year, first.month
+        while (year, month) <= (last.year, last.month):
+            months.append(date(year, month, 1))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    buckets = []
+    for month in months:
+        bucket = buckets_by_month.get(month) or dict(empty_bucket(), doc_count=0)
+        key = int(datetime(month.year, month.month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+        buckets.append({"key_as_string": month.strftime(date_format), "key": key, **bucket})
+    return {"buckets": buckets}
+
+def to_month(value):
+    return date(value.year, value.month, 1) if value is not None else None
+
+
+class SQLReportService(object):
+    """
+    Report backend that answers the /reports/* queries with GROUP BY queries against Postgres.
+    Results have the same shapes as AsyncElasticsearchService.run_report, so the API and DataVisualizer
+    can use either store, e.g. while Elasticsearch is down or being reindexed.
+    """
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+
+    def run_report(self, name, index_name=None):
+        builder = getattr(self, f'report_{name}')
+        db = self.session_factory()
+        try:
+            return builder(db)
+        except Exception as e:
+            log.error(f'Error getting {name} report from the database: {e}')
+            return None
+        finally:
+            db.close()
+
+    def report_cancellation_rate(self, db):
+        # A segment's doc_count also counts its rows without a hotel, like the ES terms aggregation
+        segment_counts = db.execute(
+            select(HotelBooking.market_segment, func.count())
+            .where(HotelBooking.market_segment.isnot(None))
+            .group_by(HotelBooking.market_segment)
+        ).all()
+        rows = db.execute(
+            select(HotelBooking.market_segment, HotelBooking.hotel, func.count(), func.avg(HotelBooking.is_canceled))
+            .where(HotelBooking.market_segment.isnot(None), HotelBooking.hotel.isnot(None))
+            .group_by(HotelBooking.market_segment, HotelBooking.hotel)
+        ).all()
+        segments = {}
+        for segment, hotel, count, rate in rows:
+            segments.setdefault(segment, []).append({"key": hotel, "doc_count": count, "cancellation_rate": value(rate)})
+        buckets = [
+            {"key": segment, "doc_count": count, "hotel_type": terms(segments.get(segment, []))}
+            for segment, count in segment_counts
+        ]
+        return {"market_segment": terms(buckets)}
+
+    def report_adr_by_month(self, db):
+        month_counts = db.execute(
+            select(arrival_month, func.count()).where(HotelBooking.arrival_date.isnot(None)).group_by(arrival_month)
+        ).all()
+        rows = db.execute(
+            select(arrival_month, HotelBooking.hotel, func.count(), func.avg(HotelBooking.adr))
+            .where(HotelBooking.arrival_date.isnot(None), HotelBooking.hotel.isnot(None))
+            .group_by(arrival_month, HotelBooking.hotel)
+        ).all()
+        months = {}
+        for month, hotel, count, adr in rows:
+            months.setdefault(to_month(month), []).append({"key": hotel, "doc_count": count, "average_adr": value(adr)})
+        buckets = {
+            to_month(month): {"doc_count": count, "hotel_type": terms(months.get(to_month(month), []))}
+            for month, count in month_counts
+        }
+        return {"months": month_histogram(buckets, '%Y-%m-%d', empty_bucket=lambda: {"hotel_type": terms([])})}
+
+    def count_by(self, db, column, size=10):
+        rows = db.execute(select(column, func.count()).where(column.isnot(None)).group_by(column)).all()
+        return terms([{"key": key, "doc_count": count} for key, count in rows], size=size)["buckets"]
+
+    def report_top_countries(self, db):
+        return self.count_by(db, HotelBooking.country)
+
+    def report_length_of_stay_distribution(self, db):
+        return self.count_by(db, nights)
+
+    def report_booking_trends_over_time(self, db):
+        rows = db.execute(
+            select(arrival_month, func.count()).where(HotelBooking.arrival_date.isnot(None)).group_by(arrival_month)
+        ).all()
+        buckets = {to_month(month): {"doc_count": count} for month, count in rows}
+        return month_histogram(buckets, '%Y-%m')["buckets"]
+
+    def report_special_requests_impact_on_cancellations(self, db):
+        rows = db.execute(
+            select(HotelBooking.total_of_special_requests, func.count(), func.avg(HotelBooking.is_canceled))
+            .where(HotelBooking.total_of_special_requests.isnot(None))
+            .group_by(HotelBooking.total_of_special_requests)
+        ).all()
+        return terms([{"key": key, "doc_count": count, "cancellation_rate": value(rate)} for key, count, rate in rows])["buckets"]
+
+    def report_average_lead_time_by_cancellation_status(self, db):
+        rows = db.execute(
+            select(HotelBooking.is_canceled, func.count(), func.avg(HotelBooking.lead_time))
+            .where(HotelBooking.is_canceled.isnot(None))
+            .group_by(HotelBooking.is_canceled)
+        ).all()
+        return terms([{"key": key, "doc_count": count, "average_lead_time": value(lead_time)} for key, count, lead_time in rows])["buckets"]
+
+    def report_bookings_distribution_by_room_type(self, db):
+        return self.count_by(db, HotelBooking.reserved_room_type)
+
+    def report_bookings_by_guest_country(self, db):
+        return self.count_by(db, HotelBooking.country)
+
+    def report_booking_source_analysis(self, db):
+        return self.count_by(db, HotelBooking.distribution_channel, size=5)
+
+    def report_revenue_analysis_by_room_and_month(self, db):
+        room_counts = self.count_by(db, HotelBooking.reserved_room_type)
+        rows = db.execute(
+            select(HotelBooking.reserved_room_type, arrival_month, func.count(), func.sum(HotelBooking.adr * nights))
+            .where(HotelBooking.reserved_room_type.isnot(None), HotelBooking.arrival_date.isnot(None))
+            .group_by(HotelBooking.reserved_room_type, arrival_month)
+        ).all()
+        rooms = {}
+        for room, month, count, revenue in rows:
+            rooms.setdefault(room, {})[to_month(month)] = {"doc_count": count, "revenue": {"value": float(revenue or 0)}}
+        buckets = [
+            {
+                "key": room["key"],
+                "doc_count": room["doc_count"],
+                "monthly_revenue": month_histogram(rooms.get(room["key"], {}), '%Y-%m', fill_gaps=False)
+            }
+            for room in room_counts
+        ]
+        return terms(buckets)["buckets"]
+
+    def report_impact_of_lead_time_on_adr(self, db):
+        lead_time_bucket = func.floor(HotelBooking.lead_time / 10.0) * 10
+        rows = db.execute(
+            select(lead_time_bucket, func.count(), func.avg(HotelBooking.adr))
+            .where(HotelBooking.lead_time.isnot(None))
+            .group_by(lead_time_bucket)
+            .order_by(lead_time_bucket)
+        ).all()
+        return [{"key": float(key), "doc_count": count, "average_adr": value(adr)} for key, count, adr in rows]
+
+    def report_analyze_repeat_guest_bookings(self, db):
+        guest = HotelBooking.is_repeated_guest
+        summary = db.execute(
+            select(guest, func.count(), func.avg(HotelBooking.lead_time)).where(guest.isnot(None)).group_by(guest)
+        ).all()
+        countries = db.execute(
+            select(guest, HotelBooking.country, func.count())
+            .where(guest.isnot(None), HotelBooking.country.isnot(None))
+            .group_by(guest, HotelBooking.country)
+        ).all()
+        hotels = db.execute(
+            select(guest, HotelBooking.hotel, func.count())
+            .where(guest.isnot(None), HotelBooking.hotel.isnot(None))
+            .group_by(guest, HotelBooking.hotel)
+        ).all()
+        buckets = []
+        for key, count, lead_time in summary:
+            buckets.append({
+                "key": key,
+                "doc_count": count,
+                "average_lead_time": value(lead_time),
+                "bookings_by_country": terms([{"key": country, "doc_count": n} for g, country, n in countries if g == key]),
+                "bookings_by_hotel_type": terms([{"key": hotel, "doc_count": n} for g, hotel, n in hotels if g == key])
+            })
+        return {"repeat_guests": terms(buckets, size=2)}
+
+    def booking_factors(self, db, *group_by):
+        return db.execute(
+            select(
+                *group_by,
+                func.count(),
+                func.avg(HotelBooking.lead_time),
+                func.avg(HotelBooking.is_canceled),
+                func.avg(nights),
+                func.avg(HotelBooking.total_of_special_requests)
+            )
+            .where(*[column.isnot(None) for column in group_by])
+            .group_by(*group_by)
+        ).all()
+
+    def report_correlate_adr_with_factors(self, db):
+        buckets = [
+            {
+                "key": float(adr),
+                "doc_count": count,
+                "cancellation_rate": value(rate),
+                "average_stay_length": value(stay),
+                "special_requests_count": value(requests)
+            }
+            for adr, count, lead_time, rate, stay, requests in self.booking_factors(db, HotelBooking.adr)
+        ]
+        return {"adr_correlation": terms(buckets, order_by_key=True)}
+
+    def report_correlate_cancelations_with_factors(self, db):
+        buckets = [
+            {
+                "key": key,
+                "doc_count": count,
+                "average_lead_time": value(lead_time),
+                "average_stay_length": value(stay),
+                "special_requests_count": value(requests)
+            }
+            for key, count, lead_time, rate, stay, requests in self.booking_factors(db, HotelBooking.is_canceled)
+        ]
+        return {"cancellation_correlation": terms(buckets, size=2)}
+
+    def report_analyze_booking_composition(self, db):
+        buckets = [
+            {
+                "key": format_composition(adults, children, babies),
+                "doc_count": count,
+                "average_lead_time": value(lead_time),
+                "average_stay_length": value(stay),
+                "special_requests_count": value(requests)
+            }
+            for adults, children, babies, count, lead_time, rate, stay, requests
+            in self.booking_factors(db, HotelBooking.adults, HotelBooking.children, HotelBooking.babies)
+        ]
+        return {"booking_composition": terms(buckets)}
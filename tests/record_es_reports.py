@@ -0,0 +1,48 @@
+"""
+Record the Elasticsearch side of test_report_parity.py: index fixtures/bookings.csv into a throwaway index
+with the bookings mapping, run every report in REPORT_QUERIES against it and write the results to fixtures/es_reports.json.
+
+Usage (from the repository root, with config.py in place and Elasticsearch running):
+
+    python tests/record_es_reports.py
+"""
+import json, sys
+from pathlib import Path
+
+import pandas as pd
+
+FIXTURES_PATH = Path(__file__).resolve().parent / 'fixtures'
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+from elasticsearch import Elasticsearch, helpers
+from config import ELASTICSEARCH_SETTINGS
+from elasticsearch_operations import BOOKING_INDEX_MAPPING, add_derived_fields
+from report_queries import REPORT_QUERIES, extract_report
+
+INDEX_NAME = 'stayscope-report-parity'
+
+
+def fixture_documents(path):
+    frame = pd.read_csv(path)
+    records = frame.astype(object).where(frame.notna(), None).to_dict('records')
+    for position, record in enumerate(records):
+        yield {"_index": INDEX_NAME, "_id": position, "_source": add_derived_fields(record)}
+
+
+if __name__ == '__main__':
+    es = Elasticsearch([{
+        'host': ELASTICSEARCH_SETTINGS['host'],
+        'port': ELASTICSEARCH_SETTINGS['port'],
+        'scheme': ELASTICSEARCH_SETTINGS['scheme']
+    }], basic_auth=ELASTICSEARCH_SETTINGS['auth'])
+    es.options(ignore_status=404).indices.delete(index=INDEX_NAME)
+    es.indices.create(index=INDEX_NAME, mappings=BOOKING_INDEX_MAPPING["mappings"])
+    try:
+        helpers.bulk(es, fixture_documents(FIXTURES_PATH / 'bookings.csv'), refresh='wait_for')
+        reports = {name: extract_report(es.search(index=INDEX_NAME, body=query["body"]).body, name) for name, query in REPORT_QUERIES.items()}
+    finally:
+        es.indices.delete(index=INDEX_NAME)
+    with open(FIXTURES_PATH / 'es_reports.json', 'w') as f:
+        json.dump(reports, f, indent=2)
+        f.write('\n')
+    print(f'Recorded {len(reports)} reports to {FIXTURES_PATH / "es_reports.json"}')
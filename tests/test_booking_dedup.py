@@ -0,0 +1,98 @@
+"""
+Booking hashes, the Bloom filter and the deduplicating load (see models.BookingDeduplicator).
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import models
+from models import (
+    BloomFilter, HotelBooking, booking_content_hashes, booking_hash_parts, coerce_booking_frame,
+    format_booking_hashes, parse_booking_hashes, insert_dataframe, ensure_booking_hashes
+)
+
+
+def synthetic_bookings(rows, offset=0, seed=0):
+    # Distinct bookings: lead_time is unique per row, the other columns vary like real data
+    rng = np.random.default_rng(seed)
+    return coerce_booking_frame(pd.DataFrame({
+        'hotel': rng.choice(['City Hotel', 'Resort Hotel'], rows),
+        'country': rng.choice(['PRT', 'GBR', 'FRA', 'ESP'], rows),
+        'lead_time': np.arange(offset, offset + rows),
+        'adr': rng.integers(0, 300, rows).astype(float),
+        'arrival_date': '2016-01-01'
+    }))
+
+@pytest.fixture
+def db(test_engine):
+    session = sessionmaker(bind=test_engine)()
+    yield session
+    session.close()
+    with test_engine.begin() as connection:
+        connection.execute(text(f'TRUNCATE {HotelBooking.__tablename__}'))
+
+
+def test_hash_halves_are_independent():
+    frame = synthetic_bookings(10000)
+    c1, c2 = booking_content_hashes(frame)
+    h1, h2, _ = booking_hash_parts(frame)
+    assert not (c1 == c2).any()
+    assert not (h1 == h2).any()
+    assert len(set(format_booking_hashes(h1, h2))) == len(frame)
+
+def test_hashes_round_trip_through_their_text_form():
+    h1, h2, _ = booking_hash_parts(synthetic_bookings(100))
+    p1, p2 = parse_booking_hashes(format_booking_hashes(h1, h2))
+    assert (p1 == h1).all() and (p2 == h2).all()
+
+def test_identical_bookings_get_distinct_reproducible_hashes():
+    frame = pd.concat([synthetic_bookings(3)] * 4, ignore_index=True)
+    hashes = format_booking_hashes(*booking_hash_parts(frame)[:2])
+    assert len(set(hashes)) == len(frame)
+    assert (format_booking_hashes(*booking_hash_parts(frame)[:2]) == hashes).all()
+
+def test_chunked_hashing_matches_one_pass():
+    frame = pd.concat([synthetic_bookings(50)] * 3, ignore_index=True)
+    whole = format_booking_hashes(*booking_hash_parts(frame)[:2])
+    chunks, seen = [], None
+    for start in range(0, len(frame), 40):
+        h1, h2, seen = booking_hash_parts(frame.iloc[start:start + 40], seen)
+        chunks.append(format_booking_hashes(h1, h2))
+    assert (np.concatenate(chunks) == whole).all()
+
+def test_bloom_filter_has_no_false_negatives():
+    h1, h2, _ = booking_hash_parts(synthetic_bookings(5000))
+    bloom = BloomFilter(len(h1), 0.01)
+    bloom.add(h1, h2)
+    assert bloom.might_contain(h1, h2).all()
+
+def test_bloom_filter_false_positive_rate_meets_its_target():
+    rows, target = 20000, 0.01
+    h1, h2, _ = booking_hash_parts(synthetic_bookings(rows))
+    bloom = BloomFilter(rows, target)
+    bloom.add(h1, h2)
+    p1, p2, _ = booking_hash_parts(synthetic_bookings(rows, offset=10 ** 6, seed=1))
+    assert bloom.might_contain(p1, p2).mean() <= target * 1.5
+
+
+@pytest.mark.parametrize('bloom_min_rows', [1, 10 ** 9])
+def test_reloading_the_same_bookings_inserts_nothing(db, monkeypatch, bloom_min_rows):
+    monkeypatch.setitem(models.DEDUP_SETTINGS, 'bloom_min_rows', bloom_min_rows)
+    frame = pd.concat([synthetic_bookings(200)] * 2, ignore_index=True)
+    assert insert_dataframe(db, frame, chunk_size=150) == len(frame)
+    assert insert_dataframe(db, frame, chunk_size=150) == 0
+    # Only the bookings that are new are inserted, identical ones included
+    more = pd.concat([frame, synthetic_bookings(10, offset=10 ** 6)], ignore_index=True)
+    assert insert_dataframe(db, more, chunk_size=150) == 10
+    assert db.execute(text(f'SELECT count(*) FROM {HotelBooking.__tablename__}')).scalar() == len(frame) + 10
+
+def test_backfilled_hashes_move_the_sync_watermark(db):
+    table = HotelBooking.__tablename__
+    insert_dataframe(db, synthetic_bookings(50), dedupe=False)
+    db.execute(text(f"UPDATE {table} SET updated_at = now() - interval '1 day'"))
+    db.commit()
+    assert ensure_booking_hashes(db, chunk_size=20) == 50
+    stale = db.execute(text(f"SELECT count(*) FROM {table} WHERE booking_hash IS NULL OR updated_at < now() - interval '1 hour'")).scalar()
+    assert stale == 0
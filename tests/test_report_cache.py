@@ -0,0 +1,106 @@
+"""
+ReportCache and QueryCache: data version invalidation, TTL and their size bounds.
+"""
+import asyncio
+
+from report_cache import ReportCache, QueryCache, normalize_request, query_key
+from elasticsearch_operations import is_last_page
+
+
+class DataVersion(object):
+    def __init__(self):
+        self.value = 1
+
+    def __call__(self):
+        return self.value
+
+def compute(value):
+    async def run():
+        return value
+    return run
+
+
+def test_report_cache_keeps_the_most_recently_used_entries():
+    cache = ReportCache(max_entries=2, version_loader=DataVersion())
+    cache.set('a', 1, 'A')
+    cache.set('b', 1, 'B')
+    assert cache.get('a', 1) == 'A'
+    cache.set('c', 1, 'C')
+    assert list(cache.entries) == ['a', 'c']
+
+def test_report_cache_drops_entries_of_an_older_data_version_or_past_their_ttl():
+    cache = ReportCache(version_loader=DataVersion())
+    cache.set('a', 1, 'A')
+    assert cache.get('a', 2) is None and 'a' not in cache.entries
+    expiring = ReportCache(ttl_seconds=0, version_loader=DataVersion())
+    expiring.set('a', 1, 'A')
+    assert expiring.get('a', 1) is None
+
+def test_report_cache_rereads_the_data_version_after_the_check_interval():
+    version = DataVersion()
+    cache = ReportCache(version_check_seconds=3600, version_loader=version)
+    assert cache.current_version() == 1
+    version.value = 2
+    assert cache.current_version() == 1
+    cache.version_check_seconds = 0
+    assert cache.current_version() == 2
+
+def test_report_cache_is_bypassed_while_the_data_version_is_unreadable():
+    def unreadable():
+        raise RuntimeError('database down')
+    cache = ReportCache(version_loader=unreadable)
+    assert asyncio.run(cache.get_or_compute('a', compute('A'))) == 'A'
+    assert not cache.entries
+
+def test_report_cache_computes_only_the_missing_reports():
+    cache = ReportCache(version_loader=DataVersion())
+    cache.set('a', 1, 'A')
+    requested = []
+    async def compute_many(names):
+        requested.extend(names)
+        return {name: name.upper() for name in names}
+    assert asyncio.run(cache.get_or_compute_many(['a', 'b'], compute_many)) == {'a': 'A', 'b': 'B'}
+    assert requested == ['b'] and cache.get('b', 1) == 'B'
+
+
+def test_query_cache_serves_until_the_data_version_changes():
+    version = DataVersion()
+    cache = QueryCache(version_check_seconds=0, version_loader=version)
+    assert asyncio.run(cache.get_or_compute('q', compute({"total": 1}))) == {"total": 1}
+    assert asyncio.run(cache.get_or_compute('q', compute({"total": 2}))) == {"total": 1}
+    version.value = 2
+    assert asyncio.run(cache.get_or_compute('q', compute({"total": 2}))) == {"total": 2}
+    assert cache.stats()["hits"] == 1
+
+def test_query_cache_entries_expire():
+    cache = QueryCache(ttl_seconds=0, version_loader=DataVersion())
+    cache.get_or_compute_sync('q', lambda: 'old')
+    assert cache.get_or_compute_sync('q', lambda: 'new') == 'new'
+
+def test_query_cache_evicts_least_recently_used_beyond_max_bytes():
+    value = 'x' * 100
+    cache = QueryCache(max_bytes=350, version_loader=DataVersion())
+    for key in ('a', 'b', 'c'):
+        cache.get_or_compute_sync(key, lambda: value)
+    cache.get('a', 1)
+    cache.get_or_compute_sync('d', lambda: value)
+    assert list(cache.entries) == ['c', 'a', 'd']
+    assert cache.total_bytes <= cache.max_bytes and cache.stats()["evictions"] == 1
+    # A result larger than the whole cache is returned but not kept
+    assert cache.get_or_compute_sync('e', lambda: 'x' * 1000) == 'x' * 1000
+    assert 'e' not in cache.entries
+
+def test_search_pages_with_a_cursor_are_not_cached():
+    cache = QueryCache(version_loader=DataVersion())
+    first = {"hits": [], "total": 30, "next_cursor": "pit-bearing"}
+    assert cache.get_or_compute_sync('search', lambda: first, cacheable=is_last_page) == first
+    assert 'search' not in cache.entries
+    last = {"hits": [], "total": 3, "next_cursor": None}
+    assert asyncio.run(cache.get_or_compute('search', compute(last), cacheable=is_last_page)) == last
+    assert cache.get('search', 1) == last
+
+def test_equal_requests_share_a_key():
+    first = normalize_request({"hotel": " City Hotel ", "adr": 100.0, "country": None, "range_fields": {}})
+    second = normalize_request({"adr": 100, "hotel": "City Hotel"})
+    assert first == second
+    assert query_key('search', 'bookings', first) == query_key('search', 'bookings', second)
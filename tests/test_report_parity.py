@@ -0,0 +1,66 @@
+"""
+Parity of the report backends on one shared fixture (fixtures/bookings.csv): the columnar and SQL backends
+must return what Elasticsearch returns for the same bookings, recorded in fixtures/es_reports.json.
+Re-record it with tests/record_es_reports.py after changing a query in report_queries.
+
+The SQL backend runs against the scratch Postgres in STAYSCOPE_TEST_DATABASE_URL (see conftest.py).
+"""
+import json
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from conftest import FIXTURES_PATH
+from columnar_reports import ColumnarSnapshot, ColumnarReportService
+from sql_reports import SQLReportService
+from report_queries import REPORT_QUERIES
+from models import insert_dataframe
+
+REPORT_NAMES = list(REPORT_QUERIES)
+
+
+@pytest.fixture(scope='module')
+def es_reports():
+    with open(FIXTURES_PATH / 'es_reports.json') as f:
+        return json.load(f)
+
+@pytest.fixture(scope='module')
+def columnar_report_service(bookings):
+    return ColumnarReportService(snapshot_loader=lambda data_version=None: ColumnarSnapshot(bookings, data_version))
+
+@pytest.fixture(scope='module')
+def sql_report_service(test_engine, bookings):
+    session_factory = sessionmaker(bind=test_engine)
+    db = session_factory()
+    try:
+        insert_dataframe(db, bookings, dedupe=False)
+    finally:
+        db.close()
+    return SQLReportService(session_factory=session_factory)
+
+def assert_same(result, expected, path='report'):
+    # Floats (averages, sums) are compared approximately, everything else exactly
+    if isinstance(expected, dict):
+        assert isinstance(result, dict) and result.keys() == expected.keys(), path
+        for key in expected:
+            assert_same(result[key], expected[key], f'{path}.{key}')
+    elif isinstance(expected, list):
+        assert isinstance(result, list) and len(result) == len(expected), path
+        for position, (item, expected_item) in enumerate(zip(result, expected)):
+            assert_same(item, expected_item, f'{path}[{position}]')
+    elif isinstance(expected, float):
+        assert result == pytest.approx(expected), path
+    else:
+        assert result == expected, path
+
+
+def test_every_report_is_recorded(es_reports):
+    assert set(es_reports) == set(REPORT_NAMES)
+
+@pytest.mark.parametrize('name', REPORT_NAMES)
+def test_columnar_matches_elasticsearch(name, columnar_report_service, es_reports):
+    assert_same(columnar_report_service.run_report(name), es_reports[name])
+
+@pytest.mark.parametrize('name', REPORT_NAMES)
+def test_sql_matches_elasticsearch(name, sql_report_service, es_reports):
+    assert_same(sql_report_service.run_report(name), es_reports[name])
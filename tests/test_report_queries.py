@@ -0,0 +1,40 @@
+"""
+Rollup responses reshaped into the raw-index report shapes (see report_queries.reshape_rollup).
+"""
+from report_queries import extract_report, reshape_rollup
+
+
+def rollup_bucket(key, rollup_docs, bookings, canceled):
+    return {
+        "key": key, "doc_count": rollup_docs,
+        "rollup_bookings": {"value": float(bookings)}, "rollup_canceled": {"value": float(canceled)}
+    }
+
+
+def test_buckets_count_bookings_and_get_their_ratios():
+    node = {"buckets": [rollup_bucket("City Hotel", 3, 40, 10), rollup_bucket("Resort Hotel", 2, 0, 0)]}
+    reshape_rollup(node, {"cancellation_rate": ("rollup_canceled", "rollup_bookings")})
+    assert node["buckets"] == [
+        {"key": "City Hotel", "doc_count": 40, "cancellation_rate": {"value": 0.25}},
+        {"key": "Resort Hotel", "doc_count": 0, "cancellation_rate": {"value": None}},
+    ]
+
+def test_nodes_without_rollup_counts_are_left_alone():
+    node = {"doc_count": 5, "rollup_note": "kept", "sum_other_doc_count": 2}
+    reshape_rollup(node, {})
+    assert node == {"doc_count": 5, "rollup_note": "kept", "sum_other_doc_count": 2}
+
+def test_rollup_report_matches_the_raw_report_shape():
+    segment = {
+        "key": "Online TA", "doc_count": 4, "rollup_bookings": {"value": 60.0},
+        "hotel_type": {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0, "buckets": [
+            rollup_bucket("City Hotel", 3, 40, 10), rollup_bucket("Resort Hotel", 1, 20, 5)
+        ]}
+    }
+    response = {"aggregations": {"market_segment": {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0, "buckets": [segment]}}}
+    report = extract_report(response, "cancellation_rate", rollup=True)
+    segment = report["market_segment"]["buckets"][0]
+    assert segment["doc_count"] == 60 and "rollup_bookings" not in segment
+    assert [(bucket["key"], bucket["doc_count"], bucket["cancellation_rate"]["value"]) for bucket in segment["hotel_type"]["buckets"]] == [
+        ("City Hotel", 40, 0.25), ("Resort Hotel", 20, 0.25)
+    ]
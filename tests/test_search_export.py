@@ -0,0 +1,36 @@
+"""
+Streaming export of search results (/search/export): one encoded chunk per Elasticsearch batch.
+"""
+import asyncio, csv, io, json
+
+from api_routes import encode_export_batch, export_search_results
+
+
+def hit(**source):
+    return {"_source": dict(source, hotel_suggest={"input": source.get("hotel")})}
+
+async def batches(*hit_lists):
+    for hits in hit_lists:
+        yield hits
+
+def collect(stream):
+    async def run():
+        return b''.join([chunk async for chunk in stream])
+    return asyncio.run(run())
+
+
+def test_ndjson_batches_leave_out_the_suggest_fields():
+    chunk, _ = encode_export_batch([hit(id=1, hotel="City Hotel"), hit(id=2, hotel="Resort Hotel")], 'ndjson')
+    assert [json.loads(line) for line in chunk.decode().splitlines()] == [
+        {"id": 1, "hotel": "City Hotel"}, {"id": 2, "hotel": "Resort Hotel"}
+    ]
+
+def test_csv_header_comes_from_the_first_batch_only():
+    first, fieldnames = encode_export_batch([hit(id=1, hotel="City Hotel")], 'csv')
+    later, same = encode_export_batch([hit(id=2, hotel="Resort Hotel", extra="dropped")], 'csv', fieldnames)
+    assert fieldnames == same == ['id', 'hotel']
+    assert list(csv.reader(io.StringIO((first + later).decode()))) == [['id', 'hotel'], ['1', 'City Hotel'], ['2', 'Resort Hotel']]
+
+def test_export_streams_every_batch():
+    stream = export_search_results([hit(id=1)], batches([hit(id=2)], [hit(id=3)]), 'ndjson')
+    assert [json.loads(line)["id"] for line in collect(stream).decode().splitlines()] == [1, 2, 3]
@@ -0,0 +1,58 @@
+"""
+Cursor paging helpers shared by ElasticsearchService.search_page and AsyncElasticsearchService.search_page.
+"""
+import pytest
+
+from elasticsearch_operations import (
+    SEARCH_SORT, build_search_page, decode_cursor, encode_cursor, parse_search_page, search_page_request, start_search_page
+)
+
+
+def search_response(count, pit_id='pit-2', total=250):
+    hits = [{"_id": str(position), "sort": [1.0, position, position]} for position in range(count)]
+    return {"pit_id": pit_id, "hits": {"hits": hits, "total": {"value": total}}}
+
+
+def test_cursor_round_trips():
+    state = {"params": {"hotel": "City Hotel"}, "pit_id": "pit-1", "search_after": [1.0, 7, 12], "page_size": 50}
+    assert decode_cursor(encode_cursor(state)) == state
+
+@pytest.mark.parametrize('cursor', ['not base64!', encode_cursor(['a list']), encode_cursor({"params": {}})])
+def test_foreign_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_new_search_starts_without_point_in_time_and_bounds_page_size():
+    state, page_size = start_search_page({"hotel": "City Hotel"}, page_size=10 ** 6)
+    assert state == {"params": {"hotel": "City Hotel"}, "pit_id": None, "search_after": None}
+    assert page_size == 1000
+
+def test_cursor_carries_query_and_page_size():
+    cursor = encode_cursor({"params": {"country": "PRT"}, "pit_id": "pit-1", "search_after": [1.0, 3, 3], "page_size": 20})
+    state, page_size = start_search_page({"ignored": True}, page_size=5, cursor=cursor)
+    assert state["params"] == {"country": "PRT"} and state["search_after"] == [1.0, 3, 3]
+    assert page_size == 20
+
+def test_page_body_pins_point_in_time_and_continues_after_sort_values():
+    body = build_search_page({"country": "PRT"}, "pit-1", 20, [1.0, 3, 3])
+    assert body["pit"]["id"] == "pit-1" and body["search_after"] == [1.0, 3, 3]
+    assert body["size"] == 20 and body["sort"] == SEARCH_SORT and body["track_total_hits"] is True
+
+def test_point_in_time_requests_do_not_name_the_index():
+    state = {"params": {}, "pit_id": "pit-1", "search_after": None}
+    assert set(search_page_request('bookings', state, 20)) == {"body"}
+    state["pit_id"] = None
+    assert search_page_request('bookings', state, 20)["index"] == 'bookings'
+
+def test_full_page_returns_cursor_on_latest_point_in_time():
+    state = {"params": {"country": "PRT"}, "pit_id": "pit-1", "search_after": None}
+    page = parse_search_page(search_response(20), state, 20)
+    assert len(page["hits"]) == 20 and page["total"] == 250
+    assert state["pit_id"] == 'pit-2'
+    assert decode_cursor(page["next_cursor"]) == {
+        "params": {"country": "PRT"}, "pit_id": "pit-2", "search_after": [1.0, 19, 19], "page_size": 20
+    }
+
+def test_short_page_is_the_last():
+    state = {"params": {}, "pit_id": "pit-1", "search_after": [1.0, 19, 19]}
+    assert parse_search_page(search_response(7), state, 20)["next_cursor"] is None
@@ -0,0 +1,57 @@
+"""
+Search, facet and aggregation request bodies built from the bookings mapping, and their parsing.
+"""
+from elasticsearch_operations import (
+    BOOKING_INDEX_MAPPING, DOCUMENTS_VERSION, build_search_query, documents_meta, needs_document_rebuild, parse_facets
+)
+
+PROPERTIES = BOOKING_INDEX_MAPPING["mappings"]["properties"]
+
+
+def test_exact_conditions_run_in_filter_context():
+    query = build_search_query({"country": "PRT", "lead_time": 30, "customer_type": ["Transient", "Group"]}, PROPERTIES)
+    assert query["query"]["bool"]["filter"] == [
+        {"term": {"country.keyword": "PRT"}},
+        {"term": {"lead_time": 30}},
+        {"terms": {"customer_type.keyword": ["Transient", "Group"]}},
+    ]
+    assert query["query"]["bool"]["must"] == []
+
+def test_unknown_and_text_only_fields_stay_scored_matches():
+    query = build_search_query({"notes": "late arrival"}, PROPERTIES)
+    assert query["query"]["bool"]["must"] == [{"match": {"notes": "late arrival"}}]
+    assert build_search_query({"country": "PRT"})["query"]["bool"]["must"] == [{"match": {"country": "PRT"}}]
+
+def test_control_fields_and_unset_values_are_not_conditions():
+    params = {"country": None, "cursor": "abc", "page_size": 20, "range_fields": {"adr": {"gte": 50, "lt": 100}}}
+    query = build_search_query(params, PROPERTIES)["query"]["bool"]
+    assert query["must"] == []
+    assert query["filter"] == [{"range": {"adr": {"gte": 50, "lt": 100}}}]
+
+def test_excluded_and_optional_fields():
+    params = {"exclude_fields": {"hotel": "Resort Hotel"}, "optional_fields": {"meal": "BB", "country": "PRT"}}
+    query = build_search_query(params, PROPERTIES)["query"]["bool"]
+    assert query["must_not"] == [{"term": {"hotel.keyword": "Resort Hotel"}}]
+    assert query["should"] == [{"term": {"meal.keyword": "BB"}}, {"term": {"country.keyword": "PRT"}}]
+    assert query["minimum_should_match"] == 1
+
+def test_facet_values_use_the_formatted_keys_of_date_buckets():
+    response = {"aggregations": {
+        "reservation_status_date_values": {"buckets": [
+            {"key": 1435708800000, "key_as_string": "2015-07-01", "doc_count": 3}
+        ]},
+        "is_canceled_values": {"buckets": [{"key": 0, "doc_count": 5}, {"key": 1, "doc_count": 2}]},
+        "arrival_date_min": {"value": 1435708800000, "value_as_string": "2015-07-01"},
+        "arrival_date_max": {"value": 1504137600000, "value_as_string": "2017-08-31"},
+    }}
+    facets = parse_facets(response, ['reservation_status_date', 'is_canceled'], ['arrival_date'])
+    assert facets['reservation_status_date']['values'] == ['2015-07-01']
+    assert facets['is_canceled']['values'] == [0, 1]
+    assert facets['arrival_date'] == {"values": [], "min": "2015-07-01", "max": "2017-08-31"}
+
+def test_only_indices_marked_by_a_completed_rebuild_are_current():
+    # put_mapping adds the derived fields to an old index long before its documents have them
+    properties = {"total_nights": {"type": "integer"}, "revenue": {"type": "float"}}
+    assert needs_document_rebuild({"mappings": {"properties": properties}})
+    assert needs_document_rebuild({"mappings": {"properties": properties, "_meta": {"documents_version": DOCUMENTS_VERSION - 1}}})
+    assert not needs_document_rebuild({"mappings": {"properties": properties, "_meta": documents_meta()}})
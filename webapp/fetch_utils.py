@@ -14,29 +14,56 @@ from pathlib import Path
 # Add the parent directory to the Python path.
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-from src.config import HOST, ENDPOINTS
+from src.config import HOST, ENDPOINTS, DASHBOARD_ENDPOINT, FACETS_ENDPOINT
 from src.llm_model import AsyncTextGenerator
 
+# Seconds before a dashboard request (all reports in one msearch) or a single report request gives up
+DASHBOARD_TIMEOUT = 30.0
+REPORT_TIMEOUT = 15.0
+
 class DataFetcher:
     def __init__(self):
         self.host = HOST
         self.endpoints = ENDPOINTS
         self.report_endpoints = ["".join([self.host, i]) for i in self.endpoints.values()]
+        self.dashboard_endpoint = "".join([self.host, DASHBOARD_ENDPOINT])
+        self.facets_endpoint = "".join([self.host, FACETS_ENDPOINT])
 
     async def fetch_data_async(self, url):
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
+        try:
+            async with httpx.AsyncClient(timeout=REPORT_TIMEOUT) as client:
+                response = await client.get(url)
+        except httpx.HTTPError:
+            response = None
+        if response is not None and response.status_code == 200:
+            return response.json()
+        st.error(f"Failed to fetch data from {url}.")
+        return None
+
+    async def fetch_all_data_async(self):
+        # All reports in a single request; fall back to one request per report if it fails or times out
+        try:
+            async with httpx.AsyncClient(timeout=DASHBOARD_TIMEOUT) as client:
+                response = await client.get(self.dashboard_endpoint, params={"reports": list(self.endpoints.keys())})
             if response.status_code == 200:
                 return response.json()
-            else:
-                st.error(f"Failed to fetch data from {url}.")
-                return None
+        except httpx.HTTPError:
+            pass
 
-    async def fetch_all_data_async(self):
         tasks = [self.fetch_data_async(url) for url in self.report_endpoints]
         results = await asyncio.gather(*tasks)
         return dict(zip(self.endpoints.keys(), results))
 
+    def fetch_facets(self, fields, range_fields):
+        # Distinct values and min/max for the search form, None if the API is unavailable
+        try:
+            response = httpx.get(self.facets_endpoint, params={"fields": fields, "range_fields": range_fields})
+        except httpx.HTTPError:
+            return None
+        if response.status_code == 200:
+            return response.json()
+        return None
+
 class DataVisualizer:
     def __init__(self, data):
         self.data = data
@@ -18,10 +18,13 @@ from webapp.fetch_utils import DataFetcher, DataVisualizer
 #change the path to the src folder of the project to use config.py
 sys.path.append(str(Path(__file__).resolve().parents[2]))
 
-from src.config import ELASTICSEARCH_SETTINGS, ES_INDEX_NAME, DATA_PATH, TMP_PATH, TMP_CSV_FILENAME, DATA_FOLDER_PATH
-from src.elasticsearch_operations import ElasticsearchService
+from src.config import ES_INDEX_NAME, DATA_PATH, TMP_PATH, TMP_CSV_FILENAME, DATA_LAKE_PATH
+from src.services import services
 from src.llm_model import AsyncTextGenerator
 from src.etl_utils import ETLUtils
+from src.data_lake import DataLake
+from src.report_cache import query_cache, normalize_request, query_key
+from src.elasticsearch_operations import is_last_page
 from src.main import sync_sql_to_elasticsearch
 
 
@@ -41,6 +44,34 @@ def inject_custom_css():
     """
     st.markdown(custom_css, unsafe_allow_html=True)
 
+def lake_version():
+    #newest modification time in the data lake, changes whenever an upload writes a batch
+    if not os.path.isdir(DATA_LAKE_PATH):
+        return None
+    return max((os.path.getmtime(os.path.join(root, f)) for root, _, files in os.walk(DATA_LAKE_PATH) for f in files), default=None)
+
+@st.cache_data(show_spinner=False)
+def load_search_options(fields, range_fields, version):
+    #same shape as the /facets response, used when the API cannot be reached
+    lake = DataLake(DATA_LAKE_PATH)
+    columns = list(dict.fromkeys(fields + range_fields))
+    data = pd.read_csv(DATA_PATH, usecols=columns) if lake.is_empty() else lake.read(columns=columns)
+    facets = {}
+    for field in columns:
+        values = data[field].dropna()
+        facets[field] = {
+            "values": sorted(values.unique().tolist()) if field in fields else [],
+            "min": str(values.min()) if field in range_fields else None,
+            "max": str(values.max()) if field in range_fields else None
+        }
+    return facets
+
+def search_results_frame(result):
+    # Extracting source data and creating DataFrame
+    df = pd.DataFrame([hit['_source'] for hit in result['hits']])
+    #excluding the id and the completion suggester columns
+    return df.drop(columns=['id', 'hotel_suggest', 'country_suggest', 'reservation_status_suggest'], errors='ignore')
+
 def streamlit_main():
     st.set_page_config(layout="wide", page_title="Hotel Bookings", page_icon="📈")
     generator = AsyncTextGenerator()
@@ -91,7 +122,7 @@ def streamlit_main():
 
         subtab1, subtab2 = st.tabs(["Search", "Aggregation"])
         
-        es_service = ElasticsearchService(config=ELASTICSEARCH_SETTINGS)
+        es_service = services.es
 
         with subtab1:
 
@@ -103,14 +134,6 @@ def streamlit_main():
             # Define search parameters
             search_params = {}
 
-            data = pd.read_csv(DATA_PATH)
-
-            #choose latest csv file from data folder
-            csv_files = [f for f in glob.glob(DATA_FOLDER_PATH + '*') if os.path.isfile(f)]
-            if csv_files:  # Check if there are any csv files
-                latest_file = max(csv_files, key=os.path.getctime)
-                data_uploaded = pd.read_csv(latest_file)
-
             #create TMP_PATH if it does not exist
             if not os.path.exists(TMP_PATH):
                 os.makedirs(TMP_PATH)
@@ -122,6 +145,12 @@ def streamlit_main():
             reservation_fields = ['reserved_room_type', 'booking_changes', 'deposit_type', 'customer_type']
             other_fields = ['meal', 'total_of_special_requests', 'reservation_status', 'reservation_status_date']
 
+            #distinct values and the arrival date range come from the cached /facets endpoint
+            option_fields = [field for field in general_fields + booking_fields + reservation_fields + other_fields if field != 'arrival_date']
+            facets = fetcher.fetch_facets(option_fields, ['arrival_date'])
+            if facets is None:
+                facets = load_search_options(option_fields, ['arrival_date'], lake_version())
+
 
             # Provide clear instructions for each group
             # with st.expander("General Information"):
@@ -135,15 +164,15 @@ def streamlit_main():
             with st.expander("General Information"):
                 for field in general_fields:
                     if field == 'arrival_date':
-                        min_date = pd.to_datetime(data['arrival_date']).min()
-                        max_date = pd.to_datetime(data_uploaded['arrival_date']).max()
+                        min_date = pd.to_datetime(facets['arrival_date']['min'])
+                        max_date = pd.to_datetime(facets['arrival_date']['max'])
                         # Set a default date within the range, e.g., the min_date
                         default_date = min_date
                         arrival_date = st.date_input("Arrival Date", value=default_date, min_value=min_date, max_value=max_date)
                         if arrival_date:
                             search_params[field] = arrival_date.strftime('%Y-%m-%d')  # Adjust the format as per your data
                     else:
-                        unique_values = set(data[field])
+                        unique_values = facets[field]['values']
                         if unique_values:
                             value = st.selectbox(f"{field.capitalize()}", [''] + sorted(unique_values))
                             if value:
@@ -152,7 +181,7 @@ def streamlit_main():
 
             with st.expander("Booking Details"):
                 for field in booking_fields:
-                    unique_values = set(data[field])
+                    unique_values = facets[field]['values']
                     if unique_values:
                         value = st.selectbox(f"{field.capitalize()}", [''] + sorted(unique_values))
                         if value:
@@ -160,7 +189,7 @@ def streamlit_main():
 
             with st.expander("Reservation Details"):
                 for field in reservation_fields:
-                    unique_values = set(data[field])
+                    unique_values = facets[field]['values']
                     if unique_values:
                         value = st.selectbox(f"{field.capitalize()}", [''] + sorted(unique_values))
                         if value:
@@ -168,37 +197,46 @@ def streamlit_main():
 
             with st.expander("Other Information"):
                 for field in other_fields:
-                    unique_values = set(data[field])
+                    unique_values = facets[field]['values']
                     if unique_values:
                         value = st.selectbox(f"{field.capitalize()}", [''] + sorted(unique_values))
                         if value:
                             search_params[field] = value
 
             
-            # Execute search query
-            if st.button('Search'):
-                result = es_service.search_query_command(ES_INDEX_NAME, search_params)
+            # Execute search query, one page at a time; the next page continues from the cursor of the current one
+            def load_search_page(result, page_number):
+                st.session_state.search_result = result
+                st.session_state.search_page_number = page_number
                 if result:
-                    hits = result['hits']['hits']
-                    total_hits = result['hits']['total']['value']
-                    st.header("Search Results")
-                    st.write(f"Total hits: {total_hits}")
-
-                    # Extracting source data and creating DataFrame
-                    source_data = [hit['_source'] for hit in hits]
-                    df = pd.DataFrame(source_data)
-                    #excluding the last 3 columns
-                    df = df.iloc[:, 1:-3]                                    
-                    #dataframe should be displayed in a scrollable container for all rows
-                    st.dataframe(df)
-                    
                     #save as json with timestamp
                     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
                     json_filename = f"{TMP_CSV_FILENAME}_{timestamp}.json"
                     json_path = os.path.join(TMP_PATH, json_filename)
-                    df.to_json(json_path)
+                    search_results_frame(result).to_json(json_path)
 
-                    
+            def load_next_search_page():
+                result = es_service.search_page(ES_INDEX_NAME, cursor=st.session_state.search_result['next_cursor'])
+                load_search_page(result, st.session_state.search_page_number + 1)
+
+            if st.button('Search'):
+                params = normalize_request(search_params)
+                result = query_cache.get_or_compute_sync(
+                    query_key('search', ES_INDEX_NAME, params, None),
+                    lambda: es_service.search_page(ES_INDEX_NAME, params),
+                    cacheable=is_last_page
+                )
+                load_search_page(result, 1)
+
+            if 'search_result' in st.session_state:
+                result = st.session_state.search_result
+                if result:
+                    st.header("Search Results")
+                    st.write(f"Total hits: {result['total']} (page {st.session_state.search_page_number})")
+                    #dataframe should be displayed in a scrollable container for all rows
+                    st.dataframe(search_results_frame(result))
+                    if result['next_cursor']:
+                        st.button('Next page', on_click=load_next_search_page)
                 else:
                     st.write("Search failed or no results found.")
                     
@@ -239,8 +277,11 @@ def streamlit_main():
             # Button to submit all aggregation specifications
             if st.button("Aggregate"):
                 if st.session_state.aggregations:
-                    agg_params = {"aggregations": st.session_state.aggregations}
-                    result = es_service.dynamic_aggregation_query(ES_INDEX_NAME, agg_params)
+                    agg_params = normalize_request({"aggregations": st.session_state.aggregations})
+                    result = query_cache.get_or_compute_sync(
+                        query_key('aggregate', ES_INDEX_NAME, agg_params),
+                        lambda: es_service.dynamic_aggregation_query(ES_INDEX_NAME, agg_params)
+                    )
                     
                     # Assuming this is within the "if st.button('Aggregate'):" block
                     if result and "aggregations" in result:
@@ -307,7 +348,13 @@ def streamlit_main():
         uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
         if uploaded_file is not None:
             etl_utils = ETLUtils()  # Create an instance of ETLUtils
-            _, success_flag = etl_utils.run_etl_flow(uploaded_file)  # Call run_etl_flow on the instance
+            progress_bar = st.progress(0.0, text="Inserting data into the database...")
+
+            def update_progress(rows_done, total_rows):
+                if total_rows:
+                    progress_bar.progress(min(rows_done / total_rows, 1.0), text=f"Inserted {rows_done} of {total_rows} rows")
+
+            _, success_flag = etl_utils.run_etl_flow(uploaded_file, progress_callback=update_progress)  # Call run_etl_flow on the instance
             if success_flag:
                 st.success("Data uploaded successfully")
                 #start timer to sync data to elasticsearch